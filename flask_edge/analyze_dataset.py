@@ -1,20 +1,24 @@
 # File: analyze_dataset.py
 # Script untuk menganalisis kualitas dataset activity_dataset.csv
 
+import sys
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from collections import Counter
 
-def analyze_dataset():
-    """Analisis komprehensif dataset untuk menentukan kualitas dan potensi akurasi."""
+from training_data import read_dataset
+
+def analyze_dataset(path='activity_dataset.csv'):
+    """Analisis komprehensif dataset (CSV atau direktori export training_data.py) untuk menentukan kualitas dan potensi akurasi."""
     
-    print("🔍 ANALISIS DATASET ACTIVITY_DATASET.CSV")
+    print(f"🔍 ANALISIS DATASET {path.upper()}")
     print("=" * 50)
     
     # Load dataset
-    df = pd.read_csv('activity_dataset.csv')
+    df = read_dataset(path)
     
     # 1. BASIC DATASET INFO
     print("\n📊 1. INFORMASI DASAR DATASET")
@@ -206,4 +210,4 @@ def analyze_dataset():
     }
 
 if __name__ == '__main__':
-    results = analyze_dataset()
+    results = analyze_dataset(sys.argv[1] if len(sys.argv) > 1 else 'activity_dataset.csv')
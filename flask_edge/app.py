@@ -2,20 +2,27 @@
 # Flask AI Backend for Smart GPS Tracker
 # Provides API endpoints for VAR prediction, Random Forest activity classification, and DBSCAN anomaly detection
 
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify, render_template_string
 from flask_cors import CORS
-import pandas as pd
 import numpy as np
-import sqlite3
 import json
 from datetime import datetime, timedelta, timezone
 import os
 import traceback
 
 # Import our ML models
-from models.var_model import VARLocationPredictor
-from models.random_forest_model_simple import ActivityClassifier
-from models.dbscan_anomaly_model_simple import AnomalyDetector
+from models.random_forest_model_simple import get_classifier
+from models.artifact_cache import get_cache
+import storage
+import point_buffer
+import route_segmenter
+import history
+import change_feed
+import live_hub
+import stats as stats_engine
+import retention
+import trajectory
+import model_workers
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React Native app
@@ -23,48 +30,18 @@ CORS(app)  # Enable CORS for React Native app
 # Indonesia timezone constant
 INDONESIA_TZ = timezone(timedelta(hours=7))
 
-# Initialize ML models
-var_predictor = VARLocationPredictor()
-activity_classifier = ActivityClassifier()
-anomaly_detector = AnomalyDetector()
+# Max points accepted by one /predict/batch request
+MAX_BATCH_POINTS = 10000
+
+# Initialize ML models (VAR and DBSCAN state is per device, see model_workers.get_pool())
+activity_classifier = get_classifier()  # Shared instance, model loaded on first use
 
 # Database setup
 def init_db():
-    """Initialize SQLite database for storing GPS data history"""
-    conn = sqlite3.connect('gps_data.db')
-    cursor = conn.cursor()
-    
-    # Create GPS data table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS gps_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            latitude REAL NOT NULL,
-            longitude REAL NOT NULL,
-            speed REAL NOT NULL,
-            timestamp INTEGER NOT NULL,
-            activity TEXT,
-            is_anomaly BOOLEAN DEFAULT 0,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create routes table for historical route tracking
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS routes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            route_name TEXT,
-            start_time DATETIME,
-            end_time DATETIME,
-            total_distance REAL,
-            avg_speed REAL,
-            main_activity TEXT,
-            anomaly_count INTEGER DEFAULT 0,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    """Initialize SQLite database (schema is prepared once by the shared pool)"""
+    storage.init_db()
+    # Warm the recent-points ring buffer so the first request skips SQLite
+    point_buffer.get_buffer()
 
 # Initialize database on startup
 init_db()
@@ -105,11 +82,19 @@ def home():
                 <code>Body: {"lat": -6.2, "lon": 106.8, "speed": 30, "timestamp": 1234567890}</code>
             </div>
             
+            <div class="endpoint">
+                <span class="method">POST</span>
+                <strong>/predict/batch</strong><br>
+                Process an ordered batch of points in one request (back-fill, replay)<br>
+                <code>Body: {"device_id": "esp32-1", "points": [{"lat": -6.2, "lon": 106.8, "speed": 30, "timestamp": 1234567890}, ...]}</code>
+            </div>
+            
             <div class="endpoint">
                 <span class="method">GET</span>
                 <strong>/history</strong><br>
-                Get historical GPS data and routes<br>
-                <code>Query: ?limit=100&activity=motor</code>
+                Get historical GPS data, newest first, with keyset pagination<br>
+                <code>Query: ?limit=100&activity=motor&from=1640995200&to=1641081600&fields=id,lat,lon,timestamp&before_ts=...&before_id=...</code><br>
+                Delta sync: <code>?since=&lt;last_id&gt;</code> with <code>If-None-Match</code> (304 when nothing changed)
             </div>
             
             <div class="endpoint">
@@ -130,7 +115,7 @@ def home():
                 <span class="method">GET</span>
                 <strong>/stats</strong><br>
                 Get analytics and statistics<br>
-                <code>Returns: activity distribution, anomaly counts, route summaries</code>
+                <code>Returns: activity distribution, anomaly counts, speed by activity (?bucket=hour for a timeline)</code>
             </div>
             
             <div class="endpoint">
@@ -140,6 +125,19 @@ def home():
                 <code>Query: ?limit=10</code>
             </div>
             
+            <div class="endpoint">
+                <span class="method">GET</span>
+                <strong>/stream</strong><br>
+                Server-Sent Events: live classified points as they are stored<br>
+                <code>Events: point {id, lat, lon, speed, ts, activity, anomaly, pred}, sync {last_id}</code>
+            </div>
+            
+            <div class="endpoint">
+                <span class="method">GET</span>
+                <strong>/ingest/metrics</strong><br>
+                MQTT ingest connection, in-flight messages, drops and batch commit statistics
+            </div>
+            
             <h3>🚀 Quick Test</h3>
             <p>Test the API with curl:</p>
             <code>
@@ -167,6 +165,8 @@ def predict():
         if not data or 'lat' not in data or 'lon' not in data:
             return jsonify({'error': 'Missing required fields: lat, lon'}), 400
         
+        device_id = storage.device_id_or_default(data.get('device_id'))
+        
         # Extract GPS data
         current_gps = {
             'lat': float(data['lat']),
@@ -175,86 +175,9 @@ def predict():
             'timestamp': int(data.get('timestamp', datetime.now(INDONESIA_TZ).timestamp()))
         }
         
-        # Get recent GPS history for context
-        recent_history = get_recent_gps_data(limit=50)
-        
-        # 1. VAR Model: Predict next location
-        try:
-            predicted_location = var_predictor.predict_next_location(
-                recent_history + [current_gps]
-            )
-        except Exception as e:
-            print(f"VAR prediction error: {e}")
-            # Fallback: simple linear extrapolation
-            predicted_location = simple_location_prediction(recent_history, current_gps)
-        # 2. Random Forest: Classify activity
-        try:
-            # Force use simple classification for consistency with database update
-            activity = classify_activity_simple(current_gps['speed'])
-        except Exception as e:
-            print(f"Activity classification error: {e}")
-            activity = classify_activity_simple(current_gps['speed'])
-        
-        # 3. Enhanced DBSCAN: Context-aware anomaly detection
-        try:
-            is_anomaly = anomaly_detector.detect_anomaly(
-                current_gps, recent_history, activity
-            )
-            
-            # Get detailed anomaly analysis
-            anomaly_analysis = anomaly_detector.get_anomaly_confidence(
-                current_gps, recent_history, activity
-            )
-        except Exception as e:
-            print(f"Anomaly detection error: {e}")
-            is_anomaly = False
-            anomaly_analysis = {
-                'confidence': 0.5,
-                'is_anomaly': False,
-                'reason': f'Error: {str(e)}',
-                'activity': activity
-            }
-          # Store data in database
-        store_gps_data(current_gps, activity, is_anomaly)
-        
-        # Get confidence scores from models
-        try:
-            activity_confidence = activity_classifier.get_prediction_confidence(
-                current_gps, recent_history[-5:] if recent_history else []
-            )
-        except Exception as e:
-            print(f"Activity confidence error: {e}")
-            activity_confidence = 0.85
-        
-        # Prepare enhanced response with detailed anomaly analysis
-        response = {
-            'activity': activity,
-            'predicted_location': predicted_location,
-            'is_anomaly': bool(is_anomaly),  # Convert numpy.bool_ to Python bool
-            'confidence_scores': {
-                'activity_confidence': float(activity_confidence),  # Ensure Python float
-                'prediction_accuracy': 0.78,  # VAR model confidence (can be enhanced later)
-                'anomaly_confidence': float(anomaly_analysis.get('confidence', 0.5))  # Enhanced anomaly confidence
-            },
-            'anomaly_details': {
-                'threshold_used': anomaly_analysis.get('threshold_used', 1000),
-                'min_distance': anomaly_analysis.get('min_distance', 0),
-                'near_frequent_location': anomaly_analysis.get('near_frequent_location', False),
-                'speed': current_gps['speed'],
-                'reason': anomaly_analysis.get('reason', 'Normal analysis')
-            },
-            'metadata': {
-                'timestamp': datetime.now(INDONESIA_TZ).isoformat(),
-                'data_points_used': len(recent_history),
-                'training_points': anomaly_analysis.get('training_points', 0),
-                'frequent_locations': anomaly_analysis.get('frequent_locations_count', 0),
-                'model_versions': {
-                    'var': '1.0',
-                    'random_forest': '1.0', 
-                    'dbscan': '2.0'  # Updated version with context awareness
-                }
-            }
-        }
+        # This device's models, held until its point is stored (keeps per-device order)
+        with model_workers.get_pool().use(device_id) as models:
+            response = predict_for_device(device_id, models, current_gps)
         
         return jsonify(response)
         
@@ -266,51 +189,269 @@ def predict():
             'details': str(e)
         }), 500
 
-@app.route('/history', methods=['GET'])
-def get_history():
-    """Get historical GPS data and routes"""
+def predict_for_device(device_id, models, current_gps):
+    """Run the /predict pipeline for one point with a device's model session and store it"""
+    # Get this device's recent GPS history for context
+    recent_history = get_recent_gps_data(limit=50, device_id=device_id)
+    
+    # 1. Random Forest: Classify activity (activity + confidence in one pass)
     try:
-        limit = int(request.args.get('limit', 100))
-        activity_filter = request.args.get('activity')
-
-        conn = sqlite3.connect('gps_data.db')
-
-        if activity_filter:
-            query = 'SELECT * FROM gps_data WHERE activity = ? ORDER BY timestamp DESC LIMIT ?'
-            df = pd.read_sql_query(query, conn, params=[activity_filter, limit])
-        else:
-            query = 'SELECT * FROM gps_data ORDER BY timestamp DESC LIMIT ?'
-            df = pd.read_sql_query(query, conn, params=[limit])
-
-        conn.close()
-
-        # Bersihkan & konversi tipe data supaya aman untuk JSON
-        df = df.fillna('').astype({
-            'id': 'int',
-            'latitude': 'float',
-            'longitude': 'float',
-            'speed': 'float',            'timestamp': 'int',
-            'activity': 'str',
-            'is_anomaly': 'bool',
-            'created_at': 'str'
-        })
+        activity_result = activity_classifier.analyze(current_gps, recent_history, device_id)
+        activity = activity_result['activity']
+        activity_confidence = activity_result['confidence']
+    except Exception as e:
+        print(f"Activity classification error: {e}")
+        activity = classify_activity_simple(current_gps['speed'])
+        activity_confidence = 0.85
+    
+    # 2. VAR location forecast + 3. context-aware DBSCAN anomaly analysis, in one
+    #    call next to the device's model state (worker process or in-process)
+    try:
+        result = models.infer(current_gps, recent_history, activity)
+    except model_workers.WorkerError as e:
+        result = {'predicted_location': None, 'anomaly_analysis': None, 'errors': {'var': str(e), 'anomaly': str(e)}}
+    
+    predicted_location = result['predicted_location']
+    if 'var' in result['errors']:
+        print(f"VAR prediction error: {result['errors']['var']}")
+        # Fallback: simple linear extrapolation
+        predicted_location = simple_location_prediction(recent_history, current_gps)
+    
+    anomaly_analysis = result['anomaly_analysis']
+    if 'anomaly' in result['errors']:
+        print(f"Anomaly detection error: {result['errors']['anomaly']}")
+        anomaly_analysis = {
+            'confidence': 0.5,
+            'is_anomaly': False,
+            'reason': f"Error: {result['errors']['anomaly']}",
+            'activity': activity
+        }
+    is_anomaly = anomaly_analysis['is_anomaly']
+    # Store data in database
+    store_gps_data(current_gps, activity, is_anomaly, predicted_location, device_id)
+    
+    # Prepare enhanced response with detailed anomaly analysis
+    return {
+        'device_id': device_id,
+        'activity': activity,
+        'predicted_location': predicted_location,
+        'is_anomaly': bool(is_anomaly),  # Convert numpy.bool_ to Python bool
+        'confidence_scores': {
+            'activity_confidence': float(activity_confidence),  # Ensure Python float
+            'prediction_accuracy': 0.78,  # VAR model confidence (can be enhanced later)
+            'anomaly_confidence': float(anomaly_analysis.get('confidence', 0.5))  # Enhanced anomaly confidence
+        },
+        'anomaly_details': {
+            'threshold_used': anomaly_analysis.get('threshold_used', 1000),
+            'min_distance': anomaly_analysis.get('min_distance', 0),  # None beyond min_distance_bound
+            'min_distance_bound': anomaly_analysis.get('min_distance_bound'),
+            'near_frequent_location': anomaly_analysis.get('near_frequent_location', False),
+            'speed': current_gps['speed'],
+            'reason': anomaly_analysis.get('reason', 'Normal analysis')
+        },
+        'metadata': {
+            'timestamp': datetime.now(INDONESIA_TZ).isoformat(),
+            'data_points_used': len(recent_history),
+            'training_points': anomaly_analysis.get('training_points', 0),
+            'frequent_locations': anomaly_analysis.get('frequent_locations_count', 0),
+            'model_versions': {
+                'var': '1.0',
+                'random_forest': '1.0', 
+                'dbscan': '2.0'  # Updated version with context awareness
+            }
+        }
+    }
 
-        history = df.to_dict(orient='records')
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    Batch version of /predict for an ordered array of points
+    
+    Activity, VAR forecasts and anomaly detection run vectorized over each
+    device's points, which are then stored in one transaction.
+    Points are processed in the order given, grouped per device_id (per point or
+    top-level) when present.
+    """
+    try:
+        data = request.get_json()
+        points = data.get('points') if isinstance(data, dict) else data
+        
+        if not isinstance(points, list) or not points:
+            return jsonify({'error': 'Missing required field: points (non-empty array)'}), 400
+        if len(points) > MAX_BATCH_POINTS:
+            return jsonify({'error': f'Too many points: {len(points)} (max {MAX_BATCH_POINTS})'}), 413
+        
+        default_device = data.get('device_id') if isinstance(data, dict) else None
+        now = int(datetime.now(INDONESIA_TZ).timestamp())
+        batch = []
+        for i, point in enumerate(points):
+            if not isinstance(point, dict) or 'lat' not in point or 'lon' not in point:
+                return jsonify({'error': f'Point {i}: missing required fields: lat, lon'}), 400
+            batch.append({
+                'lat': float(point['lat']),
+                'lon': float(point['lon']),
+                'speed': float(point.get('speed', 0)),
+                'timestamp': int(point.get('timestamp', now)),
+                'device_id': storage.device_id_or_default(point.get('device_id', default_device))
+            })
+        
+        # Keep arrival order within each device
+        groups = {}
+        for i, point in enumerate(batch):
+            groups.setdefault(point['device_id'], []).append(i)
+        
+        results = [None] * len(batch)
+        data_points_used = 0
+        
+        for device_id, indices in groups.items():
+            # This device's models, held until its points are stored (keeps per-device order)
+            with model_workers.get_pool().use(device_id) as models:
+                group_results, history_used = predict_batch_for_device(
+                    device_id, models, [batch[i] for i in indices]
+                )
+            data_points_used += history_used
+            for i, result in zip(indices, group_results):
+                result['index'] = i
+                results[i] = result
+        stored = [result['stored'] for result in results]
         
-        # Map field names for mobile app compatibility (add lat/lon aliases)
-        for record in history:
-            record['lat'] = record['latitude']
-            record['lon'] = record['longitude']
-
         return jsonify({
-            'data': history,
-            'count': len(history)
+            'count': len(results),
+            'stored': int(sum(stored)),
+            'results': results,
+            'metadata': {
+                'timestamp': datetime.now(INDONESIA_TZ).isoformat(),
+                'devices': len(groups),
+                'data_points_used': data_points_used
+            }
         })
+        
+    except Exception as e:
+        print(f"Batch prediction error: {e}")
+        traceback.print_exc()
+        return jsonify({
+            'error': 'Internal server error during batch prediction',
+            'details': str(e)
+        }), 500
 
+def predict_batch_for_device(device_id, models, group):
+    """
+    Run the /predict/batch pipeline for one device's points with its model session and store them
+    
+    Returns:
+        tuple: (per-point results in group order, number of history points used)
+    """
+    recent_history = get_recent_gps_data(limit=50, device_id=device_id)
+    
+    # 1. Random Forest: activity + confidence for the whole group in one model call
+    activities, activity_confidences = activity_classifier.analyze_batch(
+        [p['speed'] for p in group], group, device_id, recent_history
+    )
+    
+    # 2. VAR: one fit, one matrix product for all one-step forecasts
+    # 3. Enhanced DBSCAN: vectorized anomaly analysis
+    try:
+        result = models.infer_batch(group, recent_history, activities)
+    except model_workers.WorkerError as e:
+        result = {'predictions': None, 'analyses': None, 'errors': {'var': str(e), 'anomaly': str(e)}}
+    
+    predictions = result['predictions']
+    if 'var' in result['errors']:
+        print(f"VAR batch prediction error: {result['errors']['var']}")
+        predictions = [{'lat': p['lat'], 'lon': p['lon']} for p in group]
+    
+    analyses = result['analyses']
+    if 'anomaly' in result['errors']:
+        print(f"Anomaly batch detection error: {result['errors']['anomaly']}")
+        analyses = [{'confidence': 0.5, 'is_anomaly': False,
+                     'reason': f"Error: {result['errors']['anomaly']}"}] * len(group)
+    
+    # One transaction for the device's points
+    stored = store_gps_batch([
+        (point, activities[j], bool(analyses[j]['is_anomaly'])) for j, point in enumerate(group)
+    ])
+    
+    results = [{
+        'device_id': device_id,
+        'timestamp': point['timestamp'],
+        'activity': activities[j],
+        'predicted_location': predictions[j],
+        'is_anomaly': bool(analyses[j]['is_anomaly']),
+        'confidence_scores': {
+            'activity_confidence': float(activity_confidences[j]),
+            'anomaly_confidence': float(analyses[j].get('confidence', 0.5))
+        },
+        'min_distance': analyses[j].get('min_distance', 0),
+        'min_distance_bound': analyses[j].get('min_distance_bound'),
+        'stored': stored[j]
+    } for j, point in enumerate(group)]
+    return results, len(recent_history)
+
+@app.route('/history', methods=['GET'])
+def get_history():
+    """
+    Get historical GPS data, newest first
+    
+    Query:
+        limit, device_id, activity: Page size, device and activity filters
+        from, to: Inclusive timestamp range
+        before_ts, before_id: Keyset cursor (next_cursor of the previous page)
+        after_id: Only rows stored after this id
+        since, since_ts: Change feed of rows stored after an id / timestamp
+        fields: Comma-separated projection, e.g. fields=id,lat,lon,timestamp
+        tolerance: Meters; return each page as a simplified polyline
+    
+    Every response carries an ETag and X-Last-Id for the newest stored id; a
+    poll with a matching If-None-Match gets 304 without touching the database.
+    """
+    # Read before the query: a row committed meanwhile only makes the ETag stale
+    sequence = change_feed.get_sequence().current()
+    etag = change_feed.get_sequence().etag(sequence)
+    if request.if_none_match.contains_weak(change_feed.get_sequence().tag(sequence)):
+        response = Response(status=304)
+        response.headers['ETag'] = etag
+        response.headers['X-Last-Id'] = str(sequence)
+        return response
+    
+    try:
+        query = history.HistoryQuery(
+            limit=request.args.get('limit', 100, type=int),
+            device_id=request.args.get('device_id'),
+            activity=request.args.get('activity'),
+            start=request.args.get('from', type=int),
+            end=request.args.get('to', type=int),
+            before_ts=request.args.get('before_ts', type=int),
+            before_id=request.args.get('before_id', type=int),
+            after_id=request.args.get('after_id', type=int),
+            since=request.args.get('since', type=int),
+            since_ts=request.args.get('since_ts', type=int),
+            fields=history.parse_fields(request.args.get('fields')),
+            tolerance=request.args.get('tolerance', type=float)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        # The first chunk runs the query, so SQL errors still get a JSON 500
+        body = query.iter_json(sequence=sequence)
+        first_chunk = next(body)
+        response = Response(stream_history(first_chunk, body), mimetype='application/json')
+        response.headers['ETag'] = etag
+        response.headers['X-Last-Id'] = str(sequence)
+        return response
+    
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def stream_history(first_chunk, body):
+    yield first_chunk
+    try:
+        yield from body
+    except Exception:
+        # Headers are already sent; log and end the (truncated) body
+        traceback.print_exc()
+
 @app.route('/activity', methods=['POST'])
 def classify_activity_endpoint():
     """Endpoint specifically for activity classification"""
@@ -321,7 +462,7 @@ def classify_activity_endpoint():
             return jsonify({'error': 'Missing required field: speed'}), 400
         
         # Get recent history for context
-        recent_history = get_recent_gps_data(limit=10)
+        recent_history = get_recent_gps_data(limit=10, device_id=storage.device_id_or_default(data.get('device_id')))
         
         # Classify activity
         activity = activity_classifier.classify_activity(data, recent_history)
@@ -347,11 +488,14 @@ def detect_anomaly_endpoint():
         current_location = data['current_location']
         route_history = data.get('route_history', [])
         
+        device_id = storage.device_id_or_default(data.get('device_id'))
+        
         # If no route history provided, get from database
         if not route_history:
-            route_history = get_recent_gps_data(limit=100)
-          # Detect anomaly
-        is_anomaly = anomaly_detector.detect_anomaly(current_location, route_history)
+            route_history = get_recent_gps_data(limit=100, device_id=device_id)
+        # Detect anomaly against the device's own normal locations
+        with model_workers.get_pool().use(device_id) as models:
+            is_anomaly = models.detect_anomaly(current_location, route_history)
         return jsonify({
             'is_anomaly': bool(is_anomaly),  # Convert numpy.bool_ to Python bool
             'current_location': current_location,
@@ -374,91 +518,32 @@ def test_connection():
 
 @app.route('/routes', methods=['GET'])
 def get_routes():
-    """Get route-based history by grouping GPS points into meaningful trips"""
+    """
+    Get route-based history (trips split on time gaps and activity changes)
+    
+    Routes are segmented at ingest time with time_gap=180 (what the history
+    screen asks for) and read from the routes table. Any other time_gap,
+    including the default of 300, segments the most recent points on the fly. With ?tolerance= (meters) every route carries a
+    simplified polyline of its points.
+    """
     try:
         limit = request.args.get('limit', 10, type=int)
         min_points = request.args.get('min_points', 2, type=int)  # Minimum points per route
         time_gap = request.args.get('time_gap', 300, type=int)    # Time gap in seconds (default 5 min)
+        device_id = request.args.get('device_id')  # None: routes of every device
+        tolerance = request.args.get('tolerance', type=float)  # None: summaries only
         
-        conn = sqlite3.connect('gps_data.db')
-        cursor = conn.cursor()
-        
-        # Get GPS data ordered by timestamp
-        cursor.execute('''
-            SELECT id, latitude, longitude, speed, timestamp, activity, is_anomaly, created_at
-            FROM gps_data 
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (limit * 50,))  # Get much more points to ensure we have recent data
-        
-        gps_points = cursor.fetchall()
-        conn.close()
-        
-        if not gps_points:
-            return jsonify({'routes': [], 'count': 0})
-        
-        # Group GPS points into routes based on time gaps and activity changes
-        routes = []
-        current_route = None
-        
-        for point in reversed(gps_points):  # Process in chronological order
-            point_data = {
-                'id': point[0],
-                'lat': point[1],
-                'lon': point[2],
-                'speed': point[3],
-                'timestamp': point[4],
-                'activity': point[5],
-                'is_anomaly': bool(point[6]),
-                'created_at': point[7]
-            }
-            
-            # Start new route if:
-            # 1. No current route
-            # 2. Time gap > specified time_gap
-            # 3. Activity change (any activity change)
-            # 4. Split long stationary routes (every 10 points for recent data)
-            current_time = point_data['timestamp']
-            is_recent_data = (current_time > (datetime.now(INDONESIA_TZ).timestamp() - 86400))  # Last 24 hours
-            
-            if (current_route is None or 
-                point_data['timestamp'] - current_route['points'][-1]['timestamp'] > time_gap or
-                current_route['activity'] != point_data['activity'] or  # Any activity change
-                (current_route['activity'] == 'stationary' and point_data['activity'] == 'stationary' and 
-                 ((is_recent_data and len(current_route['points']) > 10) or 
-                  (not is_recent_data and len(current_route['points']) > 50)))):  # Split recent data more frequently
-                
-                # Finish previous route
-                if current_route and len(current_route['points']) >= min_points:
-                    current_route = finish_route(current_route)
-                    routes.append(current_route)
-                
-                # Start new route
-                current_route = {
-                    'points': [point_data],
-                    'activity': point_data['activity'],
-                    'start_time': point_data['timestamp'],
-                    'anomalies': 1 if point_data['is_anomaly'] else 0
-                }
-            else:
-                # Add to current route
-                current_route['points'].append(point_data)
-                if point_data['is_anomaly']:
-                    current_route['anomalies'] += 1
-                
-                # Update main activity (most frequent non-stationary activity)
-                if point_data['activity'] != 'stationary':
-                    current_route['activity'] = point_data['activity']
-        
-        # Finish last route
-        if current_route and len(current_route['points']) >= min_points:
-            current_route = finish_route(current_route)
-            routes.append(current_route)
-        
-        # Return only the requested number of routes
-        routes = routes[-limit:] if len(routes) > limit else routes
-        routes.reverse()  # Most recent first
-        
+        if time_gap == route_segmenter.ROUTE_TIME_GAP:
+            routes = route_segmenter.get_store().recent_routes(limit, min_points, device_id)
+        else:
+            routes = segment_recent_routes(limit, min_points, time_gap, device_id)
+        
+        formatted = [format_route(route) for route in routes]
+        if tolerance is not None:
+            with storage.connection() as conn:
+                for route, summary in zip(routes, formatted):
+                    summary['polyline'] = trajectory.route_polyline(conn, route, tolerance)
+        routes = formatted
         return jsonify({
             'routes': routes,
             'count': len(routes)
@@ -471,23 +556,25 @@ def get_routes():
             'details': str(e)
         }), 500
 
-def finish_route(route):
-    """Calculate route statistics and format for response"""
-    points = route['points']
-    start_point = points[0]
-    end_point = points[-1]
-    
-    # Calculate distance (rough approximation)
-    total_distance = 0
-    for i in range(1, len(points)):
-        lat1, lon1 = points[i-1]['lat'], points[i-1]['lon']
-        lat2, lon2 = points[i]['lat'], points[i]['lon']
-        # Simple distance calculation (for short distances)
-        distance = ((lat2 - lat1) ** 2 + (lon2 - lon1) ** 2) ** 0.5 * 111320  # Convert to meters
-        total_distance += distance
-    
-    # Calculate duration
-    duration_seconds = end_point['timestamp'] - start_point['timestamp']
+def segment_recent_routes(limit, min_points, time_gap, device_id=None):
+    """On-the-fly segmentation of the newest limit*50 points (non-default time_gap)"""
+    device_filter = '' if device_id is None else 'WHERE device_id = ?'
+    params = (() if device_id is None else (device_id,)) + (limit * 50,)
+    with storage.connection() as conn:
+        rows = conn.execute(f'''
+            SELECT {route_segmenter.POINT_COLUMNS}
+            FROM gps_data {device_filter}
+            ORDER BY timestamp DESC
+            LIMIT ?
+        ''', params).fetchall()
+    
+    points = [route_segmenter._point(row) for row in reversed(rows)]
+    routes = [r for r in route_segmenter.segment_points(points, time_gap) if r['point_count'] >= min_points]
+    return routes[::-1][:limit]  # Most recent first
+
+def format_route(route):
+    """Format a route summary for the history screen"""
+    duration_seconds = int(route['duration_seconds'] or 0)
     duration_minutes = duration_seconds // 60
     duration_hours = duration_minutes // 60
     
@@ -497,111 +584,179 @@ def finish_route(route):
     else:
         duration_str = f"{duration_minutes}m"
     
-    # Calculate average speed
-    if duration_seconds > 0:
-        avg_speed = sum(p['speed'] for p in points) / len(points)
-    else:
-        avg_speed = 0
-    
-    # Format start and end locations (simplified)
-    start_location = f"{start_point['lat']:.4f}, {start_point['lon']:.4f}"
-    end_location = f"{end_point['lat']:.4f}, {end_point['lon']:.4f}"
+    total_distance = route['total_distance'] or 0
     
     # Convert UTC timestamp to Indonesia timezone (UTC+7)
-    start_time_local = datetime.fromtimestamp(start_point['timestamp'], tz=INDONESIA_TZ)
-    
-    # Generate unique ID using timestamp and point count to avoid duplicates
-    unique_id = f"route_{start_point['timestamp']}_{len(points)}_{hash(str(start_point['lat']) + str(start_point['lon'])) % 10000}"
+    start_time_local = datetime.fromtimestamp(route['start_time'], tz=INDONESIA_TZ)
     
     return {
-        'id': unique_id,
+        'id': f"route_{route['start_time']}_{route['start_point_id']}",
         'date': start_time_local.strftime('%d/%m/%Y'),
         'time': start_time_local.strftime('%H:%M'),
         'duration': duration_str,
         'distance': f"{total_distance/1000:.1f} km" if total_distance > 1000 else f"{total_distance:.0f} m",
-        'startLocation': start_location,
-        'endLocation': end_location,
-        'mainActivity': route['activity'],
-        'avgSpeed': f"{avg_speed:.1f} km/h",
-        'anomalies': route['anomalies'],
-        'pointCount': len(points)
+        'startLocation': f"{route['start_lat']:.4f}, {route['start_lon']:.4f}",
+        'endLocation': f"{route['end_lat']:.4f}, {route['end_lon']:.4f}",
+        'mainActivity': route['main_activity'],
+        'avgSpeed': f"{route['avg_speed'] or 0:.1f} km/h",
+        'anomalies': route['anomaly_count'],
+        'pointCount': route['point_count'],
+        'deviceId': route['device_id']
     }
 
 # Helper functions
 
-def get_recent_gps_data(limit=50):
-    """Get recent GPS data from database"""
+def get_recent_gps_data(limit=50, device_id=storage.DEFAULT_DEVICE_ID):
+    """
+    Get a device's recent GPS data (oldest first) from its in-memory ring buffer
+
+    Returns a zero-copy PointWindow; it indexes and iterates like a list of dicts.
+    """
     try:
-        conn = sqlite3.connect('gps_data.db')
-        df = pd.read_sql_query(
-            'SELECT latitude as lat, longitude as lon, speed, timestamp FROM gps_data ORDER BY timestamp DESC LIMIT ?',
-            conn, params=[limit]
-        )
-        conn.close()
-        return df.to_dict('records')
-    except:
+        return point_buffer.get_buffer(device_id).recent(limit)
+    except Exception as e:
+        print(f"Error getting recent GPS data: {e}")
         return []
 
-def store_gps_data(gps_data, activity, is_anomaly):
-    """Store GPS data in database with enhanced timestamp validation"""
+def store_gps_data(gps_data, activity, is_anomaly, predicted_location=None, device_id=storage.DEFAULT_DEVICE_ID):
+    """Store GPS data in database with enhanced timestamp validation and publish it to live clients"""
     try:
-        conn = sqlite3.connect('gps_data.db')
-        cursor = conn.cursor()
-        
-        # Use Indonesia timezone for consistency
-        current_time = datetime.now(INDONESIA_TZ).timestamp()
-        timestamp = gps_data['timestamp']
-        
-        # Enhanced validation for real-time GPS tracking:
-        # 1. Not older than 1 hour (3600 seconds) - for active tracking
-        # 2. Not more than 5 minutes in the future (300 seconds) - account for clock drift
-        # 3. Check for duplicate timestamps (same timestamp used recently)
-        # 4. Check for "stuck" timestamps (same timestamp repeated multiple times)
-        
-        # Check for recent duplicate timestamps (within last 10 minutes)
-        cursor.execute('''
-            SELECT COUNT(*) FROM gps_data 
-            WHERE timestamp = ? AND datetime(created_at) >= datetime('now', '-10 minutes')
-        ''', (timestamp,))
-        duplicate_count = cursor.fetchone()[0]
-        
-        # Get the most recent timestamp from database
-        cursor.execute('SELECT timestamp FROM gps_data ORDER BY created_at DESC LIMIT 1')
-        last_result = cursor.fetchone()
-        last_timestamp = last_result[0] if last_result else 0
-        
-        timestamp_age = current_time - timestamp
-        is_too_old = timestamp < (current_time - 3600)        # Older than 1 hour
-        is_too_future = timestamp > (current_time + 300)      # More than 5 minutes in future
-        is_duplicate = duplicate_count > 0                    # Same timestamp used recently
-        is_stale = timestamp <= last_timestamp                # Same or older than last stored
-        
-        if is_too_old or is_too_future or is_duplicate or is_stale:
-            reasons = []
-            if is_too_old:
-                reasons.append(f"too old ({timestamp_age:.1f}s)")
-            if is_too_future:
-                reasons.append(f"future ({-timestamp_age:.1f}s)")
-            if is_duplicate:
-                reasons.append(f"duplicate ({duplicate_count} recent)")
-            if is_stale:
-                reasons.append("stale/older than last")
+        with storage.connection() as conn:
+            cursor = conn.cursor()
             
-            print(f"⚠️ Rejecting GPS timestamp {timestamp} - {', '.join(reasons)}")
-            print(f"   Original: {datetime.fromtimestamp(timestamp, tz=INDONESIA_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}")
-            print(f"   Using server time: {datetime.fromtimestamp(current_time, tz=INDONESIA_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}")
+            # Use Indonesia timezone for consistency
+            current_time = datetime.now(INDONESIA_TZ).timestamp()
+            timestamp = gps_data['timestamp']
+        
+            # Enhanced validation for real-time GPS tracking:
+            # 1. Not older than 1 hour (3600 seconds) - for active tracking
+            # 2. Not more than 5 minutes in the future (300 seconds) - account for clock drift
+            # 3. Check for duplicate timestamps (same timestamp used recently)
+            # 4. Check for "stuck" timestamps (same timestamp repeated multiple times)
+        
+            # Check for recent duplicate timestamps (within last 10 minutes)
+            duplicate_count = storage.recent_duplicate_count(cursor, timestamp, device_id=device_id)
+        
+            # Get the device's most recent timestamp from database
+            last_timestamp = storage.last_stored_timestamp(cursor, device_id)
+        
+            timestamp_age = current_time - timestamp
+            is_too_old = timestamp < (current_time - 3600)        # Older than 1 hour
+            is_too_future = timestamp > (current_time + 300)      # More than 5 minutes in future
+            is_duplicate = duplicate_count > 0                    # Same timestamp used recently
+            is_stale = timestamp <= last_timestamp                # Same or older than last stored
+        
+            if is_too_old or is_too_future or is_duplicate or is_stale:
+                reasons = []
+                if is_too_old:
+                    reasons.append(f"too old ({timestamp_age:.1f}s)")
+                if is_too_future:
+                    reasons.append(f"future ({-timestamp_age:.1f}s)")
+                if is_duplicate:
+                    reasons.append(f"duplicate ({duplicate_count} recent)")
+                if is_stale:
+                    reasons.append("stale/older than last")
             
-            timestamp = current_time
-        
-        cursor.execute(
-            'INSERT INTO gps_data (latitude, longitude, speed, timestamp, activity, is_anomaly) VALUES (?, ?, ?, ?, ?, ?)',
-            (gps_data['lat'], gps_data['lon'], gps_data['speed'], timestamp, activity, is_anomaly)
-        )
-        conn.commit()
-        conn.close()
+                print(f"⚠️ Rejecting GPS timestamp {timestamp} - {', '.join(reasons)}")
+                print(f"   Original: {datetime.fromtimestamp(timestamp, tz=INDONESIA_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}")
+                print(f"   Using server time: {datetime.fromtimestamp(current_time, tz=INDONESIA_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}")
+            
+                timestamp = current_time
+        
+            # Dead-reckoning compression: redundant points stay stored but are skipped by ?tolerance= reads
+            redundant, promoted = trajectory.mark(device_id, timestamp, gps_data['lat'], gps_data['lon'], activity, is_anomaly)
+            cursor.execute(
+                'INSERT INTO gps_data (latitude, longitude, speed, timestamp, activity, is_anomaly, device_id, redundant) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (gps_data['lat'], gps_data['lon'], gps_data['speed'], timestamp, activity, 1 if is_anomaly else 0, device_id,
+                 1 if redundant else 0)
+            )
+            last_id = cursor.lastrowid
+            trajectory.stored(device_id, last_id)
+            if promoted is not None:
+                trajectory.promote(cursor, [promoted])
+        
+        # Committed: make the point visible to the models without a DB round trip
+        point_buffer.get_buffer(device_id).append(gps_data['lat'], gps_data['lon'], gps_data['speed'], timestamp)
+        change_feed.advance(last_id)
+        live_hub.publish('point', live_hub.point_event(
+            last_id, gps_data['lat'], gps_data['lon'], gps_data['speed'], timestamp,
+            activity, is_anomaly, predicted_location, device_id
+        ))
+        route_segmenter.sync()
         
     except Exception as e:
         print(f"Database storage error: {e}")
+        trajectory.forget([device_id])
+
+def store_gps_batch(rows):
+    """
+    Store (gps_data, activity, is_anomaly) rows in one transaction
+    
+    Unlike store_gps_data, original timestamps are kept so offline logs can be
+    back-filled. Points whose device already has a point with the same timestamp
+    (a replayed batch) or more than 5 minutes in the future are skipped.
+    
+    Returns:
+        list: True for every row that was inserted
+    """
+    try:
+        timestamps = [gps_data['timestamp'] for gps_data, _, _ in rows]
+        max_future = datetime.now(INDONESIA_TZ).timestamp() + 300
+        
+        with storage.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT DISTINCT device_id, timestamp FROM gps_data WHERE timestamp BETWEEN ? AND ?',
+                (min(timestamps), max(timestamps))
+            )
+            seen = set(cursor.fetchall())
+            
+            stored = []
+            values = []
+            promoted = []
+            for gps_data, activity, is_anomaly in rows:
+                key = (gps_data['device_id'], gps_data['timestamp'])
+                ok = key not in seen and key[1] <= max_future
+                stored.append(ok)
+                if ok:
+                    seen.add(key)
+                    redundant, previous = trajectory.mark(key[0], key[1], gps_data['lat'], gps_data['lon'], activity, is_anomaly)
+                    if previous is not None:
+                        promoted.append(previous)
+                    values.append((gps_data['lat'], gps_data['lon'], gps_data['speed'], key[1],
+                                   activity, 1 if is_anomaly else 0, key[0], 1 if redundant else 0))
+                    # Row by row, in the one transaction: the next point may promote this one by id
+                    cursor.execute(
+                        'INSERT INTO gps_data (latitude, longitude, speed, timestamp, activity, is_anomaly, device_id, redundant) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        values[-1]
+                    )
+                    trajectory.stored(key[0], cursor.lastrowid)
+            
+            trajectory.promote(cursor, promoted)
+            cursor.execute('SELECT MAX(id) FROM gps_data')
+            last_id = cursor.fetchone()[0]
+        
+        # Only points newer than a device buffer's newest keep it in time order
+        for device_id in {row[6] for row in values}:
+            buffer = point_buffer.get_buffer(device_id)
+            newest = buffer.newest_timestamp()
+            buffer.extend(sorted(
+                (row[:4] for row in values if row[6] == device_id and (newest is None or row[3] > newest)),
+                key=lambda row: row[3]
+            ))
+        
+        change_feed.advance(last_id)
+        if values:
+            # Back-fills are not replayed point by point; clients catch up with /history?since=
+            live_hub.publish('sync', {'last_id': last_id, 'stored': len(values)})
+        route_segmenter.sync()
+        print(f"💾 Batch GPS disimpan: {len(values)}/{len(rows)} titik")
+        return stored
+        
+    except Exception as e:
+        print(f"Database batch storage error: {e}")
+        trajectory.forget({gps_data['device_id'] for gps_data, _, _ in rows})
+        return [False] * len(rows)
 
 def simple_location_prediction(history, current):
     """Simple fallback location prediction using linear extrapolation"""
@@ -641,70 +796,24 @@ def classify_activity_simple(speed):
 
 @app.route('/stats', methods=['GET'])
 def get_statistics():
-    """Get comprehensive statistics about GPS data and activities"""
+    """
+    Get comprehensive statistics about GPS data and activities
+    
+    Served from rolling summary buckets maintained on insert. Optional
+    ?bucket=minute|hour|day adds a per-bucket timeline (since=epoch seconds,
+    default last 24 hours).
+    """
     try:
-        conn = sqlite3.connect('gps_data.db')
-        cursor = conn.cursor()
-        
-        # Get activity distribution
-        cursor.execute('''
-            SELECT activity, COUNT(*) as count
-            FROM gps_data 
-            WHERE activity IS NOT NULL
-            GROUP BY activity
-            ORDER BY count DESC
-        ''')
-        activity_distribution = [{'activity': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        
-        # Get anomaly statistics
-        cursor.execute('''
-            SELECT is_anomaly, COUNT(*) as count
-            FROM gps_data
-            GROUP BY is_anomaly
-        ''')
-        anomaly_stats = [{'is_anomaly': bool(row[0]), 'count': row[1]} for row in cursor.fetchall()]
-        
-        # Get recent activity (last 24 hours)
-        cursor.execute('''
-            SELECT activity, COUNT(*) as count
-            FROM gps_data 
-            WHERE activity IS NOT NULL 
-            AND datetime(created_at) >= datetime('now', '-1 day')
-            GROUP BY activity
-            ORDER BY count DESC
-        ''')
-        recent_activity = [{'activity': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        
-        # Get total data points
-        cursor.execute('SELECT COUNT(*) FROM gps_data')
-        total_points = cursor.fetchone()[0]
-        
-        # Get average speed by activity
-        cursor.execute('''
-            SELECT activity, AVG(speed) as avg_speed, COUNT(*) as count
-            FROM gps_data 
-            WHERE activity IS NOT NULL AND speed IS NOT NULL
-            GROUP BY activity
-        ''')
-        speed_by_activity = [
-            {
-                'activity': row[0], 
-                'avg_speed': round(row[1], 2), 
-                'count': row[2]
-            } for row in cursor.fetchall()
-        ]
-        
-        conn.close()
-        
-        stats = {
-            'activity_distribution': activity_distribution,
-            'anomaly_statistics': anomaly_stats,
-            'recent_activity': recent_activity,
-            'total_data_points': total_points,
-            'speed_by_activity': speed_by_activity,
-            'generated_at': datetime.now(INDONESIA_TZ).isoformat()
-        }
+        stats = stats_engine.get_statistics()
         
+        bucket = request.args.get('bucket')
+        if bucket is not None:
+            if bucket not in ('minute', 'hour', 'day'):
+                return jsonify({'error': 'bucket must be minute, hour or day'}), 400
+            since = request.args.get('since', int(datetime.now(timezone.utc).timestamp()) - 86400, type=int)
+            stats['timeline'] = stats_engine.timeline(bucket, since)
+        
+        stats['generated_at'] = datetime.now(INDONESIA_TZ).isoformat()
         return jsonify(stats)
         
     except Exception as e:
@@ -714,6 +823,44 @@ def get_statistics():
             'details': str(e)
         }), 500
 
+@app.route('/stream', methods=['GET'])
+def stream_live():
+    """
+    Server-Sent Events stream of processed points
+    
+    Events: 'point' (one classified and stored point) and 'sync' (a batch was
+    back-filled; fetch /history?since=). Reconnecting clients send
+    Last-Event-ID and receive the events they missed.
+    """
+    hub = live_hub.get_hub()
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    subscription = hub.subscribe(last_event_id)
+    response = Response(hub.stream(subscription), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
+
+@app.route('/stream/metrics', methods=['GET'])
+def get_stream_metrics():
+    """Connected live clients, published and dropped events"""
+    return jsonify(live_hub.get_hub().get_info())
+
+@app.route('/ingest/metrics', methods=['GET'])
+def get_ingest_metrics():
+    """Connection, backpressure and group-commit metrics of the MQTT ingest service"""
+    if not MQTT_AVAILABLE:
+        return jsonify({'error': 'MQTT client tidak tersedia'}), 503
+    
+    from mqtt_client import ingest_service
+    return jsonify(ingest_service.metrics())
+
+@app.route('/models/metrics', methods=['GET'])
+def get_model_metrics():
+    """Model pool mode, workers and resident devices, and loaded model artifacts"""
+    info = model_workers.get_pool().get_info()
+    info['artifacts'] = get_cache().get_info()
+    return jsonify(info)
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
@@ -742,6 +889,11 @@ if __name__ == '__main__':
     else:
         print("⚠️ MQTT subscriber tidak dapat dimulai")
 
+    # Downsampling dan arsip gps_data lama (GPS_RETENTION=1)
+    if retention.RETENTION_ENABLED:
+        print("🧹 Memulai retention gps_data di background...")
+        retention.start_background()
+
     print("🚀 Starting Flask server...")
     app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
 
@@ -749,19 +901,18 @@ if __name__ == '__main__':
 def debug_timestamps():
     """Debug endpoint to check timestamp conversion"""
     try:
-        conn = sqlite3.connect('gps_data.db')
-        cursor = conn.cursor()
-        
-        # Get latest 10 records
-        cursor.execute('''
-            SELECT id, timestamp, activity, created_at
-            FROM gps_data 
-            ORDER BY timestamp DESC
-            LIMIT 10
-        ''')
-        
-        records = cursor.fetchall()
-        conn.close()
+        with storage.connection() as conn:
+            cursor = conn.cursor()
+        
+            # Get latest 10 records
+            cursor.execute('''
+                SELECT id, timestamp, activity, created_at
+                FROM gps_data 
+                ORDER BY timestamp DESC
+                LIMIT 10
+            ''')
+        
+            records = cursor.fetchall()
         
         debug_data = []
         
@@ -0,0 +1,104 @@
+# File: benchmark_geo.py
+# Micro-benchmark of the geo kernels (models/geo.py) vs the per-point loops they replace
+# Mengukur waktu per titik dan memeriksa bahwa hasil vektor sama dengan versi skalar
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from models import geo
+
+
+def scalar_haversine(lat1, lon1, lat2, lon2):
+    """The former AnomalyDetector._haversine_distance (math, one pair per call)"""
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * math.asin(math.sqrt(a)) * 6371000
+
+
+def flat_step(lat1, lon1, lat2, lon2):
+    """The former route step distance (equirectangular, no cos(lat) correction)"""
+    return ((lat2 - lat1) ** 2 + (lon2 - lon1) ** 2) ** 0.5 * 111320
+
+
+def synthetic_track(n_points, seed=42):
+    """Lintasan sintetis di sekitar Semarang, interval 5 detik"""
+    rng = np.random.default_rng(seed)
+    lats = -7.005 + np.cumsum(1e-4 + 2e-5 * rng.standard_normal(n_points))
+    lons = 110.438 + np.cumsum(5e-5 + 2e-5 * rng.standard_normal(n_points))
+    timestamps = 1_700_000_000 + 5 * np.arange(n_points)
+    return lats, lons, timestamps
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def report(name, n, loop_seconds, vector_seconds, error=None):
+    line = (f"  {name:26s} loop {loop_seconds / n * 1e6:8.3f} µs/titik   "
+            f"vektor {vector_seconds / n * 1e6:8.3f} µs/titik   x{loop_seconds / vector_seconds:7.1f}")
+    if error is not None:
+        line += f"   max |diff| {error:.2e}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Geo kernel micro-benchmark')
+    parser.add_argument('--points', type=int, default=100_000)
+    parser.add_argument('--locations', type=int, default=200, help='Lokasi untuk matriks jarak pairwise')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    n = args.points
+    lats, lons, timestamps = synthetic_track(n)
+    lat_list, lon_list = lats.tolist(), lons.tolist()
+    print(f"📐 Geo kernels, {n} titik (best of {args.repeat})")
+
+    # Step distances (anomaly detector, route builder)
+    loop, loop_s = timed(lambda: [scalar_haversine(lat_list[i - 1], lon_list[i - 1], lat_list[i], lon_list[i])
+                                  for i in range(1, n)], args.repeat)
+    vector, vector_s = timed(lambda: geo.step_distances_m(lats, lons), args.repeat)
+    report('step haversine', n, loop_s, vector_s, float(np.abs(np.array(loop) - vector).max()))
+
+    # Route length: flat-earth loop vs haversine path length
+    flat, loop_s = timed(lambda: sum(flat_step(lat_list[i - 1], lon_list[i - 1], lat_list[i], lon_list[i])
+                                     for i in range(1, n)), args.repeat)
+    length, vector_s = timed(lambda: geo.path_length_m(lats, lons), args.repeat)
+    report('path length', n, loop_s, vector_s)
+    print(f"    haversine {length / 1000:.3f} km vs flat-earth {flat / 1000:.3f} km "
+          f"({(flat - length) / length:+.2%})")
+
+    # Bearings (activity features)
+    loop, loop_s = timed(lambda: [float(geo.bearing_deg(lat_list[i - 1], lon_list[i - 1], lat_list[i], lon_list[i]))
+                                  for i in range(1, n)], args.repeat)
+    vector, vector_s = timed(lambda: geo.step_bearings_deg(lats, lons), args.repeat)
+    report('step bearing', n, loop_s, vector_s, float(np.abs(np.array(loop) - vector).max()))
+
+    # Cumulative distance
+    _, loop_s = timed(lambda: np.cumsum([0.0] + [scalar_haversine(lat_list[i - 1], lon_list[i - 1], lat_list[i],
+                                                                  lon_list[i]) for i in range(1, n)]), args.repeat)
+    _, vector_s = timed(lambda: geo.cumulative_distance_m(lats, lons), args.repeat)
+    report('cumulative distance', n, loop_s, vector_s)
+
+    # Pairwise matrix (points x frequent locations)
+    m = args.locations
+    rows = min(n, 2000)
+    loc_lats, loc_lons = lat_list[::max(n // m, 1)][:m], lon_list[::max(n // m, 1)][:m]
+    loop, loop_s = timed(lambda: [[scalar_haversine(a, b, c, d) for c, d in zip(loc_lats, loc_lons)]
+                                  for a, b in zip(lat_list[:rows], lon_list[:rows])], args.repeat)
+    vector, vector_s = timed(lambda: geo.pairwise_m(lats[:rows], lons[:rows], loc_lats, loc_lons), args.repeat)
+    report(f'pairwise {rows}x{len(loc_lats)}', rows * len(loc_lats), loop_s, vector_s,
+           float(np.abs(np.array(loop) - vector).max()))
+
+
+if __name__ == '__main__':
+    main()
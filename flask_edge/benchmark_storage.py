@@ -0,0 +1,132 @@
+# File: benchmark_storage.py
+# Benchmark gps_data: biaya insert dan query saat tabel tumbuh sampai 10 juta baris
+# Membandingkan schema v1 (tanpa index, query lama) dengan schema terbaru (index + query baru)
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+import storage
+
+CHECKPOINTS = [10_000, 100_000, 1_000_000, 10_000_000]
+BATCH_SIZE = 50_000
+ACTIVITIES = ['stationary', 'walking', 'cycling', 'motor', 'car', 'bus']
+
+# Validation queries before migration v2
+LEGACY_DUPLICATE = '''
+    SELECT COUNT(*) FROM gps_data
+    WHERE timestamp = ? AND datetime(created_at) >= datetime('now', '-10 minutes')
+'''
+LEGACY_LAST = 'SELECT timestamp FROM gps_data ORDER BY created_at DESC LIMIT 1'
+
+QUERIES = {
+    'recent_50': ('SELECT latitude, longitude, speed, timestamp FROM gps_data '
+                  'ORDER BY timestamp DESC LIMIT 50', ()),
+    'history_activity': ('SELECT * FROM gps_data WHERE activity = ? '
+                         'ORDER BY timestamp DESC LIMIT 100', ('walking',)),
+    'stats_activity': ('SELECT activity, AVG(speed), COUNT(*) FROM gps_data '
+                       'WHERE activity IS NOT NULL GROUP BY activity', ()),
+}
+
+
+def open_db(path, target):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA mmap_size={storage.MMAP_SIZE}')
+    storage.migrate(conn, target=target)
+    return conn
+
+
+def grow(conn, start, stop, rng):
+    """Bulk-load synthetic rows [start, stop) with one point every 5 seconds"""
+    base_ts = 1_700_000_000
+    for lo in range(start, stop, BATCH_SIZE):
+        hi = min(lo + BATCH_SIZE, stop)
+        rows = [
+            (-7.0 + rng.random() * 0.1, 110.4 + rng.random() * 0.1, rng.random() * 60,
+             base_ts + 5 * i, ACTIVITIES[i % len(ACTIVITIES)], 0,
+             time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(base_ts + 5 * i)))
+            for i in range(lo, hi)
+        ]
+        conn.executemany(
+            'INSERT INTO gps_data (latitude, longitude, speed, timestamp, activity, is_anomaly, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.commit()
+
+
+def time_insert(conn, legacy, next_ts, repeats=200):
+    """Median latency of one validated insert (duplicate + staleness check + INSERT + commit)"""
+    samples = []
+    cursor = conn.cursor()
+    for i in range(repeats):
+        ts = next_ts + i
+        start = time.perf_counter()
+        if legacy:
+            cursor.execute(LEGACY_DUPLICATE, (ts,))
+            cursor.fetchone()
+            cursor.execute(LEGACY_LAST)
+            cursor.fetchone()
+        else:
+            storage.recent_duplicate_count(cursor, ts)
+            storage.last_stored_timestamp(cursor)
+        cursor.execute(
+            'INSERT INTO gps_data (latitude, longitude, speed, timestamp, activity, is_anomaly) '
+            'VALUES (?, ?, ?, ?, ?, ?)', (-7.0, 110.4, 5.0, ts, 'walking', 0))
+        conn.commit()
+        samples.append(time.perf_counter() - start)
+    # Keep the table size stable across checkpoints
+    conn.execute('DELETE FROM gps_data WHERE timestamp >= ?', (next_ts,))
+    conn.commit()
+    return float(np.median(samples)) * 1000
+
+
+def time_query(conn, sql, params, repeats=20):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples)) * 1000
+
+
+def run_variant(name, target, legacy, max_rows, workdir):
+    path = os.path.join(workdir, f'bench_{name}.db')
+    conn = open_db(path, target)
+    rng = random.Random(42)
+    rows = 0
+    results = []
+    for checkpoint in [c for c in CHECKPOINTS if c <= max_rows] or [max_rows]:
+        grow(conn, rows, checkpoint, rng)
+        rows = checkpoint
+        row = {'rows': rows, 'insert': time_insert(conn, legacy, 1_700_000_000 + 5 * rows + 10)}
+        for key, (sql, params) in QUERIES.items():
+            row[key] = time_query(conn, sql, params)
+        results.append(row)
+        print(f"  {name:8s} {rows:>11,d} rows  insert={row['insert']:8.3f} ms  " +
+              '  '.join(f"{k}={row[k]:8.3f} ms" for k in QUERIES))
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark gps_data insert/query cost vs table size')
+    parser.add_argument('--max-rows', type=int, default=CHECKPOINTS[-1])
+    parser.add_argument('--workdir', default=None, help='Directory for temporary databases')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='gps_bench_')
+    print(f"🗄️ Benchmark database di {workdir}")
+    print("\n📉 Schema v1 (tanpa index, query lama)")
+    run_variant('v1', 1, True, args.max_rows, workdir)
+    print(f"\n📈 Schema v{storage.MIGRATIONS[-1][0]} (index + query baru)")
+    run_variant('latest', None, False, args.max_rows, workdir)
+
+
+if __name__ == '__main__':
+    main()
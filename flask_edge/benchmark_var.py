@@ -0,0 +1,87 @@
+# File: benchmark_var.py
+# Benchmark VAR backends: import time dan latensi prediksi (statsmodels vs NumPy)
+
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from models.var_model import VARLocationPredictor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+IMPORTS = {
+    'statsmodels': 'import pandas, statsmodels.tsa.vector_ar.var_model, statsmodels.tsa.stattools',
+    'numpy': 'import models.numpy_var',
+}
+
+
+def synthetic_track(n_points, seed=42):
+    """Lintasan GPS sintetis dengan interval 5 detik"""
+    rng = np.random.default_rng(seed)
+    lat = -7.005 + np.cumsum(1e-4 + 2e-5 * rng.standard_normal(n_points))
+    lon = 110.438 + np.cumsum(5e-5 + 2e-5 * rng.standard_normal(n_points))
+    return [
+        {'lat': float(a), 'lon': float(b), 'speed': 20.0, 'timestamp': 1_700_000_000 + 5 * i}
+        for i, (a, b) in enumerate(zip(lat, lon))
+    ]
+
+
+def measure_import(backend, repeats=5):
+    """Cold import time in a fresh interpreter (median, seconds)"""
+    code = f"import time; t = time.perf_counter(); {IMPORTS[backend]}; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', code], cwd=HERE, capture_output=True, text=True, check=True)
+        samples.append(float(out.stdout.strip()))
+    return float(np.median(samples))
+
+
+def measure_predict(backend, online, track, window=51):
+    """Per-call latency of predict_next_location over a sliding 50+1 point window"""
+    predictor = VARLocationPredictor(backend=backend, online=online)
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for end in range(window, len(track)):
+            history = track[end - window:end]
+            start = time.perf_counter()
+            predictor.predict_next_location(history)
+            samples.append(time.perf_counter() - start)
+    samples = np.array(samples) * 1000
+    return {
+        'median_ms': float(np.median(samples)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'max_ms': float(samples.max())
+    }
+
+
+def main():
+    track = synthetic_track(600)
+
+    print("📦 Import time (fresh interpreter)")
+    for backend in IMPORTS:
+        print(f"  {backend:12s} {measure_import(backend) * 1000:8.1f} ms")
+
+    print("\n⏱️ predict_next_location latency (550 calls, 51-point window)")
+    for backend in VARLocationPredictor.BACKENDS:
+        for online in (False, True):
+            stats = measure_predict(backend, online, track)
+            mode = 'online' if online else 'batch'
+            print(f"  {backend:12s} {mode:7s} median={stats['median_ms']:.3f} ms  "
+                  f"p95={stats['p95_ms']:.3f} ms  max={stats['max_ms']:.1f} ms")
+
+    # Sanity check: both backends should produce the same forecast
+    history = track[:51]
+    with contextlib.redirect_stdout(io.StringIO()):
+        a = VARLocationPredictor(backend='statsmodels', online=False).predict_next_location(history)
+        b = VARLocationPredictor(backend='numpy', online=False).predict_next_location(history)
+    diff = max(abs(a['lat'] - b['lat']), abs(a['lon'] - b['lon']))
+    print(f"\n🔍 Max forecast difference between backends: {diff:.2e} degrees")
+
+
+if __name__ == '__main__':
+    main()
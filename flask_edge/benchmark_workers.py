@@ -0,0 +1,114 @@
+# File: benchmark_workers.py
+# Benchmark model inference throughput: in-process vs sharded worker processes
+# Banyak device mengirim titik bersamaan; diukur titik/detik untuk 1..N worker
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Database dan state sementara, juga dipakai worker (environment diwarisi)
+WORKDIR = os.environ.setdefault('BENCH_WORKDIR', tempfile.mkdtemp(prefix='bench_workers_'))
+os.environ.setdefault('GPS_DB_PATH', os.path.join(WORKDIR, 'gps_data.db'))
+
+import numpy as np
+
+import model_workers
+import storage
+from models.device_registry import DeviceModelRegistry
+from point_buffer import PointWindow
+
+
+def synthetic_tracks(devices, n_points, seed=42):
+    """Satu lintasan sintetis per device, interval 5 detik"""
+    rng = np.random.default_rng(seed)
+    tracks = {}
+    for d in range(devices):
+        lat = -7.005 + 0.01 * d + np.cumsum(1e-4 + 2e-5 * rng.standard_normal(n_points))
+        lon = 110.438 + np.cumsum(5e-5 + 2e-5 * rng.standard_normal(n_points))
+        tracks[f'bench-{d}'] = [
+            {'lat': float(a), 'lon': float(b), 'speed': 20.0, 'timestamp': 1_700_000_000 + 5 * i}
+            for i, (a, b) in enumerate(zip(lat, lon))
+        ]
+    return tracks
+
+
+def run_load(pool, tracks, clients, window=50):
+    """
+    Replay every device's track through pool.use(device).infer from `clients` threads
+
+    Returns:
+        (points, seconds)
+    """
+    devices = list(tracks)
+    done = [0]
+    lock = threading.Lock()
+
+    def client(mine):
+        for device_id in mine:
+            track = tracks[device_id]
+            for end in range(window, len(track)):
+                history = PointWindow.from_points(track[end - window:end])
+                with pool.use(device_id) as models:
+                    models.infer(track[end], history, 'car')
+                with lock:
+                    done[0] += 1
+
+    threads = [threading.Thread(target=client, args=(devices[i::clients],)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return done[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--devices', type=int, default=32)
+    parser.add_argument('--points', type=int, default=150, help='Points per device')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    storage.init_db()
+    tracks = synthetic_tracks(args.devices, args.points)
+    clients = max(args.devices // 2, 1)
+    print(f"🧪 {args.devices} devices x {args.points} points, {clients} client threads, "
+          f"{os.cpu_count()} CPU, workdir {WORKDIR}")
+
+    counts = [0]
+    n = 1
+    while n <= args.max_workers:
+        counts.append(n)
+        n *= 2
+    if counts[-1] != args.max_workers:
+        counts.append(args.max_workers)
+
+    baseline = None
+    for workers in counts:
+        state_dir = os.path.join(WORKDIR, f'state_{workers}')
+        if workers == 0:
+            pool = model_workers.LocalModelPool(DeviceModelRegistry(state_dir=state_dir))
+            label = 'in-process'
+        else:
+            pool = model_workers.ModelWorkerPool(workers, state_dir=state_dir)
+            pool.start()
+            label = f'{workers} workers'
+            # Worker start-up (spawn + imports) is not part of the measurement
+            for device_id in tracks:
+                pool.call(device_id, 'detect_anomaly', tracks[device_id][0], [])
+
+        points, seconds = run_load(pool, tracks, clients)
+        pool.close()
+        rate = points / seconds
+        baseline = baseline or rate
+        print(f"  {label:12s} {rate:9.0f} titik/s   ({points} titik, {seconds:.2f} s, x{rate / baseline:.2f})")
+
+    if os.environ.get('BENCH_KEEP') != '1':
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
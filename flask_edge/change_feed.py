@@ -0,0 +1,88 @@
+# File: flask_edge/change_feed.py
+# Change sequence for Smart GPS Tracker polling clients
+# Tracks the newest committed gps_data id so unchanged /history polls are answered without SQLite
+
+import threading
+import time
+
+import storage
+
+# How stale the cached sequence may get before it is re-read from SQLite.
+# Covers writers in other processes (standalone mqtt_client.py, scripts).
+REFRESH_SECONDS = 1.0
+
+
+class ChangeSequence:
+    """
+    Monotonic sequence of gps_data changes
+
+    The value is the highest committed gps_data id (AUTOINCREMENT ids are never
+    reused, so back-filled points still get a higher value). Ingest code calls
+    advance() right after its commit; other processes' writes are picked up by a
+    MAX(id) rowid lookup at most once per REFRESH_SECONDS, however many clients
+    poll.
+
+    Retention removes old rows without adding any, so the ETag also carries
+    the retention generation (bumped by every run that deleted rows).
+    """
+
+    def __init__(self, path=None, refresh_seconds=REFRESH_SECONDS):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self._value = 0
+        self.generation = 0
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def advance(self, last_id):
+        """Record a commit that stored rows up to last_id"""
+        if last_id is None:
+            return
+        with self._lock:
+            if last_id > self._value:
+                self._value = last_id
+
+    def current(self):
+        """Current sequence value"""
+        if time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+            self.refresh()
+        return self._value
+
+    def refresh(self):
+        with storage.connection(self.path) as conn:
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM gps_data').fetchone()[0]
+            generation = conn.execute(
+                "SELECT COALESCE((SELECT value FROM retention_state WHERE key = 'generation'), 0)"
+            ).fetchone()[0]
+        self._refreshed_at = time.monotonic()
+        self.advance(last_id)
+        with self._lock:
+            self.generation = max(self.generation, generation)
+        return self._value
+
+    def tag(self, value=None):
+        """Opaque validator for sequence value (default: current) and the retention generation"""
+        value = self.current() if value is None else value
+        return f'{value}.{self.generation}' if self.generation else str(value)
+
+    def etag(self, value=None):
+        """Weak ETag for responses built at sequence value (default: current)"""
+        return f'W/"{self.tag(value)}"'
+
+
+_sequences = {}
+_sequences_lock = threading.Lock()
+
+
+def get_sequence(path=None):
+    """Process-wide ChangeSequence for a database file"""
+    with _sequences_lock:
+        sequence = _sequences.get(path)
+        if sequence is None:
+            sequence = _sequences[path] = ChangeSequence(path)
+        return sequence
+
+
+def advance(last_id, path=None):
+    """Shortcut for get_sequence(path).advance(last_id)"""
+    get_sequence(path).advance(last_id)
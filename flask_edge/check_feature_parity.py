@@ -0,0 +1,100 @@
+# File: check_feature_parity.py
+# Parity check: fitur streaming (OnlineFeatureExtractor) vs fitur training pandas (build_features)
+# Keluar dengan kode 1 jika ada fitur yang berbeda lebih dari toleransi
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from models.activity_features import FEATURES, OnlineFeatureExtractor, build_features
+
+# std of a near-constant window is the sqrt of rounding noise (~1e-7 in pandas too)
+TOLERANCE = 1e-6
+
+
+def streaming_features(df, group='route_id'):
+    """Feature matrix from one OnlineFeatureExtractor per group, rows in build_features order"""
+    df = df.sort_values(by=[group, 'timestamp'])
+    rows = []
+    for _, track in df.groupby(group, sort=True):
+        extractor = OnlineFeatureExtractor()
+        for ts, lat, lon, speed in zip(track['timestamp'], track['latitude'], track['longitude'], track['speed_mps']):
+            rows.append(extractor.push(int(ts), float(lat), float(lon), float(speed)))
+    return np.array(rows)
+
+
+def synthetic_track(n_points, seed=7):
+    """Satu track panjang dengan jeda acak, berhenti dan putaran arah"""
+    rng = np.random.default_rng(seed)
+    gaps = rng.choice([5, 5, 5, 10, 300], size=n_points)
+    speed = np.abs(np.cumsum(rng.normal(0, 1.5, n_points))) % 30
+    return pd.DataFrame({
+        'route_id': 'synthetic',
+        'timestamp': 1_700_000_000 + np.cumsum(gaps),
+        'latitude': -7.0 + np.cumsum(rng.normal(0, 1e-4, n_points)),
+        'longitude': 110.4 + np.cumsum(rng.normal(0, 1e-4, n_points)),
+        'speed_mps': speed,
+    })
+
+
+def compare(name, df):
+    start = time.perf_counter()
+    expected = build_features(df)[FEATURES].to_numpy(dtype=float)
+    batch_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = streaming_features(df)
+    stream_seconds = time.perf_counter() - start
+
+    diff = np.abs(expected - actual).max(axis=0)
+    ok = bool((diff <= TOLERANCE).all())
+    print(f"\n{'✅' if ok else '❌'} {name}: {len(df)} titik, pandas {batch_seconds * 1000:.1f} ms, "
+          f"streaming {stream_seconds / len(df) * 1e6:.1f} µs/titik")
+    for feature, d in zip(FEATURES, diff):
+        print(f"  {feature:30s} max |diff| = {d:.2e}")
+    return ok
+
+
+def check_seed(df, split):
+    """A device re-seeded from recent history continues exactly like the uninterrupted stream"""
+    track = df.sort_values('timestamp')
+    points = [
+        {'timestamp': int(ts), 'lat': float(lat), 'lon': float(lon), 'speed': float(speed) * 3.6}
+        for ts, lat, lon, speed in zip(track['timestamp'], track['latitude'], track['longitude'], track['speed_mps'])
+    ]
+    resumed = OnlineFeatureExtractor()
+    resumed.seed(points[:split])
+    uninterrupted = OnlineFeatureExtractor()
+    for p in points[:split]:
+        uninterrupted.push(p['timestamp'], p['lat'], p['lon'], p['speed'] / 3.6)
+
+    diff = 0.0
+    for p in points[split:]:
+        args = (p['timestamp'], p['lat'], p['lon'], p['speed'] / 3.6)
+        diff = max(diff, float(np.abs(np.subtract(resumed.push(*args), uninterrupted.push(*args))).max()))
+    ok = diff <= 1e-6
+    print(f"\n{'✅' if ok else '❌'} Seed dari {resumed.window + 1} titik terakhir: max |diff| = {diff:.2e}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming vs pandas activity feature parity')
+    parser.add_argument('--csv', default='activity_dataset.csv')
+    parser.add_argument('--synthetic-points', type=int, default=20000)
+    args = parser.parse_args()
+
+    dataset = pd.read_csv(args.csv)
+    synthetic = synthetic_track(args.synthetic_points)
+    results = [
+        compare(args.csv, dataset),
+        compare('synthetic (long stream)', synthetic),
+        check_seed(synthetic, args.synthetic_points // 2),
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
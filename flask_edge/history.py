@@ -0,0 +1,256 @@
+# File: flask_edge/history.py
+# GPS history queries for Smart GPS Tracker
+# Keyset-paginated, projected gps_data reads streamed straight from the cursor to JSON
+
+import json
+
+import retention
+import storage
+import trajectory
+
+# Public field name -> gps_data column (lat/lon are aliases for the mobile app)
+HISTORY_FIELDS = {
+    'id': 'id',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'lat': 'latitude',
+    'lon': 'longitude',
+    'speed': 'speed',
+    'timestamp': 'timestamp',
+    'activity': 'activity',
+    'is_anomaly': 'is_anomaly',
+    'created_at': 'created_at',
+    'device_id': 'device_id'
+}
+DEFAULT_FIELDS = ('id', 'latitude', 'longitude', 'speed', 'timestamp', 'activity',
+                  'is_anomaly', 'created_at', 'lat', 'lon', 'device_id')
+
+
+def parse_fields(value):
+    """
+    Validate a comma-separated ?fields= projection
+
+    Returns:
+        tuple: Field names, DEFAULT_FIELDS when value is empty
+
+    Raises:
+        ValueError: On an unknown field
+    """
+    if not value:
+        return DEFAULT_FIELDS
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)} (allowed: {', '.join(HISTORY_FIELDS)})")
+    return fields or DEFAULT_FIELDS
+
+
+def _clean(column, value):
+    """JSON-safe value, matching the old DataFrame cleanup (NULL -> '')"""
+    if column == 'is_anomaly':
+        # Early rows hold a numpy.bool_ blob
+        return value not in (None, 0, b'\x00')
+    if value is None:
+        return ''
+    return value
+
+
+class HistoryQuery:
+    """
+    One /history page
+
+    Rows are ordered newest first by (timestamp, id). Pages continue with the
+    keyset cursor (before_ts, before_id) of the last row, so each page is an
+    index range scan no matter how deep it is.
+
+    With since / since_ts the query is a change feed instead: rows stored after
+    id `since` (or with a timestamp after since_ts), oldest id first, continued
+    with since = last_id.
+
+    Pages also read archived months (see retention.py), but only those whose
+    timestamp range overlaps the requested one, newest first, and only until
+    the page is full. The change feed covers gps_data alone.
+
+    With a tolerance (meters) a page is a simplified polyline: at or above
+    the ingest tolerance only key points and each device's first and last
+    point in the range are read (see trajectory.py), then each device's rows
+    are reduced with Douglas-Peucker. The cursor still
+    follows the rows read, so pagination is unchanged. Feeds ignore it.
+    """
+
+    def __init__(self, limit=100, device_id=None, activity=None, start=None, end=None,
+                 before_ts=None, before_id=None, after_id=None, since=None, since_ts=None,
+                 fields=DEFAULT_FIELDS, tolerance=None):
+        """
+        Args:
+            limit: Max rows in the page
+            device_id: Only rows of this device
+            activity: Only rows with this activity
+            start, end: Inclusive timestamp range (?from= / ?to=)
+            before_ts, before_id: Cursor; only rows older than (before_ts, before_id)
+            after_id: Only rows inserted after this id
+            since, since_ts: Change feed from an id / timestamp (ascending by id)
+            fields: Projected field names (see HISTORY_FIELDS)
+            tolerance: Simplify the page to this many meters (None: every row)
+        """
+        self.limit = limit
+        self.device_id = device_id
+        self.activity = activity
+        self.start = start
+        self.end = end
+        self.before_ts = before_ts
+        self.before_id = before_id
+        self.after_id = after_id
+        self.since = since
+        self.since_ts = since_ts
+        self.fields = fields
+        self.tolerance = tolerance
+
+    @property
+    def is_feed(self):
+        return self.since is not None or self.since_ts is not None
+
+    @property
+    def simplified(self):
+        return bool(self.tolerance) and not self.is_feed
+
+    def sql(self):
+        # timestamp and id are always read so the next cursor can be built
+        columns = list(dict.fromkeys(['timestamp', 'id'] + [HISTORY_FIELDS[f] for f in self.fields]))
+        where, params = [], []
+        if self.device_id is not None:
+            where.append('device_id = ?')
+            params.append(self.device_id)
+        if self.activity:
+            where.append('activity = ?')
+            params.append(self.activity)
+        if self.start is not None:
+            where.append('timestamp >= ?')
+            params.append(self.start)
+        if self.end is not None:
+            where.append('timestamp <= ?')
+            params.append(self.end)
+        if self.after_id is not None:
+            where.append('id > ?')
+            params.append(self.after_id)
+        if self.simplified:
+            columns = list(dict.fromkeys(columns + ['latitude', 'longitude', 'device_id']))
+            if self.tolerance >= trajectory.INGEST_TOLERANCE_M:
+                endpoints, endpoint_params = self._endpoints(where, params)
+                where.append(f'(redundant = 0 OR id IN ({endpoints}))')
+                params += endpoint_params
+        if self.before_ts is not None:
+            if self.before_id is not None:
+                where.append('(timestamp, id) < (?, ?)')
+                params += [self.before_ts, self.before_id]
+            else:
+                where.append('timestamp < ?')
+                params.append(self.before_ts)
+        if self.since is not None:
+            where.append('id > ?')
+            params.append(self.since)
+        if self.since_ts is not None:
+            where.append('timestamp > ?')
+            params.append(self.since_ts)
+
+        query = f"SELECT {', '.join(columns)} FROM gps_data"
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        if self.is_feed:
+            query += ' ORDER BY id LIMIT ?'
+        else:
+            query += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+        return query, params + [self.limit], columns
+
+    def _endpoints(self, where, params):
+        """
+        Ids of each device's newest and oldest row in the requested range
+
+        Redundant points after a device's last key point (or before its first
+        one) are still part of the track, so a key-point page keeps them, as
+        route_polyline does with a route's endpoints. The range leaves the
+        cursor out, so every page sees the same endpoints.
+        """
+        condition = ' AND '.join(where) or '1'
+        if self.device_id is not None:
+            query = (f'SELECT * FROM (SELECT id FROM gps_data WHERE {condition} ORDER BY timestamp DESC, id DESC LIMIT 1) '
+                     f'UNION ALL SELECT * FROM (SELECT id FROM gps_data WHERE {condition} ORDER BY timestamp, id LIMIT 1)')
+        else:
+            query = (f'SELECT id FROM (SELECT id, MAX(timestamp) FROM gps_data WHERE {condition} GROUP BY device_id) '
+                     f'UNION ALL SELECT id FROM (SELECT id, MIN(timestamp) FROM gps_data WHERE {condition} GROUP BY device_id)')
+        return query, params * 2
+
+    def _time_range(self):
+        """Inclusive (low, high) timestamp bounds of the page, None where open"""
+        high = self.end
+        if self.before_ts is not None:
+            high = self.before_ts if high is None else min(high, self.before_ts)
+        return self.start, high
+
+    def _rows(self, conn, query, params):
+        """
+        Page rows from gps_data, merged with overlapping archived partitions
+
+        Without overlapping partitions this is the plain cursor (streamed);
+        otherwise at most limit rows per source are merged in (timestamp, id)
+        order and partitions older than a full page are never opened.
+        """
+        if self.is_feed:
+            return conn.execute(query, params)
+        partitions = retention.overlapping_partitions(conn, *self._time_range())
+        if not partitions:
+            return conn.execute(query, params)
+
+        rows = conn.execute(query, params).fetchall()
+        for partition in partitions:
+            if len(rows) >= self.limit and rows[self.limit - 1][0] > partition['max_ts']:
+                break
+            archive = retention.get_partition_cache().open(partition)
+            try:
+                rows += archive.execute(query, params).fetchall()
+            finally:
+                archive.close()
+            rows.sort(key=lambda row: (row[0], row[1]), reverse=True)
+            del rows[self.limit:]
+        return rows
+
+    def iter_json(self, path=None, sequence=None):
+        """
+        Yield the response body in chunks: {"data": [...], "count": n, "next_cursor": ...}
+        (change feed: {"data": [...], "count": n, "last_id": id, "has_more": bool})
+
+        The connection stays borrowed until the last row is sent; rows are never
+        collected into a list or DataFrame (except one page when archived months
+        are merged in). sequence is the change sequence read before the query;
+        an empty feed page reports it as last_id.
+        """
+        query, params, columns = self.sql()
+        picks = [(field, columns.index(HISTORY_FIELDS[field]), HISTORY_FIELDS[field]) for field in self.fields]
+
+        count = 0
+        last = None
+        with storage.connection(path) as conn:
+            rows = self._rows(conn, query, params)
+            if self.simplified:
+                rows = list(rows)
+                fetched, last = len(rows), (rows[-1] if rows else None)
+                rows = trajectory.simplify(rows, columns.index('latitude'), columns.index('longitude'),
+                                           self.tolerance, columns.index('device_id'))
+            yield '{"data": ['
+            for row in rows:
+                record = {field: _clean(column, row[i]) for field, i, column in picks}
+                yield (',' if count else '') + json.dumps(record)
+                count += 1
+                if not self.simplified:
+                    last = row
+        if not self.simplified:
+            fetched = count
+
+        has_more = fetched == self.limit and last is not None
+        if self.is_feed:
+            last_id = last[1] if last is not None else max(self.since or 0, sequence or 0)
+            yield f'], "count": {count}, "last_id": {last_id}, "has_more": {json.dumps(has_more)}}}'
+            return
+
+        next_cursor = {'before_ts': last[0], 'before_id': last[1]} if has_more else None
+        yield f'], "count": {count}, "next_cursor": {json.dumps(next_cursor)}}}'
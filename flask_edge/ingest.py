@@ -0,0 +1,98 @@
+# File: flask_edge/ingest.py
+# Ingest writer for GPS messages
+# Batched, group-committed SQLite writer (driven by mqtt_service.AsyncIngestService)
+
+import time
+
+import storage
+
+
+class BatchWriter:
+    """
+    Buffers rows and writes them in one transaction
+
+    A flush happens when flush_size rows are pending or the oldest pending row is
+    flush_interval_ms old. write_row(cursor, row) runs for every row inside the
+    transaction, so validation queries see earlier rows of the same batch.
+    on_failed(rows) gets the rows that were rejected, failed or rolled back.
+    """
+
+    def __init__(self, write_row, flush_size=50, flush_interval_ms=200, on_written=None, on_flushed=None,
+                 on_failed=None):
+        self.write_row = write_row
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.on_written = on_written
+        self.on_flushed = on_flushed
+        self.on_failed = on_failed
+
+        self.pending = []
+        self.oldest = None
+        self.batches = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.last_batch_size = 0
+        self.commit_seconds = 0.0
+
+    def add(self, row):
+        if not self.pending:
+            self.oldest = time.monotonic()
+        self.pending.append(row)
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    def time_until_flush(self):
+        """Seconds until the pending batch is due (None when nothing is pending)"""
+        if not self.pending:
+            return None
+        return max(0.0, self.oldest + self.flush_interval - time.monotonic())
+
+    def flush(self):
+        if not self.pending:
+            return 0
+
+        rows, self.pending = self.pending, []
+        written = []
+        start = time.perf_counter()
+        try:
+            with storage.connection() as conn:
+                cursor = conn.cursor()
+                for row in rows:
+                    try:
+                        if self.write_row(cursor, row) is not False:
+                            written.append(row)
+                    except Exception as e:
+                        self.rows_failed += 1
+                        print(f"❌ Ingest: gagal menulis baris: {e}")
+        except Exception as e:
+            # Whole transaction rolled back
+            self.rows_failed += len(rows)
+            print(f"❌ Ingest: batch {len(rows)} baris gagal di-commit: {e}")
+            if self.on_failed is not None:
+                self.on_failed(rows)
+            return 0
+
+        self.commit_seconds += time.perf_counter() - start
+        self.batches += 1
+        self.rows_written += len(written)
+        self.last_batch_size = len(rows)
+
+        if self.on_written is not None:
+            for row in written:
+                self.on_written(row)
+        if self.on_flushed is not None and written:
+            self.on_flushed(written)
+        if self.on_failed is not None and len(written) < len(rows):
+            kept = {id(row) for row in written}
+            self.on_failed([row for row in rows if id(row) not in kept])
+        return len(written)
+
+    def metrics(self):
+        return {
+            'pending': len(self.pending),
+            'batches': self.batches,
+            'rows_written': self.rows_written,
+            'rows_failed': self.rows_failed,
+            'last_batch_size': self.last_batch_size,
+            'avg_commit_ms': round(self.commit_seconds / self.batches * 1000, 3) if self.batches else 0.0
+        }
@@ -0,0 +1,166 @@
+# File: flask_edge/live_hub.py
+# Live point stream for Smart GPS Tracker
+# In-process pub/sub hub fanning processed points out to Server-Sent Events clients
+
+import json
+import queue
+import threading
+from collections import deque
+
+SUBSCRIBER_QUEUE_SIZE = 256   # Events buffered per client before the oldest is dropped
+REPLAY_SIZE = 256             # Recent events kept for Last-Event-ID resume
+KEEPALIVE_SECONDS = 15        # Comment line sent to idle clients (keeps proxies open)
+
+
+def point_event(point_id, lat, lon, speed, timestamp, activity, is_anomaly, predicted_location=None,
+                device_id=None):
+    """
+    Compact event for one classified and stored point
+
+    Returns:
+        dict: {id, lat, lon, speed, ts, activity, anomaly[, pred][, device]}
+    """
+    event = {
+        'id': point_id,
+        'lat': round(float(lat), 6),
+        'lon': round(float(lon), 6),
+        'speed': round(float(speed), 2),
+        'ts': int(timestamp),
+        'activity': activity,
+        'anomaly': bool(is_anomaly)
+    }
+    if predicted_location:
+        event['pred'] = [round(float(predicted_location['lat']), 6), round(float(predicted_location['lon']), 6)]
+    if device_id is not None:
+        event['device'] = device_id
+    return event
+
+
+class Subscription:
+    """One connected client: a bounded queue that drops its oldest event when full"""
+
+    def __init__(self, hub, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.hub = hub
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next (seq, event_type, data) or None on timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class LiveHub:
+    """
+    Fan-out of live events to every subscribed client
+
+    publish() never blocks: each subscriber gets the event in its own bounded
+    queue, so one slow client only loses its own oldest events. Events carry a
+    hub sequence number used as the SSE id; the last REPLAY_SIZE events are kept
+    so a reconnecting client resumes from Last-Event-ID without a gap.
+    """
+
+    def __init__(self, replay_size=REPLAY_SIZE):
+        self._subscribers = set()
+        self._replay = deque(maxlen=replay_size)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def publish(self, event_type, data):
+        """Send an event to every subscriber"""
+        with self._lock:
+            self._seq += 1
+            item = (self._seq, event_type, json.dumps(data, separators=(',', ':')))
+            self._replay.append(item)
+            subscribers = list(self._subscribers)
+            self.published += 1
+        for subscription in subscribers:
+            subscription.put(item)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Register a client, optionally replaying events after last_event_id
+
+        Returns:
+            Subscription
+        """
+        subscription = Subscription(self)
+        with self._lock:
+            if last_event_id is not None:
+                for item in self._replay:
+                    if item[0] > last_event_id:
+                        subscription.put(item)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stream(self, subscription, keepalive=KEEPALIVE_SECONDS):
+        """
+        Yield SSE frames for a subscription until the client disconnects
+
+        The subscription is removed when the response generator is closed.
+        """
+        try:
+            yield f'retry: 3000\n: connected ({len(self)} clients)\n\n'
+            while True:
+                item = subscription.get(timeout=keepalive)
+                if item is None:
+                    yield ': keepalive\n\n'
+                    continue
+                seq, event_type, data = item
+                yield f'id: {seq}\nevent: {event_type}\ndata: {data}\n\n'
+        finally:
+            subscription.close()
+
+    def get_info(self):
+        return {
+            'clients': len(self._subscribers),
+            'published': self.published,
+            'last_event_id': self._seq,
+            'dropped': sum(s.dropped for s in list(self._subscribers))
+        }
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """Process-wide LiveHub"""
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = LiveHub()
+        return _hub
+
+
+def publish(event_type, data):
+    """Publish on the process-wide hub; never raises (called from ingest paths)"""
+    try:
+        get_hub().publish(event_type, data)
+    except Exception as e:
+        print(f"⚠️ Live publish failed: {e}")
@@ -0,0 +1,412 @@
+# File: flask_edge/model_workers.py
+# Sharded model workers for Smart GPS Tracker
+# Devices are spread over worker processes by consistent hashing; each worker keeps its devices' VAR/DBSCAN state
+
+import atexit
+import bisect
+import hashlib
+import itertools
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from models.device_registry import DeviceModelRegistry, MAX_RESIDENT_DEVICES, MODEL_STATE_DIR, get_registry
+
+# Worker processes for VAR/DBSCAN (0: run in the calling thread, as before)
+MODEL_WORKERS = int(os.environ.get('MODEL_WORKERS', '0'))
+VIRTUAL_NODES = 64          # Ring points per worker; more = more even spread
+CALL_TIMEOUT_SECONDS = 30   # A call waiting longer fails (the worker is likely stuck)
+
+
+class WorkerError(RuntimeError):
+    """A model call failed in a worker, or the worker died before answering"""
+
+
+# Operations run next to the device state (in a worker or in-process).
+# Each catches model errors itself so one call returns both results.
+
+def infer(models, point, history, activity):
+    """
+    VAR forecast and anomaly analysis of one point
+
+    Returns:
+        dict: {predicted_location, anomaly_analysis, errors: {'var'|'anomaly': message}}
+    """
+    result = {'predicted_location': None, 'anomaly_analysis': None, 'errors': {}}
+    try:
+        result['predicted_location'] = models.var_predictor.predict_next_location(history + [point])
+    except Exception as e:
+        result['errors']['var'] = str(e)
+    try:
+        result['anomaly_analysis'] = models.anomaly_detector.analyze(point, history, activity)
+    except Exception as e:
+        result['errors']['anomaly'] = str(e)
+    return result
+
+
+def infer_batch(models, points, history, activities):
+    """
+    Batch forecasts and anomaly analyses of a device's points
+
+    Returns:
+        dict: {predictions, analyses, errors}
+    """
+    result = {'predictions': None, 'analyses': None, 'errors': {}}
+    try:
+        result['predictions'] = models.var_predictor.predict_batch(history, points)
+    except Exception as e:
+        result['errors']['var'] = str(e)
+    try:
+        result['analyses'] = models.anomaly_detector.analyze_batch(points, history, activities)
+    except Exception as e:
+        result['errors']['anomaly'] = str(e)
+    return result
+
+
+def detect_anomaly(models, point, history):
+    return bool(models.anomaly_detector.detect_anomaly(point, history))
+
+
+OPS = {
+    'infer': infer,
+    'infer_batch': infer_batch,
+    'detect_anomaly': detect_anomaly,
+}
+
+
+class DeviceSession:
+    """A device's models as seen by callers; the same calls work locally and over IPC"""
+
+    def __init__(self, device_id, run):
+        self.device_id = device_id
+        self._run = run
+
+    def infer(self, point, history, activity):
+        return self._run('infer', point, history, activity)
+
+    def infer_batch(self, points, history, activities):
+        return self._run('infer_batch', points, history, activities)
+
+    def detect_anomaly(self, point, history):
+        return self._run('detect_anomaly', point, history)
+
+
+class LocalModelPool:
+    """In-process models (MODEL_WORKERS=0): the device registry behind the pool interface"""
+
+    def __init__(self, registry=None):
+        self.registry = registry or get_registry()
+
+    @contextmanager
+    def use(self, device_id):
+        with self.registry.use(device_id) as models:
+            yield DeviceSession(device_id, lambda op, *args: OPS[op](models, *args))
+
+    def close(self):
+        self.registry.save_all()
+
+    def get_info(self):
+        return {'mode': 'in-process', 'workers': 0, 'registry': self.registry.get_info()}
+
+
+class ConsistentHashRing:
+    """
+    Maps device ids to worker indexes
+
+    Every worker owns VIRTUAL_NODES points on a 64-bit ring; a device goes to the
+    first point at or after its hash. Changing the worker count moves only about
+    1/N of the devices, and the moved ones reload their spilled state.
+    """
+
+    def __init__(self, workers, virtual_nodes=VIRTUAL_NODES):
+        points = sorted(
+            (self._hash(f'worker-{worker}#{vnode}'), worker)
+            for worker in range(workers)
+            for vnode in range(virtual_nodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._workers = [w for _, w in points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+
+    def lookup(self, device_id):
+        i = bisect.bisect_left(self._hashes, self._hash(device_id))
+        return self._workers[i % len(self._workers)]
+
+
+def _worker_main(conn, index, max_resident, state_dir):
+    """
+    Worker process loop: (request_id, op, device_id, args) in, (request_id, ok, result) out
+
+    Requests are served one at a time, so a device's calls run in the order sent.
+    """
+    registry = DeviceModelRegistry(max_resident=max_resident, state_dir=state_dir)
+    print(f"🧩 Model worker {index} siap (pid {os.getpid()})")
+    try:
+        while True:
+            try:
+                request_id, op, device_id, args = pickle.loads(conn.recv_bytes())
+            except EOFError:
+                break
+            if op is None:
+                break
+            try:
+                with registry.use(device_id) as models:
+                    reply = (request_id, True, OPS[op](models, *args))
+            except Exception as e:
+                reply = (request_id, False, f'{type(e).__name__}: {e}')
+            conn.send_bytes(pickle.dumps(reply, protocol=pickle.HIGHEST_PROTOCOL))
+    finally:
+        # Spilled state lets the next owner of these devices carry on
+        registry.save_all()
+        conn.close()
+
+
+class _WorkerHandle:
+    """Parent side of one worker: its pipe, pending futures and a reader thread"""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.pending = {}
+        self.lock = threading.Lock()   # Guards conn writes, pending and restarts
+        self.starts = 0
+        self.requests = 0
+
+    def _start(self):
+        parent_conn, child_conn = self.pool.context.Pipe()
+        self.process = self.pool.context.Process(
+            target=_worker_main, name=f'model-worker-{self.index}', daemon=True,
+            args=(child_conn, self.index, self.pool.max_resident, self.pool.state_dir)
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.pending = {}
+        self.starts += 1
+        threading.Thread(target=self._read_loop, args=(parent_conn, self.pending),
+                         name=f'model-worker-{self.index}-reader', daemon=True).start()
+
+    def submit(self, request_id, op, device_id, args):
+        message = pickle.dumps((request_id, op, device_id, args), protocol=pickle.HIGHEST_PROTOCOL)
+        future = Future()
+        with self.lock:
+            if self.conn is None:
+                if self.starts:
+                    print(f"♻️ Model worker {self.index} dimulai ulang")
+                self._start()
+            self.pending[request_id] = future
+            self.requests += 1
+            try:
+                self.conn.send_bytes(message)
+            except (OSError, ValueError) as e:
+                del self.pending[request_id]
+                raise WorkerError(f'Model worker {self.index} unreachable: {e}')
+        return future
+
+    def _read_loop(self, conn, pending):
+        try:
+            while True:
+                request_id, ok, result = pickle.loads(conn.recv_bytes())
+                with self.lock:
+                    future = pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(WorkerError(result))
+        except (EOFError, OSError):
+            pass
+
+        # Worker exited: fail what it still owed; the next submit restarts it
+        with self.lock:
+            if self.conn is conn:
+                self.conn = None
+            failed = list(pending.values())
+            pending.clear()
+        for future in failed:
+            future.set_exception(WorkerError(f'Model worker {self.index} exited'))
+
+    def restart(self, reason, request_id=None):
+        """
+        Terminate the worker and start a new one; the calls it still owed fail with WorkerError
+
+        With request_id, only while that call is still pending (another timed-out
+        call may have restarted the worker already).
+        """
+        with self.lock:
+            if request_id is not None and request_id not in self.pending:
+                return
+            conn, process, failed = self.conn, self.process, list(self.pending.values())
+            self.pending.clear()
+            self.conn = None
+            if process is not None and process.is_alive():
+                process.terminate()
+                process.join(1)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+            if conn is not None:
+                conn.close()
+            print(f"♻️ Model worker {self.index} dimulai ulang: {reason}")
+            self._start()
+        for future in failed:
+            if not future.done():
+                future.set_exception(WorkerError(f'Model worker {self.index} restarted: {reason}'))
+
+    def stop(self, timeout):
+        with self.lock:
+            conn, self.conn = self.conn, None
+        if conn is None:
+            return
+        try:
+            conn.send_bytes(pickle.dumps((0, None, None, ())))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        conn.close()
+
+    def get_info(self):
+        alive = self.process is not None and self.process.is_alive()
+        return {
+            'index': self.index,
+            'pid': self.process.pid if alive else None,
+            'alive': alive,
+            'pending': len(self.pending),
+            'requests': self.requests,
+            'starts': self.starts
+        }
+
+
+class ModelWorkerPool:
+    """
+    VAR/DBSCAN inference sharded over worker processes
+
+    Each device always goes to the same worker (ConsistentHashRing), which keeps
+    the device's models resident in its own DeviceModelRegistry, so N devices'
+    model work runs on N cores instead of behind one GIL. Calls travel over a
+    pipe as pickled tuples (a 50-point history window is a few hundred bytes).
+
+    Workers are spawned, not forked: they never inherit locks held by request
+    threads. A dead worker fails its pending calls and is restarted on the next
+    call; its devices resume from their spilled state.
+    """
+
+    def __init__(self, workers, max_resident=MAX_RESIDENT_DEVICES, state_dir=MODEL_STATE_DIR,
+                 timeout=CALL_TIMEOUT_SECONDS):
+        """
+        Args:
+            workers: Number of worker processes
+            max_resident: Resident devices per worker before spilling to state_dir
+            state_dir: Shared directory for spilled device state
+            timeout: Seconds a call may wait for its worker
+        """
+        self.context = multiprocessing.get_context('spawn')
+        self.max_resident = max_resident
+        self.state_dir = state_dir
+        self.timeout = timeout
+        self.ring = ConsistentHashRing(workers)
+        self._workers = [_WorkerHandle(self, i) for i in range(workers)]
+        self._ids = itertools.count(1)
+        self._device_locks = {}   # device_id -> [Lock, users]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._workers)
+
+    def start(self):
+        """Start every worker now instead of on its first call"""
+        for worker in self._workers:
+            with worker.lock:
+                if worker.conn is None:
+                    worker._start()
+
+    def worker_for(self, device_id):
+        return self.ring.lookup(device_id)
+
+    def submit(self, device_id, op, *args):
+        """Send one call to the device's worker; returns a Future"""
+        return self._workers[self.worker_for(device_id)].submit(next(self._ids), op, device_id, args)
+
+    def call(self, device_id, op, *args):
+        """
+        Blocking submit(); raises WorkerError on failure
+
+        A call without an answer within timeout means the worker is stuck: it is
+        restarted (failing everything it still owed) and the call fails too.
+        """
+        worker = self._workers[self.worker_for(device_id)]
+        request_id = next(self._ids)
+        future = worker.submit(request_id, op, device_id, args)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            worker.restart(f'no answer within {self.timeout} s', request_id)
+            raise WorkerError(f'Model worker {worker.index} timed out after {self.timeout} s')
+
+    @contextmanager
+    def use(self, device_id):
+        """
+        A device's session; concurrent callers of one device queue here, so
+        whatever they do with the results (e.g. storing the point) stays in order
+        """
+        with self._lock:
+            entry = self._device_locks.get(device_id)
+            if entry is None:
+                entry = self._device_locks[device_id] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield DeviceSession(device_id, lambda op, *args: self.call(device_id, op, *args))
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._device_locks[device_id]
+
+    def close(self, timeout=10):
+        """Stop the workers (each saves its resident device state)"""
+        for worker in self._workers:
+            worker.stop(timeout)
+
+    def get_info(self):
+        return {
+            'mode': 'processes',
+            'workers': len(self._workers),
+            'max_resident_per_worker': self.max_resident,
+            'state_dir': self.state_dir,
+            'worker_stats': [worker.get_info() for worker in self._workers]
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Process-wide model pool: ModelWorkerPool with MODEL_WORKERS > 0, else LocalModelPool
+
+    Created on first use, so a Flask reloader parent never starts workers.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if MODEL_WORKERS > 0:
+                _pool = ModelWorkerPool(MODEL_WORKERS)
+                _pool.start()
+                print(f"🧩 Model worker pool: {MODEL_WORKERS} proses")
+            else:
+                _pool = LocalModelPool()
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,175 @@
+# File: flask_edge/models/activity_features.py
+# Rolling-window features of the activity Random Forest
+# Batch (pandas, used for training) and streaming (O(1) per point, used for serving) versions of the same features
+
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+from models.geo import bearing_deg
+
+WINDOW_SIZE = 5   # Points per rolling window (5 x 5 s = 25 s of context)
+
+BASE_FEATURES = ['speed_mps', 'acceleration_mps2', 'bearing']
+FEATURES = BASE_FEATURES + [
+    f'{col}_rol_{stat}_{WINDOW_SIZE}' for col in BASE_FEATURES for stat in ('mean', 'std')
+]
+
+
+def build_features(df, group='route_id'):
+    """
+    Training features for a DataFrame of GPS points (pandas reference implementation)
+
+    Args:
+        df: Columns timestamp, latitude, longitude, speed_mps and the group column
+        group: Column splitting independent tracks (route or device)
+
+    Returns:
+        DataFrame: df sorted by (group, timestamp) with the FEATURES columns added
+    """
+    df = df.sort_values(by=[group, 'timestamp']).copy()
+
+    # --- Basic features ---
+    time_diff = df.groupby(group)['timestamp'].diff().fillna(0)
+    speed_diff = df.groupby(group)['speed_mps'].diff().fillna(0)
+    df['acceleration_mps2'] = np.where(time_diff > 0, speed_diff / time_diff.where(time_diff > 0, 1), 0)
+
+    prev_lat = df.groupby(group)['latitude'].shift(1)
+    prev_lon = df.groupby(group)['longitude'].shift(1)
+    df['bearing'] = np.where(
+        prev_lat.notnull(),
+        bearing_deg(prev_lat.fillna(0), prev_lon.fillna(0), df['latitude'], df['longitude']),
+        0
+    )
+
+    # --- Rolling windows: mean and sample std of the last WINDOW_SIZE points per group ---
+    for col in BASE_FEATURES:
+        rolling = df.groupby(group)[col].rolling(window=WINDOW_SIZE, min_periods=1)
+        df[f'{col}_rol_mean_{WINDOW_SIZE}'] = rolling.mean().reset_index(level=0, drop=True)
+        df[f'{col}_rol_std_{WINDOW_SIZE}'] = rolling.std().reset_index(level=0, drop=True)
+
+    # std of a single point is NaN
+    df[FEATURES] = df[FEATURES].fillna(0)
+    return df
+
+
+class RollingStats:
+    """
+    Mean and sample std of the last `window` values, O(1) per update
+
+    Welford's running mean/M2 with the leaving value removed by the inverse
+    update. The sums are rebuilt from the window now and then so rounding
+    error cannot accumulate over a long-running stream.
+    """
+
+    RESYNC_EVERY = 1024
+
+    def __init__(self, window=WINDOW_SIZE):
+        self.window = window
+        self.values = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+        self._updates = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def push(self, x):
+        if len(self.values) == self.window:
+            self._remove(self.values.popleft())
+        self.values.append(x)
+        n = len(self.values)
+        delta = x - self.mean
+        self.mean += delta / n
+        self.m2 += delta * (x - self.mean)
+
+        self._updates += 1
+        if self._updates % self.RESYNC_EVERY == 0:
+            self.mean = sum(self.values) / n
+            self.m2 = sum((v - self.mean) ** 2 for v in self.values)
+
+    def _remove(self, x):
+        """Inverse Welford update for x, already popped from values"""
+        n = len(self.values)
+        if n == 0:
+            self.mean = self.m2 = 0.0
+            return
+        delta = x - self.mean
+        self.mean -= delta / n
+        self.m2 -= delta * (x - self.mean)
+
+    def std(self):
+        """Sample std (ddof=1); 0 for a single value, like the training fillna(0)"""
+        n = len(self.values)
+        if n < 2:
+            return 0.0
+        return math.sqrt(max(self.m2, 0.0) / (n - 1))
+
+
+class OnlineFeatureExtractor:
+    """
+    Streaming FEATURES for one device
+
+    Keeps the previous point and one RollingStats per base feature, so each new
+    point costs O(1) instead of re-windowing the history. Produces the same
+    values as build_features() over the same ordered track.
+    """
+
+    def __init__(self, window=WINDOW_SIZE):
+        self.window = window
+        self.last = None   # (timestamp, lat, lon, speed_mps)
+        self.stats = [RollingStats(window) for _ in BASE_FEATURES]
+        self.lock = threading.Lock()   # For callers sharing one extractor across threads
+
+    def __len__(self):
+        return len(self.stats[0])
+
+    def _base(self, timestamp, lat, lon, speed_mps):
+        if self.last is None:
+            return [speed_mps, 0.0, 0.0]
+        prev_ts, prev_lat, prev_lon, prev_speed = self.last
+        time_diff = timestamp - prev_ts
+        acceleration = (speed_mps - prev_speed) / time_diff if time_diff > 0 else 0.0
+        bearing = float(bearing_deg(prev_lat, prev_lon, lat, lon))
+        return [speed_mps, acceleration, bearing]
+
+    def push(self, timestamp, lat, lon, speed_mps):
+        """
+        Add the next point of the track and return its feature vector
+
+        Returns:
+            list: Values in FEATURES order
+        """
+        base = self._base(timestamp, lat, lon, speed_mps)
+        self.last = (timestamp, lat, lon, speed_mps)
+        features = list(base)
+        for stats, value in zip(self.stats, base):
+            stats.push(value)
+        for stats in self.stats:
+            features += [stats.mean, stats.std()]
+        return features
+
+    def seed(self, points):
+        """
+        Warm up from recent history (dicts with lat/lon/speed km/h/timestamp, oldest first)
+
+        window + 1 points are enough: the oldest only provides the previous
+        point of the next one and leaves the rolling windows again.
+        """
+        for point in points[-(self.window + 1):]:
+            self.push(int(point['timestamp']), float(point['lat']), float(point['lon']),
+                      float(point.get('speed', 0) or 0) / 3.6)
+
+    def peek(self, timestamp, lat, lon, speed_mps):
+        """Features the point would get, without adding it (e.g. a point that is not stored)"""
+        base = self._base(timestamp, lat, lon, speed_mps)
+        features = list(base)
+        for stats, value in zip(self.stats, base):
+            values = list(stats.values)[-(self.window - 1):] if self.window > 1 else []
+            values.append(value)
+            mean = sum(values) / len(values)
+            std = math.sqrt(sum((v - mean) ** 2 for v in values) / (len(values) - 1)) if len(values) > 1 else 0.0
+            features += [mean, std]
+        return features
@@ -0,0 +1,154 @@
+# File: flask_edge/models/artifact_cache.py
+# Shared cache of trained model artifacts (joblib files)
+# Lazy, memory-mapped loading, content-hash versions and hot reload when a file changes on disk
+
+import hashlib
+import os
+import threading
+import time
+
+import joblib
+
+# How often get() may stat the file for changes (seconds)
+RELOAD_CHECK_SECONDS = 2.0
+
+
+def save_artifact(value, path):
+    """
+    joblib.dump to a temp file, then rename over path
+
+    Never rewrite an artifact in place: running processes may have it memory-mapped.
+    """
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    joblib.dump(value, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def content_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file's bytes (hex)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelArtifact:
+    """
+    One artifact file, loaded on first use
+
+    Arrays inside the pickle are memory-mapped read-only (joblib mmap_mode='r'),
+    so they are paged in on demand and shared with other processes mapping the
+    same file. The loaded object is versioned by the file's content hash: a
+    changed mtime/size triggers a re-hash, and only a different hash reloads.
+    A file that fails to load keeps the previous object.
+    """
+
+    def __init__(self, path, check_seconds=RELOAD_CHECK_SECONDS, mmap_mode='r'):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.mmap_mode = mmap_mode
+        self.version = None        # Content hash of the loaded object
+        self.loaded_at = None
+        self.loads = 0
+        self.error = None
+        self._value = None
+        self._stat = None          # (mtime_ns, size) last seen
+        self._failed_version = None
+        self._missing = False
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Loaded object (None while the file is missing or has never loaded)"""
+        if time.monotonic() - self._checked_at >= self.check_seconds:
+            self.refresh()
+        return self._value
+
+    def refresh(self):
+        """Reload if the file's content changed; returns True when a new version was loaded"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                if not self._missing:
+                    print(f"No pre-trained model found at {self.path}")
+                self._missing = True
+                self._stat = None
+                return False
+            self._missing = False
+
+            stat = (st.st_mtime_ns, st.st_size)
+            if stat == self._stat:
+                return False
+            self._stat = stat
+
+            version = content_hash(self.path)
+            if version in (self.version, self._failed_version):
+                return False
+            try:
+                value = joblib.load(self.path, mmap_mode=self.mmap_mode)
+            except Exception as e:
+                # Logged once per version; the previous object stays in use
+                self._failed_version = version
+                self.error = str(e)
+                print(f"Error loading model: {e}")
+                return False
+
+            reloaded = self.version is not None
+            self._value = value
+            self.version = version
+            self.loaded_at = time.time()
+            self.loads += 1
+            self.error = None
+            print(f"📦 Model {'reloaded' if reloaded else 'loaded'}: {self.path} (v{version[:12]})")
+            return True
+
+    def get_info(self):
+        return {
+            'path': self.path,
+            'version': self.version[:12] if self.version else None,
+            'loaded': self._value is not None,
+            'loads': self.loads,
+            'loaded_at': self.loaded_at,
+            'error': self.error
+        }
+
+
+class ArtifactCache:
+    """One ModelArtifact per file path, shared by every consumer in the process"""
+
+    def __init__(self):
+        self._artifacts = {}
+        self._lock = threading.Lock()
+
+    def artifact(self, path):
+        key = os.path.abspath(path)
+        with self._lock:
+            artifact = self._artifacts.get(key)
+            if artifact is None:
+                artifact = self._artifacts[key] = ModelArtifact(path)
+            return artifact
+
+    def get(self, path):
+        """Shortcut for artifact(path).get()"""
+        return self.artifact(path).get()
+
+    def get_info(self):
+        with self._lock:
+            artifacts = list(self._artifacts.values())
+        return [artifact.get_info() for artifact in artifacts]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide ArtifactCache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArtifactCache()
+        return _cache
@@ -2,17 +2,24 @@
 # Context-Aware Anomaly Detection for GPS Route Tracking
 
 import numpy as np
-import math
-import sqlite3
 from datetime import datetime, timedelta
 
+import storage
+from models.geo import haversine_m, pairwise_m
+from models.spatial_index import GeoGridIndex
+from models.normal_regions import NormalRegionModel
+
 class AnomalyDetector:
     """
     Context-aware anomaly detector for GPS route deviation detection
     Uses dynamic thresholds based on activity type and user behavior patterns
+    
+    Normal behaviour comes from DBSCAN regions fitted in the background over the
+    full history, plus a grid index of points seen since the detector started.
     """
     
-    def __init__(self, base_threshold_meters=1000):
+    def __init__(self, base_threshold_meters=1000, max_normal_locations=200_000,
+                 refit_interval_seconds=3600, device_id=None):
         # Dynamic thresholds based on activity
         self.thresholds = {
             'stationary': 2000,      # More tolerant for stationary points
@@ -23,14 +30,27 @@ class AnomalyDetector:
             'unknown': base_threshold_meters
         }
         
-        self.normal_locations = []
+        # Normal-location memory: grid index with FIFO eviction
+        self.normal_locations = GeoGridIndex(capacity=max_normal_locations)
+        self.last_timestamp = None  # Newest history point already indexed
         self.frequent_locations = {}  # Store frequently visited locations
+        self._frequent_arrays = (np.empty(0), np.empty(0), np.empty(0))  # lat, lon, radius
+        # History of this device only (None: every device)
+        self.device_id = device_id
+        # Whole-history normal regions (DBSCAN, refit on a background thread)
+        self.regions = NormalRegionModel(device_id=device_id)
+        self.refit_interval_seconds = refit_interval_seconds
         self.is_trained = False
         self.min_training_points = 20
+        self._memo = None  # (key, result) of the last analyze() call
         
-    def detect_anomaly(self, current_location, route_history, activity='unknown'):
+    def analyze(self, current_location, route_history, activity='unknown'):
         """
-        Context-aware anomaly detection with dynamic thresholds
+        Single-pass anomaly analysis: decision, confidence and diagnostics together
+        
+        Training data is updated and distances are computed once per point; asking
+        again for the same point and history (e.g. detect_anomaly followed by
+        get_anomaly_confidence) returns the memoized result.
         
         Args:
             current_location: dict with 'lat', 'lon', 'speed' keys
@@ -38,79 +58,268 @@ class AnomalyDetector:
             activity: Current activity type (stationary, walking, etc.)
             
         Returns:
-            bool: True if anomaly detected, False otherwise
+            dict: is_anomaly, confidence, min_distance, threshold and context details
         """
+        key = self._memo_key(current_location, route_history, activity)
+        memo = self._memo
+        if memo is not None and memo[0] == key:
+            return dict(memo[1])
+        
         try:
-            # Need sufficient history for anomaly detection
-            if len(route_history) < self.min_training_points:
-                return False  # Not enough data to determine normal behavior
-            
+            result = self._analyze(current_location, route_history, activity)
+        except Exception as e:
+            print(f"Anomaly detection error: {e}")
+            result = {
+                'confidence': 0.5,
+                'is_anomaly': False,
+                'reason': f'Error: {str(e)}',
+                'activity': activity
+            }
+        
+        self._memo = (key, result)
+        return dict(result)
+    
+    def _memo_key(self, current_location, route_history, activity):
+        """Identity of one inference: the point, its activity and the newest history point"""
+        newest = route_history[-1] if len(route_history) else None
+        return (
+            current_location.get('lat'), current_location.get('lon'),
+            current_location.get('speed'), current_location.get('timestamp'),
+            activity, len(route_history),
+            newest.get('timestamp') if newest is not None else None
+        )
+    
+    def _analyze(self, current_location, route_history, activity):
+        # Need sufficient history for anomaly detection
+        enough_history = len(route_history) >= self.min_training_points
+        if enough_history:
             # Load and update training data
             self._update_training_data(route_history)
-            
-            # Get dynamic threshold based on activity and context
-            threshold = self._get_dynamic_threshold(current_location, activity)
-            
-            # Context-based filtering: Skip anomaly detection for certain scenarios
-            if self._should_skip_detection(current_location, activity):
-                return False
-            
-            # Calculate minimum distance to normal locations
-            current_lat = current_location['lat']
-            current_lon = current_location['lon']
-            
-            min_distance = self._calculate_min_distance_to_normal(current_lat, current_lon)
-            
+        
+        if not self.normal_locations and not self.frequent_locations and not self.regions:
+            return {
+                'confidence': 0.5,
+                'is_anomaly': False,
+                'reason': 'Insufficient training data',
+                'activity': activity,
+                'threshold_used': self.thresholds.get(activity, self.thresholds['unknown'])
+            }
+        
+        current_lat = current_location['lat']
+        current_lon = current_location['lon']
+        speed = current_location.get('speed', 0)
+        
+        # Context computed once and shared by threshold, skip rules and confidence
+        near_frequent = self._is_near_frequent_location(current_location)
+        threshold = self._get_dynamic_threshold(current_location, activity, near_frequent)
+        # Distances are searched up to 2x the threshold, where every decision saturates
+        distance_bound = threshold * 2
+        min_distance = self._calculate_min_distance_to_normal(current_lat, current_lon, distance_bound)
+        beyond_bound = min_distance > distance_bound
+        
+        is_anomaly = False
+        # Context-based filtering: Skip anomaly detection for certain scenarios
+        if enough_history and not self._should_skip_detection(current_location, activity, near_frequent):
             # Check if location is anomalous
             is_anomaly = min_distance > threshold
             
             # Additional context checks
             if is_anomaly:
                 is_anomaly = self._validate_anomaly(current_location, activity, min_distance, threshold)
+        
+        # Enhanced confidence calculation
+        normalized_distance = min_distance / threshold
+        
+        # Base confidence from distance
+        if normalized_distance <= 0.5:
+            confidence = 0.95  # Very confident it's normal
+        elif normalized_distance <= 1.0:
+            confidence = 0.85 - (0.35 * normalized_distance)  # Decreasing confidence
+        else:
+            # Anomaly detected
+            confidence = min(0.95, 0.6 + (0.35 * min(normalized_distance - 1.0, 1.0)))
+        
+        # Adjust confidence based on context
+        if activity == 'stationary' and speed < 2.0:
+            if not is_anomaly:
+                confidence = max(confidence, 0.9)  # High confidence for normal stationary
+            else:
+                confidence = max(confidence, 0.8)  # Still fairly confident even if anomaly
+        
+        if near_frequent and not is_anomaly:
+            confidence = max(confidence, 0.92)
+        
+        return {
+            'confidence': confidence,
+            'is_anomaly': is_anomaly,
+            # None: farther than min_distance_bound (the exact distance is not searched for)
+            'min_distance': None if beyond_bound else min_distance,
+            'min_distance_bound': distance_bound,
+            'threshold': threshold,
+            'normalized_distance': None if beyond_bound else normalized_distance,
+            'activity': activity,
+            'speed': speed,
+            'near_frequent_location': near_frequent,
+            'threshold_used': threshold,
+            'training_points': len(self.normal_locations),
+            'normal_regions': len(self.regions),
+            'frequent_locations_count': len(self.frequent_locations)
+        }
+    
+    def analyze_batch(self, points, route_history, activities, window=10):
+        """
+        Vectorized analyze() for an ordered batch of new points
+        
+        Every point is compared against the normal memory as it was before the
+        batch, the DBSCAN regions, the frequent locations and the previous `window`
+        points of the batch (the points a sequential run would just have indexed).
+        Thresholds, skip rules and confidences are computed as arrays. The batch is
+        indexed into the normal memory once at the end.
+        
+        Args:
+            points: New points with 'lat', 'lon', 'speed', 'timestamp', in order
+            route_history: GPS history preceding the batch
+            activities: Activity per point
+            window: Number of preceding batch points each point is compared to
             
-            return is_anomaly
-            
-        except Exception as e:
-            print(f"Anomaly detection error: {e}")
-            return False
+        Returns:
+            list: One analyze()-style dict per point
+        """
+        n = len(points)
+        lats = np.array([p['lat'] for p in points], dtype=float)
+        lons = np.array([p['lon'] for p in points], dtype=float)
+        speeds = np.array([p.get('speed', 0) or 0 for p in points], dtype=float)
+        activities = np.asarray(activities, dtype=object)
+        
+        # Same training update a sequential run does once history is long enough
+        enough = len(route_history) + np.arange(n) >= self.min_training_points
+        if enough.any():
+            first = int(np.argmax(enough))
+            history = route_history + points[:first] if first else route_history
+            self._update_training_data(history)
+        
+        if not self.normal_locations and not self.frequent_locations and not self.regions:
+            return [{
+                'confidence': 0.5,
+                'is_anomaly': False,
+                'reason': 'Insufficient training data',
+                'activity': activity,
+                'threshold_used': self.thresholds.get(activity, self.thresholds['unknown'])
+            } for activity in activities]
+        
+        # Frequent locations: (points x locations) distance matrix
+        f_lats, f_lons, f_radii = self._frequent_arrays
+        if len(f_lats):
+            frequent = pairwise_m(lats, lons, f_lats, f_lons)
+            near_frequent = (frequent <= f_radii).any(axis=1)
+            min_distance = frequent.min(axis=1)
+        else:
+            near_frequent = np.zeros(n, dtype=bool)
+            min_distance = np.full(n, np.inf)
+        
+        # Dynamic thresholds (see _get_dynamic_threshold)
+        base = np.array([self.thresholds.get(a, self.thresholds['unknown']) for a in activities], dtype=float)
+        threshold = np.where(speeds < 2.0, np.maximum(base, 1500), np.where(speeds > 50, base * 2, base))
+        threshold = np.where(near_frequent, base * 1.5, threshold)
+        
+        min_distance = np.minimum(min_distance, self.regions.distance_many(lats, lons))
+        distance_bound = threshold * 2
+        min_distance = np.minimum(min_distance, self.normal_locations.nearest_many(lats, lons, distance_bound))
+        for k in range(1, min(window, n - 1) + 1):
+            min_distance[k:] = np.minimum(min_distance[k:], haversine_m(lats[k:], lons[k:], lats[:-k], lons[:-k]))
+        
+        # Skip rules and validation (see _should_skip_detection / _validate_anomaly)
+        stationary = activities == 'stationary'
+        skip = (stationary & (speeds < 1.0)) | ((speeds < 5.0) & near_frequent)
+        limit = np.where(stationary & (speeds < 2.0), threshold * 2, threshold)
+        is_anomaly = enough & ~skip & (min_distance > limit)
+        
+        # Confidence (see _analyze)
+        normalized = min_distance / threshold
+        confidence = np.where(
+            normalized <= 0.5, 0.95,
+            np.where(normalized <= 1.0, 0.85 - 0.35 * normalized,
+                     np.minimum(0.95, 0.6 + 0.35 * np.minimum(normalized - 1.0, 1.0))))
+        stationary_slow = stationary & (speeds < 2.0)
+        confidence = np.where(stationary_slow, np.maximum(confidence, np.where(is_anomaly, 0.8, 0.9)), confidence)
+        confidence = np.where(near_frequent & ~is_anomaly, np.maximum(confidence, 0.92), confidence)
+        
+        self._index_new_points(points)
+        
+        return [{
+            'confidence': float(confidence[i]),
+            'is_anomaly': bool(is_anomaly[i]),
+            'min_distance': None if min_distance[i] > distance_bound[i] else float(min_distance[i]),
+            'min_distance_bound': float(distance_bound[i]),
+            'threshold': float(threshold[i]),
+            'normalized_distance': None if min_distance[i] > distance_bound[i] else float(normalized[i]),
+            'activity': activities[i],
+            'speed': float(speeds[i]),
+            'near_frequent_location': bool(near_frequent[i]),
+            'threshold_used': float(threshold[i]),
+            'training_points': len(self.normal_locations),
+            'normal_regions': len(self.regions),
+            'frequent_locations_count': len(self.frequent_locations)
+        } for i in range(n)]
+    
+    def close(self):
+        """Stop the background refit (before the detector is dropped or saved)"""
+        self.regions.stop()
+    
+    def detect_anomaly(self, current_location, route_history, activity='unknown'):
+        """
+        Context-aware anomaly detection with dynamic thresholds
+        
+        Returns:
+            bool: True if anomaly detected, False otherwise
+        """
+        return self.analyze(current_location, route_history, activity)['is_anomaly']
     
     def _update_training_data(self, route_history):
         """Update training data with recent history and frequent locations"""
         if not self.is_trained:
             # Initial training: use recent history
-            self.normal_locations = [(point['lat'], point['lon']) for point in route_history[-100:]]
+            self._index_new_points(route_history[-100:])
             
             # Build frequent locations from database history
             self._build_frequent_locations()
+            self.regions.start_background_refit(self.refit_interval_seconds)
             self.is_trained = True
         else:
-            # Incremental update: add recent points
-            recent_points = [(point['lat'], point['lon']) for point in route_history[-10:]]
-            self.normal_locations.extend(recent_points)
-            
-            # Keep only recent 200 points to avoid memory issues
-            if len(self.normal_locations) > 200:
-                self.normal_locations = self.normal_locations[-200:]
+            # Incremental update: add recent points (the index evicts the oldest)
+            self._index_new_points(route_history[-10:])
+            # No-op while running; restarts the refit after the detector was reloaded
+            self.regions.start_background_refit(self.refit_interval_seconds)
+    
+    def _index_new_points(self, points):
+        """Insert history points newer than the last indexed one (points without timestamp are always added)"""
+        for point in points:
+            timestamp = point.get('timestamp')
+            if timestamp is not None and self.last_timestamp is not None and timestamp <= self.last_timestamp:
+                continue
+            self.normal_locations.insert(point['lat'], point['lon'])
+            if timestamp is not None:
+                self.last_timestamp = timestamp
     
     def _build_frequent_locations(self):
         """Build frequently visited locations from historical data"""
         try:
-            conn = sqlite3.connect('gps_data.db')
-            
             # Get stationary points with low speed (likely frequent locations)
-            query = '''
+            device_filter = '' if self.device_id is None else 'AND device_id = ?'
+            params = () if self.device_id is None else (self.device_id,)
+            query = f'''
                 SELECT latitude, longitude, COUNT(*) as frequency
                 FROM gps_data 
                 WHERE speed < 2.0 AND activity IN ('stationary', 'unknown')
+                {device_filter}
                 GROUP BY ROUND(latitude, 4), ROUND(longitude, 4)
                 HAVING frequency >= 3
                 ORDER BY frequency DESC
                 LIMIT 20
             '''
             
-            cursor = conn.cursor()
-            cursor.execute(query)
-            results = cursor.fetchall()
+            with storage.connection() as conn:
+                results = conn.execute(query, params).fetchall()
             
             for lat, lon, freq in results:
                 location_key = f"{lat:.4f},{lon:.4f}"
@@ -121,18 +330,29 @@ class AnomalyDetector:
                     'radius': max(500, min(2000, freq * 100))  # Dynamic radius based on frequency
                 }
             
-            conn.close()
-            
         except Exception as e:
             print(f"Error building frequent locations: {e}")
             self.frequent_locations = {}
+        
+        locations = list(self.frequent_locations.values())
+        self._frequent_arrays = tuple(
+            np.array([location[field] for location in locations], dtype=float)
+            for field in ('lat', 'lon', 'radius')
+        )
+    
+    def _frequent_distances(self, current_lat, current_lon):
+        """Distances (meters) to every frequent location and their radii"""
+        lats, lons, radii = self._frequent_arrays
+        return haversine_m(current_lat, current_lon, lats, lons), radii
     
-    def _get_dynamic_threshold(self, current_location, activity):
+    def _get_dynamic_threshold(self, current_location, activity, near_frequent=None):
         """Get dynamic threshold based on activity and location context"""
         base_threshold = self.thresholds.get(activity, self.thresholds['unknown'])
+        if near_frequent is None:
+            near_frequent = self._is_near_frequent_location(current_location)
         
         # Check if near frequent location
-        if self._is_near_frequent_location(current_location):
+        if near_frequent:
             return base_threshold * 1.5  # More tolerant near frequent locations
         
         # Adjust based on speed
@@ -144,7 +364,7 @@ class AnomalyDetector:
         
         return base_threshold
     
-    def _should_skip_detection(self, current_location, activity):
+    def _should_skip_detection(self, current_location, activity, near_frequent=None):
         """Check if anomaly detection should be skipped for this scenario"""
         speed = current_location.get('speed', 0)
         
@@ -152,43 +372,41 @@ class AnomalyDetector:
         if activity == 'stationary' and speed < 1.0:
             return True
         
+        if near_frequent is None:
+            near_frequent = self._is_near_frequent_location(current_location)
+        
         # Skip if near a frequent location with low speed
-        if speed < 5.0 and self._is_near_frequent_location(current_location):
+        if speed < 5.0 and near_frequent:
             return True
         
         return False
     
     def _is_near_frequent_location(self, current_location):
         """Check if current location is near a frequently visited location"""
-        current_lat = current_location['lat']
-        current_lon = current_location['lon']
-        
-        for location_data in self.frequent_locations.values():
-            distance = self._haversine_distance(
-                current_lat, current_lon,
-                location_data['lat'], location_data['lon']
-            )
-            if distance <= location_data['radius']:
-                return True
+        if not self.frequent_locations:
+            return False
         
-        return False
+        distances, radii = self._frequent_distances(current_location['lat'], current_location['lon'])
+        return bool((distances <= radii).any())
     
-    def _calculate_min_distance_to_normal(self, current_lat, current_lon):
-        """Calculate minimum distance to any normal location"""
-        min_distance = float('inf')
+    def _calculate_min_distance_to_normal(self, current_lat, current_lon, max_distance=None):
+        """
+        Calculate minimum distance to any normal location
+        
+        Beyond max_distance the normal route memory only reports a lower bound
+        (> max_distance): enough for every threshold check, and far points do
+        not walk the whole grid. Callers report such distances as unknown.
+        """
+        # Nearest normal route point (grid search, cost independent of memory size)
+        min_distance = self.normal_locations.nearest(current_lat, current_lon, max_distance)
         
-        # Check distance to normal route points
-        for lat, lon in self.normal_locations:
-            distance = self._haversine_distance(current_lat, current_lon, lat, lon)
-            min_distance = min(min_distance, distance)
+        # Edge of the nearest DBSCAN normal region, O(regions)
+        min_distance = min(min_distance, self.regions.distance(current_lat, current_lon))
         
         # Check distance to frequent locations
-        for location_data in self.frequent_locations.values():
-            distance = self._haversine_distance(
-                current_lat, current_lon,
-                location_data['lat'], location_data['lon']
-            )
-            min_distance = min(min_distance, distance)
+        if self.frequent_locations:
+            distances, _ = self._frequent_distances(current_lat, current_lon)
+            min_distance = min(min_distance, float(distances.min()))
         
         return min_distance
     
@@ -210,19 +428,7 @@ class AnomalyDetector:
     
     def _haversine_distance(self, lat1, lon1, lat2, lon2):
         """Calculate Haversine distance between two GPS coordinates in meters"""
-        # Convert to radians
-        lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-        
-        # Haversine formula
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        
-        # Earth radius in meters
-        r = 6371000
-        
-        return c * r
+        return float(haversine_m(lat1, lon1, lat2, lon2))
     
     def get_anomaly_confidence(self, current_location, route_history, activity='unknown'):
         """
@@ -231,68 +437,4 @@ class AnomalyDetector:
         Returns:
             dict: Contains anomaly confidence score and detailed analysis
         """
-        try:
-            is_anomaly = self.detect_anomaly(current_location, route_history, activity)
-            
-            if not self.normal_locations and not self.frequent_locations:
-                return {
-                    'confidence': 0.5,
-                    'is_anomaly': False,
-                    'reason': 'Insufficient training data',
-                    'activity': activity,
-                    'threshold_used': self.thresholds.get(activity, self.thresholds['unknown'])
-                }
-            
-            # Calculate distances and metrics
-            current_lat = current_location['lat']
-            current_lon = current_location['lon']
-            speed = current_location.get('speed', 0)
-            
-            min_distance = self._calculate_min_distance_to_normal(current_lat, current_lon)
-            threshold = self._get_dynamic_threshold(current_location, activity)
-            
-            # Enhanced confidence calculation
-            normalized_distance = min_distance / threshold
-            
-            # Base confidence from distance
-            if normalized_distance <= 0.5:
-                confidence = 0.95  # Very confident it's normal
-            elif normalized_distance <= 1.0:
-                confidence = 0.85 - (0.35 * normalized_distance)  # Decreasing confidence
-            else:
-                # Anomaly detected
-                confidence = min(0.95, 0.6 + (0.35 * min(normalized_distance - 1.0, 1.0)))
-            
-            # Adjust confidence based on context
-            if activity == 'stationary' and speed < 2.0:
-                if not is_anomaly:
-                    confidence = max(confidence, 0.9)  # High confidence for normal stationary
-                else:
-                    confidence = max(confidence, 0.8)  # Still fairly confident even if anomaly
-            
-            # Check if near frequent location
-            near_frequent = self._is_near_frequent_location(current_location)
-            if near_frequent and not is_anomaly:
-                confidence = max(confidence, 0.92)
-            
-            return {
-                'confidence': confidence,
-                'is_anomaly': is_anomaly,
-                'min_distance': min_distance,
-                'threshold': threshold,
-                'normalized_distance': normalized_distance,
-                'activity': activity,
-                'speed': speed,
-                'near_frequent_location': near_frequent,
-                'threshold_used': threshold,
-                'training_points': len(self.normal_locations),
-                'frequent_locations_count': len(self.frequent_locations)
-            }
-            
-        except Exception as e:
-            return {
-                'confidence': 0.5,
-                'is_anomaly': False,
-                'reason': f'Error: {str(e)}',
-                'activity': activity
-            }
+        return self.analyze(current_location, route_history, activity)
@@ -0,0 +1,213 @@
+# File: flask_edge/models/device_registry.py
+# Per-device model state for a fleet of trackers
+# LRU-bounded registry of VAR predictors and anomaly detectors; idle devices are spilled to disk
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import joblib
+
+from models.var_model import VARLocationPredictor
+from models.dbscan_anomaly_model_simple import AnomalyDetector
+
+# Where evicted device state is written (relative to flask_edge/, override with MODEL_STATE_DIR)
+MODEL_STATE_DIR = os.environ.get('MODEL_STATE_DIR', 'model_state')
+MAX_RESIDENT_DEVICES = 64
+
+
+class DeviceModels:
+    """Model state of one device; use it only through DeviceModelRegistry.use()"""
+
+    def __init__(self, device_id, var_predictor=None, anomaly_detector=None, loading=False):
+        """
+        Args:
+            loading: Placeholder whose state is still being read from disk: its
+                lock is held until fill(), so users of the device wait on it
+        """
+        self.device_id = device_id
+        self.lock = threading.Lock()   # One inference per device at a time
+        self.users = 0
+        self.last_used = time.time()
+        if loading:
+            self.var_predictor = self.anomaly_detector = None
+            self.lock.acquire()
+        else:
+            self.var_predictor = var_predictor or VARLocationPredictor(backend='numpy')
+            self.anomaly_detector = anomaly_detector or AnomalyDetector(device_id=device_id)
+
+    def fill(self, models):
+        """Take over the state of loaded models and release a placeholder"""
+        self.var_predictor = models.var_predictor
+        self.anomaly_detector = models.anomaly_detector
+        self.lock.release()
+
+    def close(self):
+        self.anomaly_detector.close()
+
+
+class DeviceModelRegistry:
+    """
+    Resident model state for the most recently used devices
+
+    use(device_id) hands out a device's models for the duration of a with-block
+    and serializes inference per device. Beyond max_resident devices the least
+    recently used idle one is saved with joblib and dropped; its next use loads
+    it back, so a device keeps its VAR fit and normal-location memory across
+    evictions and restarts.
+    """
+
+    def __init__(self, max_resident=MAX_RESIDENT_DEVICES, state_dir=MODEL_STATE_DIR):
+        """
+        Args:
+            max_resident: Max devices kept in memory
+            state_dir: Directory for evicted device state (None: evicted state is discarded)
+        """
+        self.max_resident = max_resident
+        self.state_dir = state_dir
+        self._devices = OrderedDict()
+        self._spilling = {}   # device_id -> models being written out
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._devices)
+
+    def _state_path(self, device_id):
+        digest = hashlib.sha1(str(device_id).encode()).hexdigest()[:16]
+        safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(device_id))[:40]
+        return os.path.join(self.state_dir, f'{safe}-{digest}.pkl')
+
+    def _load(self, device_id):
+        if self.state_dir:
+            path = self._state_path(device_id)
+            if os.path.exists(path):
+                try:
+                    state = joblib.load(path)
+                    with self._lock:
+                        self.loads += 1
+                    return DeviceModels(device_id, state['var_predictor'], state['anomaly_detector'])
+                except Exception as e:
+                    print(f"⚠️ Model state {device_id} tidak bisa dimuat, mulai baru: {e}")
+        return DeviceModels(device_id)
+
+    def save(self, models):
+        """Write a device's state to state_dir"""
+        if not self.state_dir:
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self._state_path(models.device_id)
+        joblib.dump({'var_predictor': models.var_predictor, 'anomaly_detector': models.anomaly_detector},
+                    path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def _evict_idle(self):
+        """Pop least recently used devices that are not in use (registry lock held)"""
+        evicted = []
+        for device_id in list(self._devices):
+            if len(self._devices) - len(evicted) <= self.max_resident:
+                break
+            if self._devices[device_id].users == 0:
+                models = self._spilling[device_id] = self._devices.pop(device_id)
+                evicted.append(models)
+        return evicted
+
+    @contextmanager
+    def use(self, device_id):
+        """
+        Borrow a device's models, loading them if needed
+
+        Yields:
+            DeviceModels
+        """
+        placeholder = None
+        with self._lock:
+            models = self._devices.get(device_id)
+            if models is None:
+                # A device being spilled is taken back as is, not re-read half-written
+                models = self._spilling.get(device_id)
+                if models is None:
+                    models = placeholder = DeviceModels(device_id, loading=True)
+                self._devices[device_id] = models
+            else:
+                self._devices.move_to_end(device_id)
+            models.users += 1
+            evicted = self._evict_idle()
+
+        # Disk writes and reads happen outside the registry lock; other users of
+        # a device being loaded wait on its placeholder's lock
+        for old in evicted:
+            self._spill(old)
+
+        try:
+            if placeholder is not None:
+                loaded = None
+                try:
+                    loaded = self._load(device_id)
+                finally:
+                    placeholder.fill(loaded or DeviceModels(device_id))
+            with models.lock:
+                models.last_used = time.time()
+                yield models
+        finally:
+            with self._lock:
+                models.users -= 1
+
+    def _spill(self, models):
+        with models.lock:
+            models.close()
+            try:
+                self.save(models)
+            except Exception as e:
+                print(f"⚠️ Gagal menyimpan model state {models.device_id}: {e}")
+        with self._lock:
+            if self._spilling.get(models.device_id) is models:
+                del self._spilling[models.device_id]
+            self.evictions += 1
+
+    def evict_idle(self, max_idle_seconds):
+        """Spill every device unused for max_idle_seconds"""
+        cutoff = time.time() - max_idle_seconds
+        with self._lock:
+            idle = [d for d, m in self._devices.items() if m.users == 0 and m.last_used < cutoff]
+            evicted = []
+            for device_id in idle:
+                models = self._spilling[device_id] = self._devices.pop(device_id)
+                evicted.append(models)
+        for models in evicted:
+            self._spill(models)
+        return len(evicted)
+
+    def save_all(self):
+        """Write every resident device's state (e.g. on shutdown)"""
+        with self._lock:
+            resident = list(self._devices.values())
+        for models in resident:
+            with models.lock:
+                self.save(models)
+
+    def get_info(self):
+        return {
+            'resident_devices': len(self._devices),
+            'max_resident': self.max_resident,
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'state_dir': self.state_dir
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Process-wide DeviceModelRegistry"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DeviceModelRegistry()
+        return _registry
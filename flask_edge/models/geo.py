@@ -0,0 +1,124 @@
+# File: flask_edge/models/geo.py
+# Vectorized geodesy kernels shared by the models, route builder and endpoints
+# Array-in/array-out haversine distance, bearing, pairwise matrices and path length (degrees in, meters out)
+
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    Haversine distance in meters
+
+    Args:
+        lat1, lon1: First point(s) in degrees
+        lat2, lon2: Second point(s) in degrees (all four broadcast, e.g. lats[:, None])
+
+    Returns:
+        np.ndarray: Distances in meters (0-d for scalar input)
+    """
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dlat = phi2 - phi1
+    dlon = np.radians(lon2) - np.radians(lon1)
+    a = np.sin(dlat / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def pairwise_m(lats1, lons1, lats2, lons2):
+    """(len(lats1), len(lats2)) matrix of haversine distances in meters"""
+    return haversine_m(np.asarray(lats1, dtype=float)[:, None], np.asarray(lons1, dtype=float)[:, None],
+                       np.asarray(lats2, dtype=float), np.asarray(lons2, dtype=float))
+
+
+def bearing_deg(lat1, lon1, lat2, lon2):
+    """Initial bearing from point 1 to point 2 in degrees [0, 360) (broadcasts like haversine_m)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+    dlon = lon2 - lon1
+    y = np.sin(dlon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    bearing = np.degrees(np.arctan2(y, x))
+    return (bearing + 360) % 360
+
+
+def step_distances_m(lats, lons):
+    """Distance of each step of a track: n points -> n - 1 meters"""
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    return haversine_m(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+def step_bearings_deg(lats, lons):
+    """Bearing of each step of a track: n points -> n - 1 degrees"""
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    return bearing_deg(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+def cumulative_distance_m(lats, lons):
+    """Distance travelled up to each point of a track (n values, starting at 0)"""
+    steps = step_distances_m(lats, lons)
+    return np.concatenate(([0.0], np.cumsum(steps)))
+
+
+def path_length_m(lats, lons):
+    """Total length of a track in meters"""
+    if len(lats) < 2:
+        return 0.0
+    return float(step_distances_m(lats, lons).sum())
+
+
+def _segment_distances(x, y, x1, y1, x2, y2):
+    """Distance from points (x, y) to the segment (x1, y1)-(x2, y2), planar meters"""
+    dx, dy = x2 - x1, y2 - y1
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return np.hypot(x - x1, y - y1)
+    t = np.clip(((x - x1) * dx + (y - y1) * dy) / length2, 0.0, 1.0)
+    return np.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+
+
+def douglas_peucker(lats, lons, tolerance_m):
+    """
+    Douglas-Peucker simplification of a track
+
+    Distances are measured in a local equirectangular projection (meters),
+    accurate for route-sized tracks. Each split is one vectorized
+    point-to-segment distance over the remaining span.
+
+    Args:
+        lats, lons: Track in degrees, in order
+        tolerance_m: Max distance of a dropped point from the simplified line
+
+    Returns:
+        np.ndarray: Boolean mask of the points to keep (first and last always kept)
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    n = len(lats)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    if n < 3:
+        return keep
+
+    y = lats * METERS_PER_DEGREE
+    x = lons * METERS_PER_DEGREE * math.cos(math.radians(float(lats.mean())))
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(x[first + 1:last], y[first + 1:last], x[first], y[first], x[last], y[last])
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance_m:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
@@ -0,0 +1,220 @@
+# File: flask_edge/models/normal_regions.py
+# DBSCAN "normal region" model for GPS anomaly detection
+# Clusters the full gps_data history (haversine metric) into compact region summaries
+
+import math
+import threading
+import time
+
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+import storage
+from models.geo import EARTH_RADIUS_M, METERS_PER_DEGREE, haversine_m
+
+# History is aggregated per ROUND(lat, 4) / ROUND(lon, 4) cell (~11 m) before
+# clustering; the visit count of each cell becomes its DBSCAN sample weight
+HISTORY_QUERY = '''
+    SELECT ROUND(latitude, 4) AS lat, ROUND(longitude, 4) AS lon, COUNT(*) AS visits
+    FROM gps_data
+    {where}
+    GROUP BY ROUND(latitude, 4), ROUND(longitude, 4)
+    ORDER BY visits DESC
+    LIMIT ?
+'''
+
+
+class NormalRegionModel:
+    """
+    Normal regions learned with DBSCAN over the whole location history
+
+    Each cluster is summarised as one or more circles (centroid, radius, visit
+    count, density); clusters that stretch along a route are split into tiles of
+    tile_meters so a summary never covers much more than the route itself.
+    Online checks are a vectorized distance to every summary, O(regions).
+
+    fit() builds the new summaries off to the side and swaps them in with one
+    assignment, so readers on other threads never see a half-built model.
+    """
+
+    def __init__(self, eps_meters=150, min_samples=5, tile_meters=500, max_cells=200_000, device_id=None):
+        """
+        Args:
+            eps_meters: DBSCAN neighbourhood radius in meters
+            min_samples: Min visits (weighted) for a core point
+            tile_meters: Max extent of one region summary along a cluster
+            max_cells: Max aggregated history cells fed to DBSCAN (most visited first)
+            device_id: Only learn from this device's history (None: every device)
+        """
+        self.eps_meters = eps_meters
+        self.min_samples = min_samples
+        self.tile_meters = tile_meters
+        self.max_cells = max_cells
+        self.device_id = device_id
+
+        self.regions = []
+        self._arrays = (np.empty(0), np.empty(0), np.empty(0))  # lat, lon, radius
+        self.fitted_at = None
+        self.fit_seconds = 0.0
+        self.history_points = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __getstate__(self):
+        # The refit thread is not carried over; restart it after loading
+        state = self.__dict__.copy()
+        del state['_stop'], state['_thread']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def fit(self, lats, lons, weights=None):
+        """
+        Cluster points and replace the region summaries
+
+        Args:
+            lats, lons: Point coordinates in degrees
+            weights: Optional visit count per point
+
+        Returns:
+            list: Region summaries (dicts with lat, lon, radius, points, density, cluster)
+        """
+        start = time.perf_counter()
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        weights = np.ones(len(lats)) if weights is None else np.asarray(weights, dtype=float)
+
+        regions = []
+        if len(lats):
+            labels = DBSCAN(
+                eps=self.eps_meters / EARTH_RADIUS_M,
+                min_samples=self.min_samples,
+                metric='haversine',
+                algorithm='ball_tree'
+            ).fit(np.radians(np.column_stack((lats, lons))), sample_weight=weights).labels_
+            regions = self._summarise(lats, lons, weights, labels)
+
+        self.regions = regions
+        self._arrays = tuple(np.array([r[f] for r in regions], dtype=float) for f in ('lat', 'lon', 'radius'))
+        self.history_points = int(weights.sum())
+        self.fitted_at = time.time()
+        self.fit_seconds = time.perf_counter() - start
+        return regions
+
+    def _summarise(self, lats, lons, weights, labels):
+        """Split every cluster into tiles and summarise each tile as a circle"""
+        clustered = labels >= 0
+        if not clustered.any():
+            return []
+
+        lats, lons, weights, labels = lats[clustered], lons[clustered], weights[clustered], labels[clustered]
+        tile_deg = self.tile_meters / METERS_PER_DEGREE
+        keys = np.column_stack((labels, np.floor(lats / tile_deg), np.floor(lons / tile_deg)))
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+
+        order = np.argsort(inverse.ravel(), kind='stable')
+        bounds = np.cumsum(np.bincount(inverse.ravel(), minlength=len(groups)))[:-1]
+        min_radius = self.eps_meters / 2
+
+        regions = []
+        for group, members in zip(groups, np.split(order, bounds)):
+            w = weights[members]
+            lat = float(np.average(lats[members], weights=w))
+            lon = float(np.average(lons[members], weights=w))
+            radius = float(haversine_m(lat, lon, lats[members], lons[members]).max())
+            visits = float(w.sum())
+            regions.append({
+                'cluster': int(group[0]),
+                'lat': lat,
+                'lon': lon,
+                'radius': radius,
+                'points': int(visits),
+                'density': visits / (math.pi * max(radius, min_radius) ** 2) * 1e6  # visits per km²
+            })
+        return regions
+
+    def load_history(self, path=None):
+        """Aggregated (lat, lon, visits) arrays from gps_data"""
+        with storage.connection(path) as conn:
+            if self.device_id is None:
+                rows = conn.execute(HISTORY_QUERY.format(where=''), (self.max_cells,)).fetchall()
+            else:
+                rows = conn.execute(HISTORY_QUERY.format(where='WHERE device_id = ?'),
+                                    (self.device_id, self.max_cells)).fetchall()
+        if not rows:
+            return np.empty(0), np.empty(0), np.empty(0)
+        data = np.array(rows, dtype=float)
+        return data[:, 0], data[:, 1], data[:, 2]
+
+    def fit_from_db(self, path=None):
+        """Refit over the full gps_data history"""
+        regions = self.fit(*self.load_history(path))
+        print(f"🗺️ Normal regions refit ({self.device_id or 'all devices'}): {len(regions)} regions from {self.history_points} points "
+              f"({self.fit_seconds * 1000:.0f} ms)")
+        return regions
+
+    def distance(self, lat, lon):
+        """
+        Distance in meters from a point to the edge of the nearest region
+
+        Returns:
+            float: 0 inside a region, inf when no regions are fitted
+        """
+        region_lats, region_lons, radii = self._arrays
+        if not len(region_lats):
+            return float('inf')
+        edge = haversine_m(lat, lon, region_lats, region_lons) - radii
+        return max(0.0, float(edge.min()))
+
+    def distance_many(self, lats, lons, chunk_elements=2_000_000):
+        """Vectorized distance() for arrays of points, in chunks of at most chunk_elements pairs"""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        out = np.full(len(lats), np.inf)
+        region_lats, region_lons, radii = self._arrays
+        if not len(region_lats):
+            return out
+
+        chunk = max(1, chunk_elements // len(region_lats))
+        for start in range(0, len(lats), chunk):
+            stop = start + chunk
+            edge = haversine_m(lats[start:stop, None], lons[start:stop, None], region_lats, region_lons) - radii
+            out[start:stop] = np.maximum(edge.min(axis=1), 0.0)
+        return out
+
+    def start_background_refit(self, interval_seconds=3600, path=None):
+        """Fit now and then every interval_seconds on a daemon thread (no-op if running)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def run():
+            while True:
+                try:
+                    self.fit_from_db(path)
+                except Exception as e:
+                    print(f"⚠️ Normal region refit failed: {e}")
+                if self._stop.wait(interval_seconds):
+                    return
+
+        self._thread = threading.Thread(target=run, name='normal-region-refit', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get_info(self):
+        return {
+            'regions': len(self.regions),
+            'clusters': len({r['cluster'] for r in self.regions}),
+            'history_points': self.history_points,
+            'fitted_at': self.fitted_at,
+            'fit_ms': round(self.fit_seconds * 1000, 1)
+        }
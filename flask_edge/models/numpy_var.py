@@ -0,0 +1,178 @@
+# File: flask_edge/models/numpy_var.py
+# Pure-NumPy VAR backend for GPS Location Prediction
+# Least-squares fitting, ADF stationarity test, AIC/BIC lag selection and forecasting
+# on contiguous arrays, mirroring the statsmodels computations used by var_model.py
+
+import math
+import numpy as np
+
+from models.online_var import lag_matrix
+
+# MacKinnon (1994) p-value approximation for the ADF test, constant only, N=1
+# (same coefficients statsmodels.tsa.adfvalues.mackinnonp uses)
+_TAU_MAX_C = 2.74
+_TAU_MIN_C = -18.83
+_TAU_STAR_C = -1.61
+_TAU_C_SMALLP = (2.1659, 1.4412, 3.8269e-2)
+_TAU_C_LARGEP = (1.7339, 9.3202e-1, -1.2745e-1, -1.0368e-2)
+
+
+def _ols(y, X):
+    """Pseudo-inverse least squares like statsmodels OLS, returning (params, residuals, rank, pinv)"""
+    pinv_x = np.linalg.pinv(X, rcond=1e-15)
+    params = pinv_x @ y
+    resid = y - X @ params
+    return params, resid, np.linalg.matrix_rank(X), pinv_x
+
+
+def _ols_aic(y, X):
+    """Gaussian AIC of a single-equation OLS fit (statsmodels OLS.aic)"""
+    _, resid, rank, _ = _ols(y, X)
+    nobs = y.shape[0]
+    ssr = float(resid @ resid)
+    llf = -nobs / 2.0 * (math.log(2 * math.pi) + math.log(ssr / nobs) + 1)
+    return -2 * llf + 2 * rank
+
+
+def _adf_design(x, xdiff, lags):
+    """Level + lagged differences design used by the ADF regression"""
+    nobs = xdiff.shape[0] - lags
+    design = np.empty((nobs, lags + 1))
+    design[:, 0] = x[-nobs - 1:-1]
+    for i in range(1, lags + 1):
+        design[:, i] = xdiff[lags - i:lags - i + nobs]
+    return design, xdiff[-nobs:]
+
+
+def mackinnon_pvalue(teststat):
+    """Approximate p-value for an ADF statistic with constant term"""
+    if teststat > _TAU_MAX_C:
+        return 1.0
+    if teststat < _TAU_MIN_C:
+        return 0.0
+    coef = _TAU_C_SMALLP if teststat <= _TAU_STAR_C else _TAU_C_LARGEP
+    z = sum(c * teststat ** i for i, c in enumerate(coef))
+    return 0.5 * math.erfc(-z / math.sqrt(2))
+
+
+def adfuller_pvalue(x):
+    """
+    Augmented Dickey-Fuller p-value with constant and AIC lag selection
+
+    Equivalent to statsmodels adfuller(x)[1] with default arguments.
+    """
+    x = np.ascontiguousarray(x, dtype=float)
+    if x.max() == x.min():
+        raise ValueError("Invalid input, x is constant")
+
+    nobs = x.shape[0]
+    maxlag = int(np.ceil(12.0 * np.power(nobs / 100.0, 1 / 4.0)))
+    maxlag = min(nobs // 2 - 2, maxlag)
+    if maxlag < 0:
+        raise ValueError("sample size is too short to use selected regression component")
+
+    xdiff = np.diff(x)
+
+    # Pick the number of lagged differences by AIC on a common sample
+    design, y = _adf_design(x, xdiff, maxlag)
+    full = np.hstack([np.ones((design.shape[0], 1)), design])
+    best_aic, best_lag = min((_ols_aic(y, full[:, :cols]), cols - 2)
+                             for cols in range(2, maxlag + 3))
+
+    design, y = _adf_design(x, xdiff, best_lag)
+    X = np.hstack([design, np.ones((design.shape[0], 1))])
+    params, resid, rank, pinv_x = _ols(y, X)
+    sigma2 = float(resid @ resid) / (y.shape[0] - rank)
+    bse = math.sqrt(sigma2 * (pinv_x[0] @ pinv_x[0]))
+    return mackinnon_pvalue(params[0] / bse)
+
+
+def is_stationary(x, alpha=0.05):
+    """Check stationarity with the ADF test (p-value <= alpha)"""
+    try:
+        return adfuller_pvalue(x) <= alpha
+    except Exception:
+        return False
+
+
+class VARResults:
+    """Fitted VAR(p) with intercept, exposing the attributes var_model.py reads"""
+
+    def __init__(self, data, lag, endog_names, offset=0):
+        data = np.ascontiguousarray(data, dtype=float)[offset:]
+        X, Y = lag_matrix(data, lag)
+
+        self.k_ar = lag
+        self.neqs = data.shape[1]
+        self.nobs = X.shape[0]
+        self.endog_names = list(endog_names)
+        self.params = np.linalg.lstsq(X, Y, rcond=None)[0]
+        self.resid = Y - X @ self.params
+        self.df_resid = self.nobs - X.shape[1]
+        self.sigma_u_mle = (self.resid.T @ self.resid) / self.nobs
+
+    @property
+    def info_criteria(self):
+        """AIC/BIC as defined by statsmodels VARResults.info_criteria"""
+        nobs = self.nobs
+        free_params = self.k_ar * self.neqs ** 2 + self.neqs
+        if self.df_resid:
+            # Cholesky raises on a singular residual covariance like logdet_symm
+            chol = np.linalg.cholesky(self.sigma_u_mle)
+            ld = 2 * np.sum(np.log(np.diag(chol)))
+        else:
+            ld = -np.inf
+        return {
+            'aic': ld + (2.0 / nobs) * free_params,
+            'bic': ld + (np.log(nobs) / nobs) * free_params
+        }
+
+    @property
+    def aic(self):
+        return self.info_criteria['aic']
+
+    @property
+    def bic(self):
+        return self.info_criteria['bic']
+
+    def forecast(self, y, steps):
+        """
+        Iterated forecast
+
+        Args:
+            y: Last k_ar observations, oldest first
+            steps: Number of steps ahead
+
+        Returns:
+            numpy.ndarray: Array of shape (steps, variables)
+        """
+        history = [np.asarray(row, dtype=float) for row in np.asarray(y)[-self.k_ar:]] if self.k_ar else []
+        out = np.empty((steps, self.neqs))
+        for h in range(steps):
+            x = np.concatenate([[1.0]] + history[::-1][:self.k_ar])
+            out[h] = x @ self.params
+            history.append(out[h])
+        return out
+
+
+def select_order(data, maxlags):
+    """
+    Lag order selection by information criteria
+
+    Equivalent to statsmodels VAR(data).select_order(maxlags).selected_orders
+    for the 'aic' and 'bic' keys: each lag is fitted on the same sample.
+    """
+    data = np.ascontiguousarray(data, dtype=float)
+    n_totobs, neqs = data.shape
+    max_estimable = (n_totobs - neqs - 1) // (1 + neqs)
+    if maxlags > max_estimable:
+        raise ValueError("maxlags is too large for the number of observations and "
+                         "the number of equations. The largest model cannot be estimated.")
+
+    ics = {'aic': [], 'bic': []}
+    for p in range(0, maxlags + 1):
+        result = VARResults(data, p, [], offset=maxlags - p)
+        for key, value in result.info_criteria.items():
+            ics[key].append(value)
+
+    return {key: int(np.argmin(values)) for key, values in ics.items()}
@@ -0,0 +1,201 @@
+# File: flask_edge/models/online_var.py
+# Online VAR (Vector Autoregression) engine for GPS Location Prediction
+# Keeps least-squares sufficient statistics so every new GPS point is a rank-one update
+
+import numpy as np
+
+
+def lag_matrix(data, lag):
+    """
+    Build the VAR regression design for a given lag order
+
+    Args:
+        data: 2D array (observations x variables), oldest observation first
+        lag: Lag order p
+
+    Returns:
+        tuple: (X, Y) where each row of X is [1, y(t-1), ..., y(t-p)] and Y holds y(t).
+               Column order matches statsmodels (const, L1.*, L2.*, ...)
+    """
+    data = np.ascontiguousarray(data, dtype=float)
+    neqs = data.shape[1]
+    nobs = data.shape[0] - lag
+
+    X = np.empty((nobs, 1 + lag * neqs))
+    X[:, 0] = 1.0
+    for i in range(1, lag + 1):
+        X[:, 1 + (i - 1) * neqs:1 + i * neqs] = data[lag - i:lag - i + nobs]
+
+    return X, data[lag:]
+
+
+class OnlineVAR:
+    """
+    Recursive least-squares VAR(p) with intercept
+
+    Stores X'X, X'Y and Y'Y for a fixed lag order. New observations are folded in
+    with a rank-one update (optionally with exponential forgetting), coefficients are
+    re-solved lazily, and a running score of standardized one-step errors flags drift
+    so the caller can reselect the lag order.
+    """
+
+    # Number of updates after a fit before drift is allowed to trigger
+    DRIFT_WARMUP = 5
+
+    def __init__(self, forgetting_factor=1.0, drift_threshold=5.0, drift_alpha=0.1):
+        self.forgetting_factor = forgetting_factor
+        self.drift_threshold = drift_threshold
+        self.drift_alpha = drift_alpha
+
+        self.k_ar = 0
+        self.neqs = 0
+        self.xtx = None
+        self.xty = None
+        self.yty = None
+        self.weight = 0.0
+        self.coefs = None
+        self.sigma2 = None
+        self.recent = None  # Last p observations, newest first
+        self.updates_since_fit = 0
+        self.drift_score = 0.0
+        self._dirty = False
+
+    @property
+    def is_fitted(self):
+        return self.xtx is not None
+
+    @property
+    def nobs(self):
+        return int(round(self.weight))
+
+    @property
+    def drift_detected(self):
+        return (self.updates_since_fit >= self.DRIFT_WARMUP and
+                self.drift_score > self.drift_threshold)
+
+    def fit(self, data, lag):
+        """
+        (Re)initialize sufficient statistics from a block of observations
+
+        Args:
+            data: 2D array (observations x variables), oldest first
+            lag: Lag order p
+        """
+        data = np.ascontiguousarray(data, dtype=float)
+        if data.ndim != 2 or data.shape[0] <= lag:
+            raise ValueError(f"Need more than {lag} observations to fit VAR({lag})")
+
+        X, Y = lag_matrix(data, lag)
+
+        self.k_ar = int(lag)
+        self.neqs = data.shape[1]
+        self.xtx = X.T @ X
+        self.xty = X.T @ Y
+        self.yty = Y.T @ Y
+        self.weight = float(X.shape[0])
+        self.recent = np.ascontiguousarray(data[::-1][:max(lag, 1)])
+        self.updates_since_fit = 0
+        self.drift_score = 0.0
+        self._solve()
+
+    def update(self, y):
+        """
+        Fold one new observation into the model
+
+        Args:
+            y: 1D array with one value per variable
+
+        Returns:
+            float: Mean squared standardized one-step error for this observation
+        """
+        y = np.asarray(y, dtype=float)
+        x = self._regressor()
+
+        if self._dirty:
+            self._solve()
+        error = y - x @ self.coefs
+        z = float(np.mean(error * error / np.maximum(self.sigma2, 1e-12)))
+
+        lam = self.forgetting_factor
+        self.xtx *= lam
+        self.xty *= lam
+        self.yty *= lam
+        self.xtx += np.outer(x, x)
+        self.xty += np.outer(x, y)
+        self.yty += np.outer(y, y)
+        self.weight = self.weight * lam + 1.0
+
+        if self.k_ar > 0:
+            self.recent[1:] = self.recent[:-1]
+        self.recent[0] = y
+
+        self.updates_since_fit += 1
+        self.drift_score = (1 - self.drift_alpha) * self.drift_score + self.drift_alpha * z
+        self._dirty = True
+        return z
+
+    def forecast(self, steps=1):
+        """
+        Forecast future observations by iterating the fitted recursion
+
+        Returns:
+            numpy.ndarray: Array of shape (steps, variables)
+        """
+        if self._dirty:
+            self._solve()
+
+        recent = self.recent.copy()
+        out = np.empty((steps, self.neqs))
+        for h in range(steps):
+            x = np.concatenate(([1.0], recent[:self.k_ar].ravel()))
+            out[h] = x @ self.coefs
+            if self.k_ar > 0:
+                recent[1:] = recent[:-1]
+                recent[0] = out[h]
+        return out
+
+    @property
+    def sigma_u_mle(self):
+        """Residual covariance (maximum likelihood, divided by nobs)"""
+        if self._dirty:
+            self._solve()
+        ssr = self.yty - self.coefs.T @ self.xty
+        return ssr / max(self.weight, 1.0)
+
+    def info_criteria(self):
+        """AIC/BIC computed the same way as statsmodels VARResults"""
+        nobs = max(self.weight, 1.0)
+        free_params = self.k_ar * self.neqs ** 2 + self.neqs
+        sign, logdet = np.linalg.slogdet(self.sigma_u_mle)
+        if sign <= 0:
+            logdet = -np.inf
+        return {
+            'aic': logdet + (2.0 / nobs) * free_params,
+            'bic': logdet + (np.log(nobs) / nobs) * free_params
+        }
+
+    @property
+    def aic(self):
+        return self.info_criteria()['aic']
+
+    @property
+    def bic(self):
+        return self.info_criteria()['bic']
+
+    def _regressor(self):
+        x = np.empty(1 + self.k_ar * self.neqs)
+        x[0] = 1.0
+        x[1:] = self.recent[:self.k_ar].ravel()
+        return x
+
+    def _solve(self):
+        try:
+            self.coefs = np.linalg.solve(self.xtx, self.xty)
+        except np.linalg.LinAlgError:
+            # Singular design (e.g. a stationary device repeating the same fix)
+            self.coefs = np.linalg.lstsq(self.xtx, self.xty, rcond=None)[0]
+
+        df_resid = max(self.weight - self.xtx.shape[0], 1.0)
+        ssr = np.diag(self.yty - self.coefs.T @ self.xty)
+        self.sigma2 = np.maximum(ssr, 0.0) / df_resid
+        self._dirty = False
@@ -1,57 +1,191 @@
 # File: flask_edge/models/random_forest_model_simple.py
 # Simplified Random Forest Classifier for Activity Recognition
 
+import threading
+from collections import OrderedDict
+
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-import joblib
-import os
+from models.artifact_cache import get_cache, save_artifact
+from models.activity_features import FEATURES, OnlineFeatureExtractor
+
+# Devices whose rolling feature state is kept (least recently used beyond this are re-seeded on demand)
+MAX_DEVICE_EXTRACTORS = 1024
 
 class ActivityClassifier:
     """
-    Simplified Random Forest classifier for transportation activity recognition
-    Uses only speed-based classification to avoid feature extraction complexity
+    Random Forest classifier for transportation activity recognition
+    
+    With a loaded rolling-window forest (train_random_forest.py, FEATURES) each
+    point is classified from streaming features kept per device; otherwise it
+    falls back to speed thresholds.
     """
     
+    # Confidence per predicted class (typical speed ranges score higher)
+    ACTIVITY_CONFIDENCE = {
+        'stationary': 0.9,
+        'walking': 0.85,
+        'cycling': 0.8,
+        'motor': 0.85,
+        'car': 0.9,
+        'bus': 0.75
+    }
+    
     def __init__(self, model_path='activity_model.pkl'):
-        self.model = None
         self.model_path = model_path
-        self.is_trained = False
         self.activity_labels = ['stationary', 'walking', 'cycling', 'motor', 'car', 'bus']
-        
-        # Try to load pre-trained model
-        self._load_model()
+        self._model = None  # Set by training; otherwise the shared, lazily loaded artifact
+        self._artifact = get_cache().artifact(model_path)
+        self._extractors = OrderedDict()  # device_id -> OnlineFeatureExtractor
+        self._extractors_lock = threading.Lock()
+    
+    @property
+    def model(self):
+        """Trained model: loaded from model_path on first access, reloaded when the file changes"""
+        if self._model is not None:
+            return self._model
+        return self._load_model()
+    
+    @model.setter
+    def model(self, value):
+        self._model = value
     
-    def classify_activity(self, current_gps, gps_history=None):
+    @property
+    def is_trained(self):
+        return self.model is not None
+    
+    def _forest(self):
+        """The loaded model if it is a rolling-window forest, else None"""
+        model = self.model
+        if getattr(model, 'n_features_in_', None) == len(FEATURES) and hasattr(model, 'predict_proba'):
+            return model
+        return None
+    
+    def _extractor(self, device_id, gps_history):
+        """Feature state of a device, seeded from its history on first use"""
+        with self._extractors_lock:
+            extractor = self._extractors.get(device_id)
+            if extractor is not None:
+                self._extractors.move_to_end(device_id)
+                return extractor
+            extractor = self._extractors[device_id] = OnlineFeatureExtractor()
+            while len(self._extractors) > MAX_DEVICE_EXTRACTORS:
+                self._extractors.popitem(last=False)
+        with extractor.lock:
+            if gps_history is not None and len(gps_history):
+                extractor.seed(gps_history)
+        return extractor
+    
+    def _features(self, extractor, points):
+        """Feature rows for points (km/h speeds); newer points advance the device's state"""
+        rows = []
+        with extractor.lock:
+            for point in points:
+                args = (int(point['timestamp']), float(point['lat']), float(point['lon']),
+                        float(point.get('speed', 0) or 0) / 3.6)
+                if extractor.last is None or args[0] > extractor.last[0]:
+                    rows.append(extractor.push(*args))
+                else:
+                    # Replayed or out-of-order point: classify without touching the state
+                    rows.append(extractor.peek(*args))
+        return rows
+    
+    def _predict_forest(self, forest, rows):
+        proba = forest.predict_proba(np.asarray(rows, dtype=float))
+        best = proba.argmax(axis=1)
+        return [str(forest.classes_[i]) for i in best], [float(p[i]) for p, i in zip(proba, best)]
+    
+    def analyze(self, current_gps, gps_history=None, device_id=None):
         """
-        Classify current activity based on GPS speed
+        Single-pass classification: activity and confidence in one model call
         
         Args:
-            current_gps: Current GPS point with 'speed' key
-            gps_history: Recent GPS history (optional, not used in simple version)
-              Returns:
-            str: Predicted activity class
+            current_gps: Current GPS point with 'speed' key (km/h, as sent by the ESP32)
+            gps_history: Recent GPS history of the device, oldest first (seeds its features)
+            device_id: Device whose streaming feature state to use and advance; without
+                       it the features come from gps_history alone and nothing is kept
+            
+        Returns:
+            dict: activity, confidence and the speed used
         """
         try:
-            # Get speed - ESP32 sends speed in km/h already
             speed_kmh = float(current_gps.get('speed', 0))
-            
-            # Speed-based activity classification with improved thresholds
-            if speed_kmh < 2.5:  # Threshold untuk GPS noise saat diam
-                return 'stationary'
-            elif speed_kmh < 6.0:  # Typical walking speed 3-5 km/h
-                return 'walking'
-            elif speed_kmh < 15:
-                return 'cycling'
-            elif speed_kmh < 40:
-                return 'motor'
-            elif speed_kmh < 80:
-                return 'car'
-            else:
-                return 'bus'
-                
         except Exception as e:
             print(f"Activity classification error: {e}")
+            return {'activity': 'stationary', 'confidence': 0.5, 'speed_kmh': None}
+        
+        # Streaming features need a located, timestamped point
+        has_fix = all(current_gps.get(key) is not None for key in ('lat', 'lon', 'timestamp'))
+        forest = self._forest() if has_fix else None
+        if forest is not None:
+            try:
+                if device_id is None:
+                    extractor = OnlineFeatureExtractor()
+                    if gps_history is not None and len(gps_history):
+                        extractor.seed(gps_history)
+                else:
+                    extractor = self._extractor(device_id, gps_history)
+                activities, confidences = self._predict_forest(forest, self._features(extractor, [current_gps]))
+                return {'activity': activities[0], 'confidence': confidences[0], 'speed_kmh': speed_kmh}
+            except Exception as e:
+                print(f"Activity forest error, using speed thresholds: {e}")
+        
+        activity = self._activity_for_speed(speed_kmh)
+        return {
+            'activity': activity,
+            'confidence': self.ACTIVITY_CONFIDENCE[activity],
+            'speed_kmh': speed_kmh
+        }
+    
+    # Upper speed bound (km/h, exclusive) of each class, in activity_labels order
+    SPEED_BINS = (2.5, 6.0, 15, 40, 80)
+    
+    def analyze_batch(self, speeds_kmh, points=None, device_id=None, gps_history=None):
+        """
+        Vectorized analyze() for an array of speeds (km/h)
+        
+        With points (dicts with lat/lon/speed/timestamp, oldest first) and a
+        device_id, a loaded forest classifies them from streaming features in
+        one predict_proba call.
+        
+        Returns:
+            tuple: (list of activities, list of confidences)
+        """
+        forest = self._forest() if points is not None and device_id is not None else None
+        if forest is not None:
+            try:
+                extractor = self._extractor(device_id, gps_history)
+                return self._predict_forest(forest, self._features(extractor, points))
+            except Exception as e:
+                print(f"Activity forest error, using speed thresholds: {e}")
+        
+        classes = np.searchsorted(self.SPEED_BINS, np.asarray(speeds_kmh, dtype=float), side='right')
+        activities = [self.activity_labels[c] for c in classes]
+        return activities, [self.ACTIVITY_CONFIDENCE[a] for a in activities]
+    
+    @staticmethod
+    def _activity_for_speed(speed_kmh):
+        """Speed-based activity classification with improved thresholds"""
+        if speed_kmh < 2.5:  # Threshold untuk GPS noise saat diam
             return 'stationary'
+        elif speed_kmh < 6.0:  # Typical walking speed 3-5 km/h
+            return 'walking'
+        elif speed_kmh < 15:
+            return 'cycling'
+        elif speed_kmh < 40:
+            return 'motor'
+        elif speed_kmh < 80:
+            return 'car'
+        else:
+            return 'bus'
+    
+    def classify_activity(self, current_gps, gps_history=None, device_id=None):
+        """
+        Classify current activity (see analyze)
+        
+        Returns:
+            str: Predicted activity class
+        """
+        return self.analyze(current_gps, gps_history, device_id)['activity']
     
     def get_prediction_confidence(self, current_gps, gps_history=None):
         """
@@ -60,54 +194,22 @@ class ActivityClassifier:
         Returns:
             float: Confidence score between 0 and 1
         """
-        try:
-            speed = float(current_gps.get('speed', 0)) * 3.6  # Convert to km/h
-              # Higher confidence for typical speed ranges
-            if speed < 2.0:  # stationary - increased threshold
-                return 0.9
-            elif speed < 6.0:  # walking - adjusted threshold  
-                return 0.85
-            elif speed < 15:  # cycling
-                return 0.8
-            elif speed < 40:  # motor
-                return 0.85
-            elif speed < 80:  # car
-                return 0.9
-            else:  # bus/high speed
-                return 0.75
-                
-        except Exception as e:
-            print(f"Confidence calculation error: {e}")
-            return 0.5
+        return self.analyze(current_gps, gps_history)['confidence']
     
     def _load_model(self):
-        """Load pre-trained model if it exists"""
-        if os.path.exists(self.model_path):
-            try:
-                loaded_data = joblib.load(self.model_path)
-                
-                # Handle different model formats
-                if isinstance(loaded_data, dict):
-                    self.model = loaded_data.get('model')
-                    print("Model loaded from dictionary format")
-                else:
-                    self.model = loaded_data
-                    print("Model loaded from direct format")
-                
-                self.is_trained = True
-                
-            except Exception as e:
-                print(f"Error loading model: {e}")
-                self.model = None
-                self.is_trained = False
-        else:
-            print(f"No pre-trained model found at {self.model_path}")
+        """Pre-trained model from the shared artifact cache (None if missing or unloadable)"""
+        loaded_data = self._artifact.get()
+        
+        # Handle different model formats
+        if isinstance(loaded_data, dict):
+            return loaded_data.get('model')
+        return loaded_data
     
     def _save_model(self):
         """Save the trained model"""
         try:
             if self.model is not None:
-                joblib.dump(self.model, self.model_path)
+                save_artifact(self.model, self.model_path)
                 print(f"Model saved to {self.model_path}")
         except Exception as e:
             print(f"Error saving model: {e}")
@@ -158,13 +260,13 @@ class ActivityClassifier:
                 y.append('bus')
             
             # Train the model
+            from sklearn.ensemble import RandomForestClassifier
             X = np.array(X)
             y = np.array(y)
             
             self.model = RandomForestClassifier(n_estimators=50, random_state=42)
             self.model.fit(X, y)
             
-            self.is_trained = True
             self._save_model()
             
             print(f"Synthetic model trained with {len(X)} samples")
@@ -177,9 +279,23 @@ class ActivityClassifier:
     def get_model_info(self):
         """Get information about the current model"""
         return {
-            'algorithm': 'Speed-based Random Forest',
+            'algorithm': 'Rolling-window Random Forest' if self._forest() is not None else 'Speed-based Random Forest',
             'is_trained': self.is_trained,
             'model_path': self.model_path,
+            'model_version': self._artifact.get_info()['version'],
             'activity_labels': self.activity_labels,
-            'features': ['speed']
+            'features': FEATURES if self._forest() is not None else ['speed']
         }
+
+
+_classifiers = {}
+_classifiers_lock = threading.Lock()
+
+
+def get_classifier(model_path='activity_model.pkl'):
+    """Process-wide ActivityClassifier for a model file (one resident instance per path)"""
+    with _classifiers_lock:
+        classifier = _classifiers.get(model_path)
+        if classifier is None:
+            classifier = _classifiers[model_path] = ActivityClassifier(model_path)
+        return classifier
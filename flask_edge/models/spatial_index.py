@@ -0,0 +1,241 @@
+# File: flask_edge/models/spatial_index.py
+# Spatial index for GPS points (normal-location memory of the anomaly detector)
+# Uniform lat/lon grid with incremental inserts, FIFO eviction and nearest/radius queries
+
+import math
+from collections import deque
+
+import numpy as np
+
+from models.geo import METERS_PER_DEGREE, haversine_m, pairwise_m
+
+# nearest(): rings covering more than this share of the occupied cells give way to a full scan
+FULL_SCAN_FRACTION = 1 / 16
+SCAN_CHUNK = 1 << 22           # Max distance-matrix entries computed at once
+
+
+class GeoGridIndex:
+    """
+    Grid index of GPS points keyed by (lat, lon) cell
+
+    Points are quantized to `resolution` degrees (~1 m by default) and stored once
+    per quantized location with a reference count, so a device parked in one spot
+    does not fill a cell with duplicates. The oldest insert is evicted when more
+    than `capacity` inserts are held.
+
+    nearest() searches rings of cells outwards from the query cell and stops as
+    soon as no unsearched cell can hold a closer point, so its cost depends on the
+    local density rather than on the total number of points. A query far from
+    every point falls back to one vectorized scan after a few rings.
+    """
+
+    def __init__(self, cell_meters=250, capacity=200_000, resolution=1e-5):
+        """
+        Args:
+            cell_meters: Grid cell edge along a meridian, in meters
+            capacity: Max number of inserts kept (oldest are evicted first)
+            resolution: Quantization step in degrees for de-duplicating points
+        """
+        self.cell_meters = cell_meters
+        self.cell_deg = cell_meters / METERS_PER_DEGREE
+        self.capacity = capacity
+        self.resolution = resolution
+
+        self._cells = {}       # (row, col) -> {key: [lat, lon, count]}
+        self._arrays = {}      # (row, col) -> (lats, lons), rebuilt after the cell changes
+        self._all = None       # (lats, lons) of every cell for full scans, rebuilt after any change
+        self._order = deque()  # (key, cell) per insert, oldest first
+        self._distinct = 0
+
+    def __len__(self):
+        return len(self._order)
+
+    def __getstate__(self):
+        # The full-scan arrays are a cache; rebuilt on the first far query after loading
+        state = self.__dict__.copy()
+        state['_all'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_all', None)
+
+    @property
+    def distinct(self):
+        """Number of distinct (quantized) locations held"""
+        return self._distinct
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def insert(self, lat, lon):
+        """Add one point, evicting the oldest insert when over capacity"""
+        key = (round(lat / self.resolution), round(lon / self.resolution))
+        cell = self._cell(key[0] * self.resolution, key[1] * self.resolution)
+
+        bucket = self._cells.setdefault(cell, {})
+        entry = bucket.get(key)
+        if entry is None:
+            bucket[key] = [lat, lon, 1]
+            self._distinct += 1
+            self._arrays.pop(cell, None)
+            self._all = None
+        else:
+            entry[2] += 1
+        self._order.append((key, cell))
+
+        while len(self._order) > self.capacity:
+            self._evict()
+
+    def extend(self, points):
+        """Add (lat, lon) pairs, oldest first"""
+        for lat, lon in points:
+            self.insert(lat, lon)
+
+    def _evict(self):
+        key, cell = self._order.popleft()
+        bucket = self._cells[cell]
+        entry = bucket[key]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del bucket[key]
+            self._distinct -= 1
+            self._arrays.pop(cell, None)
+            self._all = None
+            if not bucket:
+                del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._arrays.clear()
+        self._all = None
+        self._order.clear()
+        self._distinct = 0
+
+    def _cell_arrays(self, cell):
+        arrays = self._arrays.get(cell)
+        if arrays is None:
+            points = np.array([entry[:2] for entry in self._cells[cell].values()], dtype=float)
+            arrays = self._arrays[cell] = (points[:, 0], points[:, 1])
+        return arrays
+
+    def _gather(self, cells):
+        parts = [self._cell_arrays(cell) for cell in cells if cell in self._cells]
+        if not parts:
+            return np.empty(0), np.empty(0)
+        return (np.concatenate([lats for lats, _ in parts]),
+                np.concatenate([lons for _, lons in parts]))
+
+    def _ring(self, row, col, k):
+        if k == 0:
+            return [(row, col)]
+        cells = [(row + dr, col + dc) for dr in (-k, k) for dc in range(-k, k + 1)]
+        cells += [(row + dr, col + dc) for dc in (-k, k) for dr in range(-k + 1, k)]
+        return cells
+
+    def _min_cell_meters(self, lat):
+        """Smallest cell edge (in meters) around a latitude; cells narrow towards the poles"""
+        widest_lat = min(abs(lat) + self.cell_deg, 90.0)
+        return self.cell_meters * max(math.cos(math.radians(widest_lat)), 0.01)
+
+    def nearest(self, lat, lon, max_distance=None):
+        """
+        Distance in meters to the nearest stored point
+
+        Args:
+            lat, lon: Query point in degrees
+            max_distance: Optional bound; the search stops once it is exceeded
+
+        Returns:
+            float: Distance in meters, inf when the index is empty. Beyond
+                   max_distance a lower bound (> max_distance) is returned instead.
+        """
+        return float(self.nearest_many([lat], [lon], max_distance)[0])
+
+    def nearest_many(self, lats, lons, max_distance=None):
+        """
+        nearest() for many query points at once
+
+        Queries are grouped by grid cell and each group searches the rings of
+        its cell together, one distance matrix per ring. Once the rings would
+        cover more than FULL_SCAN_FRACTION of the occupied cells (a point far
+        from everything) the rest of the group is answered by one vectorized
+        scan of all points instead.
+
+        Args:
+            lats, lons: Query points in degrees
+            max_distance: Optional bound (scalar or one per point)
+
+        Returns:
+            np.ndarray: Distances in meters (see nearest())
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        result = np.full(len(lats), np.inf)
+        if not self._cells or not len(lats):
+            return result
+        limits = np.broadcast_to(np.inf if max_distance is None else np.asarray(max_distance, dtype=float),
+                                 lats.shape)
+
+        rows = np.floor(lats / self.cell_deg).astype(np.int64)
+        cols = np.floor(lons / self.cell_deg).astype(np.int64)
+        groups = {}
+        for i, cell in enumerate(zip(rows.tolist(), cols.tolist())):
+            groups.setdefault(cell, []).append(i)
+
+        max_cells = FULL_SCAN_FRACTION * len(self._cells)
+        for (row, col), members in groups.items():
+            members = np.asarray(members)
+            g_lats, g_lons, g_limits = lats[members], lons[members], limits[members]
+            step = self._min_cell_meters(float(np.abs(g_lats).max()))
+            best = np.full(len(members), np.inf)
+            k = 0
+            while True:
+                if (2 * k + 1) ** 2 > max_cells:
+                    if self._all is None:
+                        self._all = self._gather(self._cells.keys())
+                    best = np.minimum(best, self._scan(g_lats, g_lons, *self._all))
+                    break
+
+                ring_lats, ring_lons = self._gather(self._ring(row, col, k))
+                if len(ring_lats):
+                    best = np.minimum(best, self._scan(g_lats, g_lons, ring_lats, ring_lons))
+
+                # Every point outside rings 0..k is at least k cell edges away
+                bound = k * step
+                if ((best <= bound) | (bound > g_limits)).all():
+                    best = np.minimum(best, bound)
+                    break
+                k += 1
+            result[members] = best
+        return result
+
+    @staticmethod
+    def _scan(lats, lons, point_lats, point_lons):
+        """Min distance from each query to the given points, in bounded-size matrix chunks"""
+        chunk = max(1, SCAN_CHUNK // len(point_lats))
+        return np.concatenate([pairwise_m(lats[i:i + chunk], lons[i:i + chunk], point_lats, point_lons).min(axis=1)
+                               for i in range(0, len(lats), chunk)])
+
+    def query_radius(self, lat, lon, radius):
+        """
+        Stored points within `radius` meters
+
+        Returns:
+            np.ndarray: (n, 2) array of [lat, lon] rows
+        """
+        if not self._cells:
+            return np.empty((0, 2))
+
+        row, col = self._cell(lat, lon)
+        k = math.ceil(radius / self._min_cell_meters(lat))
+        if (2 * k + 1) ** 2 >= len(self._cells):
+            cells = self._cells.keys()
+        else:
+            cells = [(row + dr, col + dc) for dr in range(-k, k + 1) for dc in range(-k, k + 1)]
+
+        lats, lons = self._gather(cells)
+        if not len(lats):
+            return np.empty((0, 2))
+        mask = haversine_m(lat, lon, lats, lons) <= radius
+        return np.column_stack((lats[mask], lons[mask]))
@@ -3,12 +3,16 @@
 # Predicts next GPS coordinates based on historical location data
 
 import numpy as np
-import pandas as pd
-from statsmodels.tsa.vector_ar.var_model import VAR
-from statsmodels.tsa.stattools import adfuller
 import warnings
 from datetime import datetime, timedelta
 
+from models.online_var import OnlineVAR, lag_matrix
+from models import numpy_var
+from models.geo import step_bearings_deg, step_distances_m
+
+# pandas/statsmodels are imported lazily by the 'statsmodels' backend only,
+# so the 'numpy' backend keeps them off the import and prediction path
+
 warnings.filterwarnings('ignore')
 
 class VARLocationPredictor:
@@ -17,12 +21,38 @@ class VARLocationPredictor:
     based on time series analysis of latitude and longitude coordinates
     """
     
-    def __init__(self, min_data_points=10, max_lag=5):
+    BACKENDS = ('statsmodels', 'numpy')
+    
+    def __init__(self, min_data_points=10, max_lag=5, online=True, refit_interval=500,
+                 drift_threshold=5.0, forgetting_factor=0.98, backend='statsmodels'):
+        """
+        Args:
+            min_data_points: Minimum history length before VAR is used
+            max_lag: Upper bound for lag order selection
+            online: Keep an incremental engine between calls instead of refitting
+            refit_interval: Reselect lag order after this many online updates
+            drift_threshold: Mean standardized squared error that triggers a refit
+            forgetting_factor: Exponential weight for old points (0.98 ~ 50-point memory)
+            backend: 'statsmodels' or 'numpy' (same results, no pandas/statsmodels import)
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown VAR backend '{backend}', expected one of {self.BACKENDS}")
+        
         self.min_data_points = min_data_points
         self.max_lag = max_lag
         self.model = None
         self.fitted_model = None
         self.last_training_data = None
+        self.training_columns = None
+        self.backend = backend
+
+        # Online engine state
+        self.online = online
+        self.refit_interval = refit_interval
+        self.engine = OnlineVAR(forgetting_factor, drift_threshold) if online else None
+        self.use_differences = False
+        self.last_level = None
+        self.last_timestamp = None
         
     def prepare_data(self, gps_history):
         """
@@ -34,11 +64,13 @@ class VARLocationPredictor:
         Returns:
             pandas.DataFrame: Prepared time series data
         """
+        import pandas as pd
+        
         if len(gps_history) < self.min_data_points:
             raise ValueError(f"Insufficient data points. Need at least {self.min_data_points}, got {len(gps_history)}")
         
-        # Convert to DataFrame
-        df = pd.DataFrame(gps_history)
+        # Convert to DataFrame (ring buffer windows expose their arrays directly)
+        df = pd.DataFrame(gps_history.columns() if hasattr(gps_history, 'columns') else gps_history)
         
         # Sort by timestamp
         df = df.sort_values('timestamp')
@@ -63,8 +95,37 @@ class VARLocationPredictor:
         else:
             return ts_data[['lat', 'lon']]
     
+    def prepare_array(self, gps_history):
+        """
+        NumPy equivalent of prepare_data
+        
+        Returns:
+            tuple: (2D float array oldest first, column names)
+        """
+        if len(gps_history) < self.min_data_points:
+            raise ValueError(f"Insufficient data points. Need at least {self.min_data_points}, got {len(gps_history)}")
+        
+        levels, _ = self._sorted_arrays(gps_history)
+        return self._stationary_array(levels[~np.isnan(levels).any(axis=1)])
+    
+    def _stationary_array(self, levels):
+        """Differences if both are stationary by ADF, otherwise the levels"""
+        diffs = np.diff(levels, axis=0)
+        if numpy_var.is_stationary(diffs[:, 0]) and numpy_var.is_stationary(diffs[:, 1]):
+            return np.ascontiguousarray(diffs), ['lat_diff', 'lon_diff']
+        return levels, ['lat', 'lon']
+    
+    def _prepare(self, gps_history):
+        """Backend-specific preparation returning (array, column names)"""
+        if self.backend == 'numpy':
+            return self.prepare_array(gps_history)
+        ts_data = self.prepare_data(gps_history)
+        return ts_data.values, list(ts_data.columns)
+    
     def _is_stationary(self, series):
         """Check if time series is stationary using Augmented Dickey-Fuller test"""
+        from statsmodels.tsa.stattools import adfuller
+        
         try:
             result = adfuller(series.dropna())
             return result[1] <= 0.05  # p-value <= 0.05 indicates stationarity
@@ -74,14 +135,18 @@ class VARLocationPredictor:
     def _select_optimal_lag(self, data):
         """Select optimal lag order for VAR model using information criteria"""
         try:
-            model = VAR(data)
-            lag_order = model.select_order(maxlags=min(self.max_lag, len(data)//4))
+            maxlags = min(self.max_lag, len(data)//4)
+            if self.backend == 'numpy':
+                selected_orders = numpy_var.select_order(data, maxlags)
+            else:
+                from statsmodels.tsa.vector_ar.var_model import VAR
+                selected_orders = VAR(data).select_order(maxlags=maxlags).selected_orders
             
             # Prefer AIC criterion, fallback to others
-            if 'aic' in lag_order.selected_orders and lag_order.selected_orders['aic'] > 0:
-                return lag_order.selected_orders['aic']
-            elif 'bic' in lag_order.selected_orders and lag_order.selected_orders['bic'] > 0:
-                return lag_order.selected_orders['bic']
+            if 'aic' in selected_orders and selected_orders['aic'] > 0:
+                return int(selected_orders['aic'])
+            elif 'bic' in selected_orders and selected_orders['bic'] > 0:
+                return int(selected_orders['bic'])
             else:
                 return min(2, len(data)//4)  # Conservative fallback
         except:
@@ -96,23 +161,96 @@ class VARLocationPredictor:
         """
         try:
             # Prepare data
-            ts_data = self.prepare_data(gps_history)
+            ts_data, columns = self._prepare(gps_history)
             
             # Select optimal lag
             optimal_lag = self._select_optimal_lag(ts_data)
             
             # Fit VAR model
-            self.model = VAR(ts_data)
-            self.fitted_model = self.model.fit(optimal_lag)
+            if self.backend == 'numpy':
+                self.model = None
+                self.fitted_model = numpy_var.VARResults(ts_data, optimal_lag, columns)
+            else:
+                from statsmodels.tsa.vector_ar.var_model import VAR
+                self.model = VAR(ts_data)
+                self.fitted_model = self.model.fit(optimal_lag)
             self.last_training_data = ts_data
+            self.training_columns = columns
             
-            print(f"VAR model trained with lag order: {optimal_lag}")
+            if self.engine is not None:
+                self._seed_engine(gps_history, ts_data, columns, optimal_lag)
+            
+            print(f"VAR model trained with lag order: {optimal_lag} ({self.backend})")
             print(f"Training data shape: {ts_data.shape}")
             
         except Exception as e:
             print(f"VAR training error: {e}")
             self.fitted_model = None
     
+    def _seed_engine(self, gps_history, ts_data, columns, lag):
+        """Initialize the online engine from the data the batch model was fitted on"""
+        self.engine.fit(ts_data, lag)
+        self.use_differences = columns[0] == 'lat_diff'
+        
+        levels, timestamps = self._sorted_arrays(gps_history)
+        self.last_level = levels[-1].copy()
+        self.last_timestamp = timestamps[-1]
+    
+    def _sorted_arrays(self, gps_history):
+        """
+        Coordinates and timestamps of points that have both, oldest first
+        
+        Returns:
+            tuple: (N x 2 array of lat/lon, N timestamps)
+        """
+        if hasattr(gps_history, 'columns'):
+            # Struct-of-arrays window from the ring buffer, no per-point dicts
+            levels = np.column_stack((gps_history.lat, gps_history.lon))
+            timestamps = np.asarray(gps_history.timestamp)
+        else:
+            points = [p for p in gps_history
+                      if p.get('lat') is not None and p.get('lon') is not None and p.get('timestamp') is not None]
+            levels = np.array([(p['lat'], p['lon']) for p in points], dtype=float).reshape(-1, 2)
+            timestamps = np.array([p['timestamp'] for p in points])
+        
+        order = np.argsort(timestamps, kind='stable')
+        return levels[order], timestamps[order]
+    
+    def _needs_refit(self):
+        engine = self.engine
+        return (not engine.is_fitted or
+                engine.updates_since_fit >= self.refit_interval or
+                engine.drift_detected)
+    
+    def _predict_online(self, gps_history):
+        """
+        One-step forecast from the online engine
+
+        Only points newer than the last ingested timestamp are folded in, so the
+        usual 50-point history window costs one rank-one update per new point.
+        The lag order is reselected with a full fit on schedule or on drift.
+        """
+        if self._needs_refit():
+            self.train(gps_history)
+            if self.fitted_model is None or not self.engine.is_fitted:
+                return None
+        else:
+            levels, timestamps = self._sorted_arrays(gps_history)
+            new = timestamps > self.last_timestamp
+            for level, timestamp in zip(levels[new], timestamps[new]):
+                self.engine.update(level - self.last_level if self.use_differences else level)
+                self.last_level = level
+                self.last_timestamp = timestamp
+        
+        forecast = self.engine.forecast(1)[0]
+        if self.use_differences:
+            forecast = self.last_level + forecast
+        
+        return {
+            'lat': float(forecast[0]),
+            'lon': float(forecast[1])
+        }
+    
     def predict_next_location(self, gps_history, steps=1):
         """
         Predict next GPS location(s)
@@ -130,16 +268,20 @@ class VARLocationPredictor:
                 return self._simple_extrapolation(gps_history)
             
             # Check for location variance to avoid constant column issues
-            recent_lats = [point.get('lat', 0) for point in gps_history[-10:]]
-            recent_lons = [point.get('lon', 0) for point in gps_history[-10:]]
+            recent = gps_history[-10:]
+            if hasattr(recent, 'columns'):
+                recent_lats, recent_lons = recent.lat, recent.lon
+            else:
+                recent_lats = [point.get('lat', 0) for point in recent]
+                recent_lons = [point.get('lon', 0) for point in recent]
             
             lat_variance = np.var(recent_lats) if len(recent_lats) > 1 else 0
             lon_variance = np.var(recent_lons) if len(recent_lons) > 1 else 0
             
             # If no significant movement, return current location with small offset
             if lat_variance < 1e-8 and lon_variance < 1e-8:
-                current_lat = recent_lats[-1] if recent_lats else 0
-                current_lon = recent_lons[-1] if recent_lons else 0
+                current_lat = recent_lats[-1] if len(recent_lats) else 0
+                current_lon = recent_lons[-1] if len(recent_lons) else 0
                 
                 # Add small random offset to simulate movement
                 offset = 0.0001  # About 10 meters
@@ -148,22 +290,34 @@ class VARLocationPredictor:
                     'lon': current_lon + np.random.uniform(-offset, offset)
                 }
             
+            if self.engine is not None:
+                prediction = self._predict_online(gps_history)
+                if prediction is not None:
+                    return prediction
+                return self._simple_extrapolation(gps_history)
+            
             # Try VAR prediction with error handling
             if self.fitted_model is None:
                 self.train(gps_history)
             
             if self.fitted_model is not None:
                 # Prepare current data
-                ts_data = self.prepare_data(gps_history)
+                ts_data, columns = self._prepare(gps_history)
                 
                 # Make prediction
-                forecast = self.fitted_model.forecast(ts_data.tail(self.fitted_model.k_ar).values, steps=steps)
+                forecast = self.fitted_model.forecast(ts_data[len(ts_data) - self.fitted_model.k_ar:], steps=steps)
                 
                 # Extract predicted coordinates
                 if len(forecast) > 0:
                     predicted_lat = float(forecast[0][0])
                     predicted_lon = float(forecast[0][1])
                     
+                    # Differenced model forecasts a step, add it back to the last position
+                    if columns[0] == 'lat_diff':
+                        levels, _ = self._sorted_arrays(gps_history)
+                        predicted_lat += levels[-1][0]
+                        predicted_lon += levels[-1][1]
+                    
                     return {
                         'lat': predicted_lat,
                         'lon': predicted_lon
@@ -176,6 +330,63 @@ class VARLocationPredictor:
             # Fallback to simple extrapolation
             return self._simple_extrapolation(gps_history)
     
+    def predict_batch(self, gps_history, points):
+        """
+        One-step forecasts after every point of an ordered batch, in one pass
+        
+        History and batch are merged by timestamp and a single VAR (NumPy OLS) is
+        fitted on the result; the forecast after each point is one row of the
+        lagged design times the coefficient matrix, so the whole batch costs one
+        fit and one matrix product. Points too early in the series for the lag
+        order fall back to damped linear extrapolation.
+        
+        Args:
+            gps_history: Recent GPS points (list of dicts or ring buffer window)
+            points: New points with 'lat', 'lon', 'timestamp', in arrival order
+            
+        Returns:
+            list: {'lat', 'lon'} per batch point, in the order given
+        """
+        hist_levels, hist_ts = self._sorted_arrays(gps_history) if len(gps_history) else (np.empty((0, 2)), np.empty(0))
+        batch_levels = np.array([(p['lat'], p['lon']) for p in points], dtype=float).reshape(-1, 2)
+        batch_ts = np.array([p['timestamp'] for p in points])
+        
+        levels = np.vstack((hist_levels, batch_levels))
+        origin = np.concatenate((np.full(len(hist_levels), -1), np.arange(len(points))))
+        order = np.argsort(np.concatenate((hist_ts, batch_ts)), kind='stable')
+        levels, origin = levels[order], origin[order]
+        
+        # Fallback for every position: damped linear extrapolation from the previous point
+        step = np.zeros_like(levels)
+        step[1:] = np.diff(levels, axis=0) * 0.8
+        forecasts = levels + step
+        
+        if len(levels) >= self.min_data_points and np.var(levels, axis=0).max() >= 1e-8:
+            try:
+                data, columns = self._stationary_array(levels)
+                lag = self._select_optimal_lag(data)
+                results = numpy_var.VARResults(data, lag, columns)
+                
+                # Regressors ending at every row t >= lag - 1 (padding row is the unused target)
+                X, _ = lag_matrix(np.vstack((data, np.zeros((1, data.shape[1])))), lag)
+                predicted = X @ results.params
+                rows = np.arange(max(lag - 1, 0), len(data))
+                if columns[0] == 'lat_diff':
+                    # Difference row t ends at level t + 1
+                    forecasts[rows + 1] = levels[rows + 1] + predicted[len(predicted) - len(rows):]
+                else:
+                    forecasts[rows] = predicted[len(predicted) - len(rows):]
+            except Exception as e:
+                print(f"VAR batch prediction error: {e}")
+        
+        out = [None] * len(points)
+        for position in np.flatnonzero(origin >= 0):
+            out[origin[position]] = {
+                'lat': float(forecasts[position, 0]),
+                'lon': float(forecasts[position, 1])
+            }
+        return out
+    
     def _simple_extrapolation(self, gps_history):
         """Fallback prediction using simple linear extrapolation"""
         if len(gps_history) < 2:
@@ -233,25 +444,15 @@ class VARLocationPredictor:
         if len(gps_history) < 3:
             return 0.5
         
-        # Calculate variance in speed and direction
-        speeds = []
-        directions = []
-        
-        for i in range(1, len(gps_history)):
-            prev = gps_history[i-1]
-            curr = gps_history[i]
-            
-            # Calculate speed (simplified)
-            lat_diff = curr['lat'] - prev['lat']
-            lon_diff = curr['lon'] - prev['lon']
-            distance = np.sqrt(lat_diff**2 + lon_diff**2)
-            time_diff = max(curr['timestamp'] - prev['timestamp'], 1)
-            speed = distance / time_diff
-            speeds.append(speed)
-            
-            # Calculate direction
-            direction = np.arctan2(lat_diff, lon_diff)
-            directions.append(direction)
+        # Variance in speed (m/s) and direction (radians) of each step
+        if hasattr(gps_history, 'columns'):
+            lats, lons, timestamps = gps_history.lat, gps_history.lon, np.asarray(gps_history.timestamp, dtype=float)
+        else:
+            lats = np.array([point['lat'] for point in gps_history], dtype=float)
+            lons = np.array([point['lon'] for point in gps_history], dtype=float)
+            timestamps = np.array([point['timestamp'] for point in gps_history], dtype=float)
+        speeds = step_distances_m(lats, lons) / np.maximum(np.diff(timestamps), 1)
+        directions = np.radians(step_bearings_deg(lats, lons))
         
         # Lower variance = higher consistency
         speed_consistency = 1.0 / (1.0 + np.var(speeds))
@@ -266,7 +467,7 @@ class VARLocationPredictor:
                 return 0.3
             
             # Use AIC as proxy for model quality (lower is better)
-            aic = self.fitted_model.aic
+            aic = self.engine.aic if self.engine is not None and self.engine.is_fitted else self.fitted_model.aic
             
             # Convert to 0-1 scale (arbitrary scaling)
             quality = max(0.1, 1.0 / (1.0 + abs(aic) / 100))
@@ -283,10 +484,26 @@ class VARLocationPredictor:
                 'message': 'Model not trained yet'
             }
         
+        if self.engine is not None and self.engine.is_fitted:
+            return {
+                'status': 'trained',
+                'engine': 'online',
+                'backend': self.backend,
+                'lag_order': self.engine.k_ar,
+                'variables': self.training_columns,
+                'observations': self.engine.nobs,
+                'aic': self.engine.aic,
+                'bic': self.engine.bic,
+                'updates_since_fit': self.engine.updates_since_fit,
+                'drift_score': self.engine.drift_score,
+                'training_data_shape': self.last_training_data.shape
+            }
+        
         return {
             'status': 'trained',
+            'backend': self.backend,
             'lag_order': self.fitted_model.k_ar,
-            'variables': self.fitted_model.endog_names,
+            'variables': self.training_columns,
             'observations': self.fitted_model.nobs,
             'aic': self.fitted_model.aic,
             'bic': self.fitted_model.bic,
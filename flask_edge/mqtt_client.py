@@ -1,236 +1,317 @@
-import paho.mqtt.client as mqtt
-import json
-import time
-import sqlite3
-import pandas as pd
+import asyncio
+import threading
 from datetime import datetime, timezone, timedelta
 
 # Import models using relative paths
-from models.random_forest_model_simple import ActivityClassifier
-from models.var_model import VARLocationPredictor
-from models.dbscan_anomaly_model_simple import AnomalyDetector
+from models.random_forest_model_simple import get_classifier
+import storage
+import point_buffer
+import route_segmenter
+import change_feed
+import live_hub
+import trajectory
+import model_workers
+from mqtt_service import AsyncIngestService, MQTTSettings
 
-# Konfigurasi MQTT
+# Konfigurasi MQTT (default; MQTT_BROKER, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD,
+# MQTT_TOPICS dll. dari environment menimpa nilai ini)
 MQTT_BROKER = "52.186.170.43"   # IP Ubuntu MQTT Server
 MQTT_PORT = 1883
-MQTT_TOPIC = "gps/data"
+MQTT_TOPIC = "gps/data"          # Tracker tunggal (device_id dari payload atau 'default')
+MQTT_DEVICE_TOPIC = "gps/+/data"  # Armada: gps/<device_id>/data
 MQTT_USERNAME = "ubuntu"     # Sesuaikan dengan Mosquitto
 MQTT_PASSWORD = "admin"
 
-# Database path
-DATABASE_PATH = 'gps_data.db'
+# Konfigurasi ingest: batas pesan tertunda + group commit
+INGEST_QUEUE_SIZE = 10000      # Maks pesan diterima tapi belum disimpan
+INGEST_MAX_CONCURRENCY = 4     # Maks pesan dalam proses model sekaligus
+INGEST_WORKERS = 4             # Thread executor model (state model per device, dikunci per device)
+INGEST_BATCH_SIZE = 50         # Commit setiap N titik...
+INGEST_FLUSH_MS = 200          # ...atau setiap T milidetik
 
 # Indonesia timezone constant
 INDONESIA_TZ = timezone(timedelta(hours=7))
 
-# Inisialisasi model
-activity_classifier = ActivityClassifier()
-var_predictor = VARLocationPredictor()
-anomaly_detector = AnomalyDetector()
+# Inisialisasi model (VAR dan DBSCAN per device lewat model_workers.get_pool())
+activity_classifier = get_classifier()  # Shared instance, model loaded on first use
 
-def get_recent_gps_data(limit=50):
-    """Get recent GPS data from database"""
+def device_id_for(topic, payload):
+    """Device of a message: payload device_id, else the <id> of gps/<id>/data, else the default"""
+    if payload.get('device_id') not in (None, ''):
+        return storage.device_id_or_default(payload['device_id'])
+    parts = topic.split('/')
+    if len(parts) == 3 and parts[0] == 'gps' and parts[2] == 'data':
+        return storage.device_id_or_default(parts[1])
+    return storage.DEFAULT_DEVICE_ID
+
+# Titik yang sudah diproses model tapi belum di-commit (group commit), per device, terlama dulu
+_pending_rows = {}
+_pending_lock = threading.Lock()
+
+def get_recent_gps_data(limit=50, device_id=storage.DEFAULT_DEVICE_ID):
+    """
+    Get a device's recent GPS data (oldest first)
+
+    A zero-copy window of its ring buffer, plus the device's processed points
+    still waiting for their group commit, so a burst is modelled with its own
+    preceding points.
+    """
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        query = '''
-        SELECT latitude, longitude, speed, activity, timestamp, is_anomaly 
-        FROM gps_data 
-        ORDER BY timestamp DESC 
-        LIMIT ?
-        '''
-        df = pd.read_sql_query(query, conn, params=(limit,))
-        conn.close()
-        
-        # Convert to list of dictionaries
-        return df.to_dict('records')
+        buffer = point_buffer.get_buffer(device_id)
+        with _pending_lock:
+            window = buffer.recent(limit)
+            pending = [{'lat': row['gps_data'].get('latitude', 0), 'lon': row['gps_data'].get('longitude', 0),
+                        'speed': row['gps_data'].get('speed', 0), 'timestamp': row['gps_data']['timestamp']}
+                       for row in _pending_rows.get(device_id, ())]
+        return (window + pending)[-limit:] if pending else window
     except Exception as e:
         print(f"Error getting recent GPS data: {e}")
         return []
 
-def store_gps_data(gps_data, activity=None, is_anomaly=False):
+def _add_pending(row):
+    with _pending_lock:
+        _pending_rows.setdefault(row['device_id'], []).append(row)
+
+def _drop_pending(row):
+    """Remove a row from its device's pending window (pending lock held)"""
+    rows = _pending_rows.get(row['device_id'])
+    if rows is None:
+        return
+    rows[:] = [pending for pending in rows if pending is not row]
+    if not rows:
+        del _pending_rows[row['device_id']]
+
+def rows_failed(rows):
+    """Ingest callback: rejected or rolled-back rows leave the pending windows"""
+    with _pending_lock:
+        for row in rows:
+            _drop_pending(row)
+    # Their points may have moved the dead-reckoning state (see trajectory.mark)
+    trajectory.forget({row.get('device_id', storage.DEFAULT_DEVICE_ID) for row in rows})
+
+def row_committed(row):
+    """Ingest callback: make a committed row visible (ring buffer, change sequence, live stream)"""
+    gps_data = row['gps_data']
+    device_id = row.get('device_id', storage.DEFAULT_DEVICE_ID)
+    buffer = point_buffer.get_buffer(device_id)
+    # Moves from the pending window to the ring buffer in one step
+    with _pending_lock:
+        buffer.append(
+            gps_data.get('latitude', 0), gps_data.get('longitude', 0),
+            gps_data.get('speed', 0), row['stored_timestamp']
+        )
+        _drop_pending(row)
+    change_feed.advance(row['stored_id'])
+    live_hub.publish('point', live_hub.point_event(
+        row['stored_id'], gps_data.get('latitude', 0), gps_data.get('longitude', 0),
+        gps_data.get('speed', 0), row['stored_timestamp'], row['activity'], row['is_anomaly'],
+        row.get('predicted_location'), device_id
+    ))
+
+def store_gps_data(gps_data, activity=None, is_anomaly=False, device_id=storage.DEFAULT_DEVICE_ID):
     """Store GPS data to database with timestamp validation"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # Ensure table exists dengan format yang benar
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS gps_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            latitude REAL NOT NULL,
-            longitude REAL NOT NULL,
-            speed REAL,
-            activity TEXT,
-            timestamp INTEGER,
-            is_anomaly BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # Enhanced timestamp validation (same as in app.py)
-        # Use Indonesia timezone for consistency
-        current_time = datetime.now(INDONESIA_TZ).timestamp()
-        timestamp = int(gps_data.get('timestamp', current_time))
-        
-        # Check for recent duplicate timestamps (within last 10 minutes)
-        cursor.execute('''
-            SELECT COUNT(*) FROM gps_data 
-            WHERE timestamp = ? AND datetime(created_at) >= datetime('now', '-10 minutes')
-        ''', (timestamp,))
-        duplicate_count = cursor.fetchone()[0]
-        
-        # Get the most recent timestamp from database
-        cursor.execute('SELECT timestamp FROM gps_data ORDER BY created_at DESC LIMIT 1')
-        last_result = cursor.fetchone()
-        last_timestamp = last_result[0] if last_result else 0
-        
-        timestamp_age = current_time - timestamp
-        is_too_old = timestamp < (current_time - 3600)        # Older than 1 hour
-        is_too_future = timestamp > (current_time + 300)      # More than 5 minutes in future
-        is_duplicate = duplicate_count > 0                    # Same timestamp used recently
-        is_stale = timestamp <= last_timestamp                # Same or older than last stored
-        
-        if is_too_old or is_too_future or is_duplicate or is_stale:
-            reasons = []
-            if is_too_old:
-                reasons.append(f"too old ({timestamp_age:.1f}s)")
-            if is_too_future:
-                reasons.append(f"future ({-timestamp_age:.1f}s)")
-            if is_duplicate:
-                reasons.append(f"duplicate ({duplicate_count} recent)")
-            if is_stale:
-                reasons.append("stale/older than last")
-            
-            print(f"⚠️ MQTT: Rejecting GPS timestamp {timestamp} - {', '.join(reasons)}")
-            print(f"   Original: {datetime.fromtimestamp(timestamp, tz=INDONESIA_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}")
-            print(f"   Using server time: {datetime.fromtimestamp(current_time, tz=INDONESIA_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}")
-            
-            timestamp = int(current_time)
-        
-        # Insert data dengan konversi tipe yang benar
+        # Schema disiapkan sekali oleh storage pool, tidak perlu CREATE TABLE per insert
+        with storage.connection() as conn:
+            row = {
+                'gps_data': gps_data,
+                'activity': activity,
+                'is_anomaly': is_anomaly,
+                'device_id': device_id
+            }
+            write_gps_row(conn.cursor(), row)
+        row_committed(row)
+        route_segmenter.sync()
+        return True
+    except Exception as e:
+        print(f"❌ Error menyimpan GPS data: {e}")
+        trajectory.forget([device_id])
+        import traceback
+        traceback.print_exc()
+        return False
+
+def write_gps_row(cursor, row):
+    """
+    Validate timestamp and insert one point with an open cursor
+
+    Used directly by store_gps_data and per row inside the ingest batch transaction.
+    """
+    gps_data = row['gps_data']
+    activity = row['activity']
+    is_anomaly = row['is_anomaly']
+    device_id = row.get('device_id', storage.DEFAULT_DEVICE_ID)
+    
+    # Enhanced timestamp validation (same as in app.py)
+    # Use Indonesia timezone for consistency
+    current_time = datetime.now(INDONESIA_TZ).timestamp()
+    timestamp = int(gps_data.get('timestamp', current_time))
+
+    # Check for recent duplicate timestamps (within last 10 minutes)
+    duplicate_count = storage.recent_duplicate_count(cursor, timestamp, device_id=device_id)
+
+    # Get the device's most recent timestamp from database
+    last_timestamp = storage.last_stored_timestamp(cursor, device_id)
+
+    timestamp_age = current_time - timestamp
+    is_too_old = timestamp < (current_time - 3600)        # Older than 1 hour
+    is_too_future = timestamp > (current_time + 300)      # More than 5 minutes in future
+    is_duplicate = duplicate_count > 0                    # Same timestamp used recently
+    is_stale = timestamp <= last_timestamp                # Same or older than last stored
+
+    if is_too_old or is_too_future or is_duplicate or is_stale:
+        reasons = []
+        if is_too_old:
+            reasons.append(f"too old ({timestamp_age:.1f}s)")
+        if is_too_future:
+            reasons.append(f"future ({-timestamp_age:.1f}s)")
+        if is_duplicate:
+            reasons.append(f"duplicate ({duplicate_count} recent)")
+        if is_stale:
+            reasons.append("stale/older than last")
+    
+        print(f"⚠️ MQTT: Rejecting GPS timestamp {timestamp} - {', '.join(reasons)}")
+        print(f"   Original: {datetime.fromtimestamp(timestamp, tz=INDONESIA_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}")
+        print(f"   Using server time: {datetime.fromtimestamp(current_time, tz=INDONESIA_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}")
+    
+        timestamp = int(current_time)
+
+    # Dead-reckoning compression: redundant points stay stored but are skipped by ?tolerance= reads
+    redundant, promoted = trajectory.mark(device_id, timestamp, float(gps_data.get('latitude', 0)),
+                                          float(gps_data.get('longitude', 0)), str(activity or 'unknown'), is_anomaly)
+
+    # Insert data dengan konversi tipe yang benar
+    try:
         cursor.execute('''
-        INSERT INTO gps_data (latitude, longitude, speed, activity, timestamp, is_anomaly)
-        VALUES (?, ?, ?, ?, ?, ?)
+        INSERT INTO gps_data (latitude, longitude, speed, activity, timestamp, is_anomaly, device_id, redundant)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             float(gps_data.get('latitude', 0)),
             float(gps_data.get('longitude', 0)),
             float(gps_data.get('speed', 0)),
             str(activity or 'unknown'),
             timestamp,
-            1 if is_anomaly else 0
+            1 if is_anomaly else 0,
+            device_id,
+            1 if redundant else 0
         ))
-        
-        conn.commit()
-        conn.close()
-        print(f"💾 Data GPS disimpan: lat={gps_data.get('latitude')}, lon={gps_data.get('longitude')}, timestamp={timestamp}")
-        return True
-    except Exception as e:
-        print(f"❌ Error menyimpan GPS data: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+        row['stored_timestamp'] = timestamp
+        row['stored_id'] = cursor.lastrowid
+        trajectory.stored(device_id, row['stored_id'])
+        if promoted is not None:
+            trajectory.promote(cursor, [promoted])
+    except Exception:
+        # The reckoner already counted this point: resume it from what is stored
+        trajectory.forget([device_id])
+        raise
+    
+    print(f"💾 Data GPS disimpan: device={device_id}, lat={gps_data.get('latitude')}, lon={gps_data.get('longitude')}, timestamp={timestamp}")
+    return True
 
-# Fungsi callback saat berhasil konek ke broker
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        print("✅ MQTT terhubung ke broker!")
-        client.subscribe(MQTT_TOPIC)
-        print(f"📡 Subscribed to topic: {MQTT_TOPIC}")
-    else:
-        print(f"🚫 Gagal konek ke MQTT Broker. Kode: {rc}")
+def process_message(message):
+    """
+    Run the AI models for one decoded MQTT message (ingest worker thread)
 
-# Fungsi callback saat pesan diterima
-def on_message(client, userdata, msg):
+    Returns:
+        dict: Row for write_gps_row
+    """
+    payload = message['payload']
+    current_timestamp = message['received_at']
+    device_id = device_id_for(message['topic'], payload)
+    gps_data = {
+        'latitude': payload.get('lat'),
+        'longitude': payload.get('lon'), 
+        'speed': payload.get('speed', 0),
+        'timestamp': current_timestamp  # Selalu gunakan waktu saat ini
+    }
+    
+    print(f"📍 GPS Data yang akan disimpan: {gps_data}")
+    
+    # Ambil data historis device untuk konteks model (view ring buffer, format lat/lon)
+    history_for_models = get_recent_gps_data(limit=50, device_id=device_id)
+
+    # Proses AI dengan format yang konsisten
     try:
-        payload = json.loads(msg.payload.decode())
-        print(f"📥 Data dari ESP32 via MQTT: {payload}")        # Map field names untuk kompatibilitas database
-        # Force menggunakan timestamp saat ini untuk data real-time
-        current_timestamp = int(datetime.now(INDONESIA_TZ).timestamp())
-        gps_data = {
-            'latitude': payload.get('lat'),
-            'longitude': payload.get('lon'), 
-            'speed': payload.get('speed', 0),
-            'timestamp': current_timestamp  # Selalu gunakan waktu saat ini
-        }
-        
-        print(f"⏰ Original timestamp: {payload.get('timestamp')}, Using current: {current_timestamp}")
-        
-        print(f"📍 GPS Data yang akan disimpan: {gps_data}")        # Ambil data historis untuk konteks model
-        recent_history = get_recent_gps_data(limit=50)
+        activity = activity_classifier.classify_activity(
+            {**payload, 'timestamp': current_timestamp}, history_for_models, device_id
+        )
+    except Exception as e:
+        print(f"⚠️ Activity classification error: {e}")
+        activity = 'unknown'
         
-        # Convert database format (latitude/longitude) to model format (lat/lon) for consistency
-        history_for_models = []
-        for item in recent_history:
-            history_for_models.append({
-                'lat': item.get('latitude', item.get('lat', 0)),
-                'lon': item.get('longitude', item.get('lon', 0)),
-                'speed': item.get('speed', 0),
-                'timestamp': item.get('timestamp', 0)
-            })
-
-        # Proses AI dengan format yang konsisten
-        try:
-            activity = activity_classifier.classify_activity(payload, history_for_models[-5:])
-        except Exception as e:
-            print(f"⚠️ Activity classification error: {e}")
-            activity = 'unknown'
-            
-        try:
-            predicted_location = var_predictor.predict_next_location(history_for_models + [payload])
-        except Exception as e:
-            print(f"⚠️ VAR prediction error: {e}")
-            predicted_location = {'lat': payload.get('lat', 0), 'lon': payload.get('lon', 0)}
-            
-        try:
-            is_anomaly = anomaly_detector.detect_anomaly(payload, history_for_models)
-        except Exception as e:
-            print(f"⚠️ Anomaly detection error: {e}")
-            is_anomaly = False
-
-        # Simpan ke database dengan field yang benar
-        store_gps_data(gps_data, activity, is_anomaly)
-
-        print("✅ Data berhasil diproses & disimpan oleh AI models.")
-        print(f"  Aktivitas: {activity}")
-        print(f"  Prediksi Lokasi: {predicted_location}")
-        print(f"  Anomali: {'Ya' if is_anomaly else 'Tidak'}")
+    # VAR + DBSCAN dalam satu panggilan ke state model device (worker process atau in-process)
+    # Beri timestamp server agar VAR online bisa membedakan titik baru
+    point = {**payload, 'timestamp': current_timestamp}
+    try:
+        with model_workers.get_pool().use(device_id) as models:
+            # Anomali tanpa konteks aktivitas, seperti detect_anomaly sebelumnya
+            result = models.infer(point, history_for_models, 'unknown')
+    except model_workers.WorkerError as e:
+        result = {'predicted_location': None, 'anomaly_analysis': None, 'errors': {'var': str(e), 'anomaly': str(e)}}
 
-    except Exception as e:
-        print(f"❌ Error saat memproses data MQTT: {e}")
-        import traceback
-        traceback.print_exc()
+    predicted_location = result['predicted_location']
+    if 'var' in result['errors']:
+        print(f"⚠️ VAR prediction error: {result['errors']['var']}")
+        predicted_location = {'lat': payload.get('lat', 0), 'lon': payload.get('lon', 0)}
+
+    is_anomaly = False
+    if 'anomaly' in result['errors']:
+        print(f"⚠️ Anomaly detection error: {result['errors']['anomaly']}")
+    else:
+        is_anomaly = bool(result['anomaly_analysis']['is_anomaly'])
+
+    print(f"✅ Data {device_id} berhasil diproses oleh AI models.")
+    print(f"  Aktivitas: {activity}")
+    print(f"  Prediksi Lokasi: {predicted_location}")
+    print(f"  Anomali: {'Ya' if is_anomaly else 'Tidak'}")
+
+    # Disimpan oleh batch writer (group commit); sampai itu, titik ini jadi history titik berikutnya
+    row = {
+        'gps_data': gps_data,
+        'activity': activity,
+        'is_anomaly': is_anomaly,
+        'predicted_location': predicted_location,
+        'device_id': device_id
+    }
+    _add_pending(row)
+    return row
+
+# Layanan ingest asyncio: penerimaan hanya decode + task, model di executor, DB di writer thread
+ingest_service = AsyncIngestService(
+    settings=MQTTSettings.from_env(
+        broker=MQTT_BROKER,
+        port=MQTT_PORT,
+        username=MQTT_USERNAME,
+        password=MQTT_PASSWORD,
+        topics=(MQTT_TOPIC, MQTT_DEVICE_TOPIC),
+        max_concurrency=INGEST_MAX_CONCURRENCY,
+        max_pending=INGEST_QUEUE_SIZE,
+        model_workers=INGEST_WORKERS,
+        flush_size=INGEST_BATCH_SIZE,
+        flush_interval_ms=INGEST_FLUSH_MS
+    ),
+    process=process_message,
+    write_row=write_gps_row,
+    device_key=device_id_for,
+    on_written=row_committed,
+    on_flushed=lambda rows: route_segmenter.sync(),
+    on_failed=rows_failed
+)
 
 # Fungsi utama untuk menjalankan subscriber MQTT
 def run():
-    client = mqtt.Client()
-    client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-    client.on_connect = on_connect
-    client.on_message = on_message
-
+    """Run the ingest service on its own event loop (blocks; reconnects until stopped)"""
+    settings = ingest_service.settings
+    print(f"👤 Username: {settings.username}")
+    print(f"📡 Topics: {', '.join(settings.topics)}")
+    
+    point_buffer.get_buffer()
+    print("🚀 MQTT Client mulai listening...")
     try:
-        print(f"🔌 Mencoba koneksi ke MQTT broker: {MQTT_BROKER}:{MQTT_PORT}")
-        print(f"👤 Username: {MQTT_USERNAME}")
-        print(f"📡 Topic: {MQTT_TOPIC}")
-          # Tambahkan timeout dan debug
-        print("⏳ Menunggu koneksi...")
-        result = client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        
-        if result == 0:
-            print("✅ Connect request berhasil dikirim")
-        else:
-            print(f"❌ Connect request gagal dengan code: {result}")
-            return
-            
-        print("🚀 MQTT Client mulai listening...")
-        client.loop_forever()
-        
-    except ConnectionRefusedError:
-        print(f"❌ Koneksi ditolak! Cek apakah MQTT broker di {MQTT_BROKER}:{MQTT_PORT} berjalan")
-    except TimeoutError:
-        print(f"⏰ Timeout! MQTT broker tidak merespon dalam waktu yang ditentukan")
+        asyncio.run(ingest_service.run())
+    except KeyboardInterrupt:
+        print("🛑 MQTT subscriber dihentikan")
     except Exception as e:
-        print(f"❗ Gagal konek ke MQTT broker: {e}")
-        print(f"💡 Cek: 1) IP broker benar? 2) Port 1883 terbuka? 3) Username/password benar?")
+        print(f"❗ MQTT ingest berhenti: {e}")
         import traceback
         traceback.print_exc()
 
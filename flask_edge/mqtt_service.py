@@ -0,0 +1,389 @@
+# File: flask_edge/mqtt_service.py
+# asyncio MQTT ingest service for Smart GPS Tracker
+# Event-loop driven paho client with reconnect, per-message tasks and executor-offloaded model work
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as mqtt
+
+from ingest import BatchWriter
+
+
+class MQTTSettings:
+    """Broker address, credentials, topics and ingest limits"""
+
+    def __init__(self, broker='localhost', port=1883, username=None, password=None, topics=('gps/data',),
+                 client_id='', keepalive=60, max_concurrency=4, max_pending=10000, model_workers=1,
+                 flush_size=50, flush_interval_ms=200, reconnect_min=1.0, reconnect_max=60.0):
+        """
+        Args:
+            broker, port, username, password: Broker connection
+            topics: Topic filters to subscribe to (wildcards allowed)
+            client_id: MQTT client id ('' lets the broker assign one)
+            keepalive: MQTT keepalive in seconds
+            max_concurrency: Max messages in model work at once
+            max_pending: Max messages received but not yet stored; more are dropped
+            model_workers: Executor threads for model work (models must be thread-safe above 1)
+            flush_size, flush_interval_ms: Group commit thresholds of the writer
+            reconnect_min, reconnect_max: Reconnect backoff bounds in seconds
+        """
+        self.broker = broker
+        self.port = port
+        self.username = username
+        self.password = password
+        self.topics = tuple(topics)
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.model_workers = model_workers
+        self.flush_size = flush_size
+        self.flush_interval_ms = flush_interval_ms
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+
+    @classmethod
+    def from_env(cls, **defaults):
+        """
+        Settings from MQTT_* environment variables, falling back to defaults
+
+        MQTT_TOPICS is a comma-separated list of topic filters.
+        """
+        settings = cls(**defaults)
+        env = os.environ
+        settings.broker = env.get('MQTT_BROKER', settings.broker)
+        settings.port = int(env.get('MQTT_PORT', settings.port))
+        settings.username = env.get('MQTT_USERNAME', settings.username)
+        settings.password = env.get('MQTT_PASSWORD', settings.password)
+        if env.get('MQTT_TOPICS'):
+            settings.topics = tuple(t.strip() for t in env['MQTT_TOPICS'].split(',') if t.strip())
+        settings.client_id = env.get('MQTT_CLIENT_ID', settings.client_id)
+        settings.keepalive = int(env.get('MQTT_KEEPALIVE', settings.keepalive))
+        settings.max_concurrency = int(env.get('MQTT_MAX_CONCURRENCY', settings.max_concurrency))
+        settings.max_pending = int(env.get('MQTT_MAX_PENDING', settings.max_pending))
+        settings.model_workers = int(env.get('MQTT_MODEL_WORKERS', settings.model_workers))
+        return settings
+
+
+def _reason_value(reason_code):
+    return getattr(reason_code, 'value', reason_code)
+
+
+class PahoTransport:
+    """
+    paho client driven by an asyncio loop instead of loop_forever()
+
+    Socket readiness is registered with the event loop (add_reader/add_writer)
+    and loop_misc() runs from a periodic task, so the network never needs a
+    thread of its own.
+    """
+
+    def __init__(self, settings, loop, on_message, on_disconnect):
+        self.settings = settings
+        self.loop = loop
+        self.on_message = on_message
+        self.on_disconnect = on_disconnect
+        self._connected = None
+        self._misc_task = None
+
+        if hasattr(mqtt, 'CallbackAPIVersion'):
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=settings.client_id)
+        else:
+            self.client = mqtt.Client(client_id=settings.client_id)
+        if settings.username:
+            self.client.username_pw_set(settings.username, settings.password)
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = lambda client, userdata, msg: self.on_message(msg.topic, msg.payload)
+        # connect() opens the socket in an executor thread: socket callbacks always run on the loop
+        self.client.on_socket_open = lambda *args: self._on_loop(self._on_socket_open, *args)
+        self.client.on_socket_close = lambda *args: self._on_loop(self._on_socket_close, *args)
+        self.client.on_socket_register_write = lambda client, userdata, sock: self._on_loop(
+            self.loop.add_writer, sock, client.loop_write)
+        self.client.on_socket_unregister_write = lambda client, userdata, sock: self._on_loop(
+            self.loop.remove_writer, sock)
+
+    def _on_loop(self, callback, *args):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def _on_connect(self, client, userdata, flags, reason_code, *properties):
+        if self._connected is not None and not self._connected.done():
+            if _reason_value(reason_code) == 0:
+                self._connected.set_result(True)
+            else:
+                self._connected.set_exception(ConnectionError(f"Broker menolak koneksi: {reason_code}"))
+
+    def _on_disconnect(self, client, userdata, *args):
+        self.on_disconnect(args[-2] if len(args) > 1 else args[0])
+
+    async def connect(self, timeout=10.0):
+        """
+        Connect and wait for CONNACK (raises on refusal or timeout)
+
+        The DNS lookup and TCP connect block, so they run in the default
+        executor; in-flight tasks keep running during every reconnect attempt.
+        """
+        self._connected = self.loop.create_future()
+        await self.loop.run_in_executor(None, self.client.connect, self.settings.broker, self.settings.port,
+                                        self.settings.keepalive)
+        await asyncio.wait_for(self._connected, timeout)
+
+    def subscribe(self, topics):
+        for topic in topics:
+            self.client.subscribe(topic)
+
+    def disconnect(self):
+        self.client.disconnect()
+
+
+class InMemoryBroker:
+    """
+    In-process stand-in for a broker (QoS 0, topic wildcards)
+
+    Lets AsyncIngestService run end to end without Mosquitto:
+    AsyncIngestService(settings, ..., transport_factory=broker.transport).
+    """
+
+    def __init__(self):
+        self.transports = []
+
+    def transport(self, settings, loop, on_message, on_disconnect):
+        return InMemoryTransport(self, loop, on_message, on_disconnect)
+
+    def publish(self, topic, payload):
+        """Deliver to every matching subscriber (callable from any thread)"""
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload)
+        if isinstance(payload, str):
+            payload = payload.encode()
+        for transport in list(self.transports):
+            if any(mqtt.topic_matches_sub(sub, topic) for sub in transport.topics):
+                transport.loop.call_soon_threadsafe(transport.on_message, topic, payload)
+
+    def drop_connections(self):
+        """Simulate a broker restart: every client sees a disconnect"""
+        for transport in list(self.transports):
+            transport.loop.call_soon_threadsafe(transport.on_disconnect, 'broker restart')
+        self.transports = []
+
+
+class InMemoryTransport:
+    def __init__(self, broker, loop, on_message, on_disconnect):
+        self.broker = broker
+        self.loop = loop
+        self.on_message = on_message
+        self.on_disconnect = on_disconnect
+        self.topics = []
+
+    async def connect(self, timeout=10.0):
+        self.broker.transports.append(self)
+
+    def subscribe(self, topics):
+        self.topics.extend(topics)
+
+    def disconnect(self):
+        if self in self.broker.transports:
+            self.broker.transports.remove(self)
+
+
+class AsyncIngestService:
+    """
+    MQTT ingest on an asyncio event loop
+
+    Reception only decodes the JSON payload and creates a task. Each task waits
+    for its device's lock (points of one device stay in arrival order), then for
+    a concurrency slot, runs process() on the model executor and hands the row
+    to a BatchWriter on a single writer thread (group commit). A slow model
+    fit therefore delays only its own device, never message reception.
+    """
+
+    def __init__(self, settings, process, write_row, device_key=None, on_written=None, on_flushed=None,
+                 on_failed=None, transport_factory=PahoTransport):
+        """
+        Args:
+            settings: MQTTSettings
+            process: process(message) -> row to store, or None to skip (runs in the executor)
+            write_row: write_row(cursor, row) -> False if the row was rejected
+            device_key: device_key(topic, payload) -> ordering key (default: payload device_id or topic)
+            on_written, on_flushed, on_failed: BatchWriter callbacks (writer thread)
+            transport_factory: factory(settings, loop, on_message, on_disconnect) -> transport
+        """
+        self.settings = settings
+        self.process = process
+        self.device_key = device_key or (lambda topic, payload: payload.get('device_id', topic))
+        self.transport_factory = transport_factory
+        self.writer = BatchWriter(write_row, settings.flush_size, settings.flush_interval_ms, on_written, on_flushed,
+                                  on_failed)
+
+        self.loop = None
+        self.transport = None
+        self._model_executor = None
+        self._write_executor = None
+        self._semaphore = None
+        self._device_locks = {}  # key -> [asyncio.Lock, tasks using it]
+        self._tasks = set()
+        self._disconnected = None
+        self._stopping = False
+
+        self.connected = False
+        self.reconnects = 0
+        self.received = 0
+        self.invalid = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.latency_seconds = 0.0
+
+    async def run(self):
+        """Connect, consume and reconnect with backoff until stop() or cancellation"""
+        self.loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.settings.max_concurrency)
+        self._model_executor = ThreadPoolExecutor(self.settings.model_workers, thread_name_prefix='ingest-model')
+        self._write_executor = ThreadPoolExecutor(1, thread_name_prefix='ingest-writer')
+        flusher = self.loop.create_task(self._flush_loop())
+
+        delay = self.settings.reconnect_min
+        try:
+            while not self._stopping:
+                self._disconnected = asyncio.Event()
+                self.transport = self.transport_factory(self.settings, self.loop, self._on_message, self._on_disconnect)
+                try:
+                    print(f"🔌 Mencoba koneksi ke MQTT broker: {self.settings.broker}:{self.settings.port}")
+                    await self.transport.connect()
+                except Exception as e:
+                    print(f"❌ Koneksi MQTT gagal: {e}; coba lagi dalam {delay:.0f}s")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.settings.reconnect_max)
+                    continue
+
+                self.connected = True
+                delay = self.settings.reconnect_min
+                self.transport.subscribe(self.settings.topics)
+                print(f"✅ MQTT terhubung, subscribe: {', '.join(self.settings.topics)}")
+
+                await self._disconnected.wait()
+                self.connected = False
+                if not self._stopping:
+                    self.reconnects += 1
+                    print(f"⚠️ MQTT terputus; reconnect dalam {delay:.0f}s")
+                    await asyncio.sleep(delay)
+        finally:
+            self.connected = False
+            flusher.cancel()
+            await self.drain()
+            self._model_executor.shutdown(wait=True)
+            self._write_executor.shutdown(wait=True)
+
+    def stop(self):
+        """Ask run() to disconnect, drain in-flight messages and return"""
+        self._stopping = True
+        if self.transport is not None:
+            self.transport.disconnect()
+        if self._disconnected is not None:
+            self._disconnected.set()
+
+    async def drain(self):
+        """Wait for in-flight messages and flush the writer"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.loop.run_in_executor(self._write_executor, self.writer.flush)
+
+    def _on_disconnect(self, reason=None):
+        if self._disconnected is not None:
+            self._disconnected.set()
+
+    def _on_message(self, topic, payload):
+        self.received += 1
+        try:
+            message = json.loads(payload.decode())
+            if not isinstance(message, dict):
+                raise ValueError('payload is not a JSON object')
+        except (ValueError, UnicodeDecodeError) as e:
+            self.invalid += 1
+            print(f"❌ Payload MQTT tidak valid di {topic}: {e}")
+            return
+
+        if len(self._tasks) >= self.settings.max_pending:
+            self.dropped += 1
+            print(f"⚠️ Ingest: {len(self._tasks)} pesan tertunda, pesan dibuang")
+            return
+
+        received = {'at': int(time.time()), 'monotonic': time.monotonic()}
+        task = self.loop.create_task(self._dispatch(topic, message, received))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, topic, payload, received):
+        key = self.device_key(topic, payload)
+        entry = self._device_locks.get(key)
+        if entry is None:
+            entry = self._device_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._semaphore:
+                    message = {'topic': topic, 'payload': payload, 'received_at': received['at']}
+                    row = await self.loop.run_in_executor(self._model_executor, self.process, message)
+                if row is not None:
+                    await self.loop.run_in_executor(self._write_executor, self.writer.add, row)
+            self.processed += 1
+            self.latency_seconds += time.monotonic() - received['monotonic']
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ Ingest: error memproses pesan: {e}")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._device_locks[key]
+
+    async def _flush_loop(self):
+        interval = self.settings.flush_interval_ms / 1000.0
+        while True:
+            await asyncio.sleep(interval)
+            if self.writer.time_until_flush() == 0.0:
+                await self.loop.run_in_executor(self._write_executor, self.writer.flush)
+
+    def metrics(self):
+        """Reception, concurrency and group-commit counters"""
+        return {
+            'connected': self.connected,
+            'broker': f"{self.settings.broker}:{self.settings.port}",
+            'topics': list(self.settings.topics),
+            'reconnects': self.reconnects,
+            'received': self.received,
+            'invalid': self.invalid,
+            'in_flight': len(self._tasks),
+            'max_pending': self.settings.max_pending,
+            'max_concurrency': self.settings.max_concurrency,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'avg_latency_ms': round(self.latency_seconds / self.processed * 1000, 3) if self.processed else 0.0,
+            'writer': self.writer.metrics()
+        }
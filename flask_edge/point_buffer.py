@@ -0,0 +1,175 @@
+# File: flask_edge/point_buffer.py
+# In-memory ring buffer of recent GPS points
+# Struct-of-arrays NumPy storage per device, shared by the Flask handlers and the MQTT ingest worker
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import storage
+
+DEFAULT_CAPACITY = 4096
+MAX_DEVICE_BUFFERS = 256   # Least recently used device buffers beyond this are dropped (re-warmed on demand)
+
+
+class PointWindow:
+    """
+    Read-only window of consecutive points, oldest first
+
+    Holds one NumPy array per field (lat, lon, speed, timestamp). Slicing returns
+    another window over the same memory; integer indexing and iteration yield
+    dicts so code written for list-of-dict history keeps working.
+    """
+
+    FIELDS = ('lat', 'lon', 'speed', 'timestamp')
+
+    def __init__(self, lat, lon, speed, timestamp):
+        self.lat = lat
+        self.lon = lon
+        self.speed = speed
+        self.timestamp = timestamp
+
+    def __len__(self):
+        return self.lat.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PointWindow(self.lat[index], self.lon[index], self.speed[index], self.timestamp[index])
+        return {
+            'lat': float(self.lat[index]),
+            'lon': float(self.lon[index]),
+            'speed': float(self.speed[index]),
+            'timestamp': int(self.timestamp[index])
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __add__(self, points):
+        """window + [point, ...] -> new window (copies, the buffer is untouched)"""
+        if isinstance(points, PointWindow):
+            other = points
+        else:
+            other = PointWindow.from_points(points)
+        return PointWindow(*(np.concatenate((getattr(self, f), getattr(other, f))) for f in self.FIELDS))
+
+    def columns(self):
+        """Field -> array mapping (e.g. for pandas.DataFrame)"""
+        return {f: getattr(self, f) for f in self.FIELDS}
+
+    def to_list(self):
+        return list(self)
+
+    @classmethod
+    def from_points(cls, points):
+        """Build a window from a list of dicts with lat/lon/speed/timestamp"""
+        return cls(
+            np.array([p.get('lat', 0) for p in points], dtype=float),
+            np.array([p.get('lon', 0) for p in points], dtype=float),
+            np.array([p.get('speed', 0) or 0 for p in points], dtype=float),
+            np.array([p.get('timestamp', 0) or 0 for p in points], dtype=np.int64)
+        )
+
+
+class PointRingBuffer:
+    """
+    Fixed-capacity, lock-protected ring of the most recent points
+
+    Every point is written twice, at i and i + capacity, so the newest n points
+    are always one contiguous slice and recent(n) returns views without copying.
+    A view stays intact for the next (capacity - n) appends.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, device_id=storage.DEFAULT_DEVICE_ID):
+        self.capacity = capacity
+        self.device_id = device_id
+        self._lat = np.zeros(2 * capacity)
+        self._lon = np.zeros(2 * capacity)
+        self._speed = np.zeros(2 * capacity)
+        self._timestamp = np.zeros(2 * capacity, dtype=np.int64)
+        self._head = 0   # Next write position in [0, capacity)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.warmed = False
+
+    def __len__(self):
+        return self._size
+
+    def append(self, lat, lon, speed, timestamp):
+        with self._lock:
+            self._write(lat, lon, speed, timestamp)
+
+    def extend(self, rows):
+        """Append (lat, lon, speed, timestamp) tuples, oldest first"""
+        with self._lock:
+            for row in rows:
+                self._write(*row)
+
+    def _write(self, lat, lon, speed, timestamp):
+        i = self._head
+        for array, value in ((self._lat, lat), (self._lon, lon), (self._speed, speed or 0),
+                             (self._timestamp, timestamp)):
+            array[i] = value
+            array[i + self.capacity] = value
+        self._head = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def newest_timestamp(self):
+        """Timestamp of the newest point (None while empty)"""
+        with self._lock:
+            if not self._size:
+                return None
+            return int(self._timestamp[self._head + self.capacity - 1])
+
+    def recent(self, n):
+        """
+        Newest n points as a PointWindow, oldest first (zero-copy)
+        """
+        with self._lock:
+            n = min(n, self._size)
+            end = self._head + self.capacity
+            start = end - n
+            return PointWindow(self._lat[start:end], self._lon[start:end],
+                               self._speed[start:end], self._timestamp[start:end])
+
+    def warm(self, path=None):
+        """Load the device's newest `capacity` points from SQLite"""
+        with storage.connection(path) as conn:
+            rows = conn.execute('''
+                SELECT latitude, longitude, speed, timestamp
+                FROM gps_data
+                WHERE device_id = ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+            ''', (self.device_id, self.capacity)).fetchall()
+        with self._lock:
+            self._head = 0
+            self._size = 0
+            for row in reversed(rows):
+                self._write(*row)
+            self.warmed = True
+        print(f"🧠 Ring buffer {self.device_id} warmed with {len(rows)} recent points")
+
+
+_buffers = OrderedDict()
+_buffers_lock = threading.Lock()
+
+
+def get_buffer(device_id=storage.DEFAULT_DEVICE_ID):
+    """Process-wide ring buffer of a device, warmed from SQLite on first use"""
+    with _buffers_lock:
+        buffer = _buffers.get(device_id)
+        if buffer is not None:
+            _buffers.move_to_end(device_id)
+            return buffer
+
+        buffer = _buffers[device_id] = PointRingBuffer(device_id=device_id)
+        while len(_buffers) > MAX_DEVICE_BUFFERS:
+            _buffers.popitem(last=False)
+        try:
+            buffer.warm()
+        except Exception as e:
+            print(f"⚠️ Ring buffer warm-up failed: {e}")
+        return buffer
@@ -0,0 +1,485 @@
+# File: flask_edge/retention.py
+# Retention for Smart GPS Tracker gps_data
+# Downsamples aging points, moves cold months to compressed SQLite partitions and opens them again for /history
+
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import change_feed
+import storage
+
+# Off by default: downsampling drops raw points for good (enable with GPS_RETENTION=1)
+RETENTION_ENABLED = os.environ.get('GPS_RETENTION', '0') == '1'
+ARCHIVE_DIR = os.environ.get('GPS_ARCHIVE_DIR', 'archive')
+
+# (age, resolution) in seconds: points older than age keep one row per device,
+# activity and resolution-wide time bucket (anomalies are always kept)
+DOWNSAMPLE_TIERS = (
+    (7 * 86400, 60),
+    (30 * 86400, 600),
+)
+ARCHIVE_AFTER = 90 * 86400     # Whole months older than this leave gps_data
+RETENTION_INTERVAL = 3600
+CACHE_PARTITIONS = 4           # Decompressed archive partitions kept on disk for queries
+
+GPS_COLUMNS = ('id', 'latitude', 'longitude', 'speed', 'timestamp', 'activity', 'is_anomaly', 'created_at', 'device_id',
+               'redundant')
+
+# Schema of one archive partition: the gps_data columns and the read paths /history uses
+PARTITION_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS gps_data (
+        id INTEGER PRIMARY KEY,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        speed REAL NOT NULL,
+        timestamp INTEGER NOT NULL,
+        activity TEXT,
+        is_anomaly BOOLEAN DEFAULT 0,
+        created_at DATETIME,
+        device_id TEXT NOT NULL,
+        redundant INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_gps_data_timestamp ON gps_data (timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_gps_data_device_timestamp ON gps_data (device_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_gps_data_activity ON gps_data (activity, timestamp)',
+]
+
+
+def month_bounds(timestamp):
+    """('YYYY-MM', first second, first second of the next month) of a UTC timestamp"""
+    moment = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    start = datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+    end = datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1, tzinfo=timezone.utc)
+    return f'{moment:%Y-%m}', int(start.timestamp()), int(end.timestamp())
+
+
+def overlapping_partitions(conn, start=None, end=None):
+    """
+    Archived partitions whose timestamp range overlaps [start, end], newest first
+
+    Returns:
+        list: Catalog rows as dicts (name, path, min_ts, max_ts, rows, bytes, archived_at)
+    """
+    rows = conn.execute('''
+        SELECT name, path, min_ts, max_ts, rows, bytes, archived_at
+        FROM archived_partitions
+        WHERE (? IS NULL OR max_ts >= ?) AND (? IS NULL OR min_ts <= ?)
+        ORDER BY max_ts DESC
+    ''', (start, start, end, end)).fetchall()
+    return [dict(zip(('name', 'path', 'min_ts', 'max_ts', 'rows', 'bytes', 'archived_at'), row)) for row in rows]
+
+
+def downsampled_before(conn):
+    """Timestamp below which gps_data has been thinned by downsampling (0: nothing yet)"""
+    row = conn.execute("SELECT MAX(value) FROM retention_state WHERE key LIKE 'downsampled_before_%'").fetchone()
+    return row[0] or 0
+
+
+def _catalog(conn, partition):
+    conn.execute('''
+        INSERT OR REPLACE INTO archived_partitions
+            (name, path, min_ts, max_ts, min_id, max_id, rows, bytes, archived_at)
+        VALUES (:name, :path, :min_ts, :max_ts, :min_id, :max_id, :rows, :bytes, :archived_at)
+    ''', partition)
+
+
+def _bump_generation(conn):
+    conn.execute('''
+        INSERT INTO retention_state (key, value) VALUES ('generation', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+    ''')
+
+
+def _delete(conn, where, params):
+    """
+    DELETE FROM gps_data inside the caller's transaction, without touching stats
+
+    The 'deleting' marker row silences the stats delete trigger (stats count
+    every ingested point) and is removed before commit, so no other connection
+    ever sees it.
+    """
+    conn.execute("INSERT OR REPLACE INTO retention_state (key, value) VALUES ('deleting', 1)")
+    deleted = conn.execute(f'DELETE FROM gps_data WHERE {where}', params).rowcount
+    conn.execute("DELETE FROM retention_state WHERE key = 'deleting'")
+    if deleted:
+        _bump_generation(conn)
+    return deleted
+
+
+class PartitionCache:
+    """
+    Decompressed copies of archived partitions, opened read-only
+
+    Copies are named after the catalog version (archived_at, bytes), so a
+    re-archived month never serves a stale copy. At most `capacity` copies are
+    kept; the least recently opened is removed first.
+    """
+
+    def __init__(self, cache_dir=None, capacity=CACHE_PARTITIONS):
+        self.cache_dir = cache_dir or os.path.join(ARCHIVE_DIR, 'cache')
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+    def open(self, partition):
+        """sqlite3 connection (read-only) to one catalog partition"""
+        name = f"{partition['name']}-{partition['archived_at']}-{partition['bytes']}.sqlite"
+        cached = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if not os.path.exists(cached):
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp = f'{cached}.tmp{os.getpid()}'
+                with gzip.open(partition['path'], 'rb') as src, open(tmp, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(tmp, cached)
+            os.utime(cached)
+            self._trim()
+        # The copy never changes under its name, so SQLite may skip locking
+        return sqlite3.connect(f'file:{cached}?mode=ro&immutable=1', uri=True, check_same_thread=False)
+
+    def _trim(self):
+        copies = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.sqlite')]
+        copies.sort(key=os.path.getmtime, reverse=True)
+        for stale in copies[self.capacity:]:
+            os.remove(stale)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_partition_cache():
+    """Process-wide PartitionCache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PartitionCache()
+        return _cache
+
+
+class RetentionManager:
+    """
+    Keeps gps_data (the hot table) small
+
+    1. Downsampling: per DOWNSAMPLE_TIERS, points older than a tier's age are
+       thinned to one row per (device, activity, time bucket); anomalies stay.
+       Each tier remembers its last cutoff and only revisits newer rows.
+    2. Archival: whole UTC months older than ARCHIVE_AFTER are copied into
+       archive/gps_data-YYYY-MM.sqlite.gz, recorded in archived_partitions and
+       deleted from gps_data. The file is replaced before rows are deleted, and
+       merging is by id, so an interrupted run is simply repeated.
+
+    Routes and stats buckets are summaries and stay in place. Every run that
+    removes rows bumps the retention generation, which changes the /history ETag.
+    """
+
+    def __init__(self, path=None, archive_dir=ARCHIVE_DIR, tiers=DOWNSAMPLE_TIERS, archive_after=ARCHIVE_AFTER):
+        self.path = path
+        self.archive_dir = archive_dir
+        self.tiers = tiers
+        self.archive_after = archive_after
+        self._lock = threading.Lock()
+
+    def run(self, now=None, dry_run=False):
+        """
+        Downsample, then archive
+
+        Args:
+            now: Reference time (epoch seconds, default: now)
+            dry_run: Only count what would be removed
+
+        Returns:
+            dict: downsampled / archived row counts, partitions written and duration
+        """
+        now = now if now is not None else time.time()
+        start = time.perf_counter()
+        with self._lock:
+            if dry_run:
+                downsampled, archived, partitions = self._preview(now)
+            else:
+                self._rekey_partitions()
+                downsampled = self.downsample(now)
+                archived, partitions = self.archive(now)
+        if not dry_run and (downsampled or archived):
+            change_feed.get_sequence(self.path).refresh()
+
+        result = {
+            'downsampled': downsampled,
+            'archived': archived,
+            'partitions': partitions,
+            'dry_run': dry_run,
+            'seconds': round(time.perf_counter() - start, 3)
+        }
+        print(f"🧹 Retention{' (dry run)' if dry_run else ''}: {downsampled} titik di-downsample, "
+              f"{archived} titik diarsipkan ke {len(partitions)} partisi ({result['seconds']} s)")
+        return result
+
+    def downsample(self, now, dry_run=False):
+        if dry_run:
+            return self._preview(now)[0]
+        removed = 0
+        for age, resolution in self.tiers:
+            with storage.connection(self.path) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                removed += self._downsample_tier(conn, now, age, resolution)
+        return removed
+
+    def _tier_range(self, conn, now, age, resolution):
+        """(state key, low, cutoff) of the rows a tier has not covered yet"""
+        # Bucket-aligned cutoff: a bucket is thinned once, never split across runs
+        cutoff = int(now - age) // resolution * resolution
+        key = f'downsampled_before_{resolution}'
+        row = conn.execute('SELECT value FROM retention_state WHERE key = ?', (key,)).fetchone()
+        return key, row[0] if row else 0, cutoff
+
+    def _downsample_tier(self, conn, now, age, resolution):
+        """Thin the rows a tier has not covered yet, inside the caller's transaction"""
+        key, low, cutoff = self._tier_range(conn, now, age, resolution)
+        if cutoff <= low:
+            return 0
+        # A bucket keeps a key point when it has one (see trajectory.py)
+        removed = _delete(conn, '''
+            timestamp >= ? AND timestamp < ?
+            AND COALESCE(is_anomaly, 0) NOT IN (1, X'01')
+            AND id NOT IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY device_id, timestamp / ?, COALESCE(activity, '')
+                        ORDER BY redundant, id
+                    ) AS pick
+                    FROM gps_data
+                    WHERE timestamp >= ? AND timestamp < ?
+                )
+                WHERE pick = 1
+            )
+        ''', (low, cutoff, resolution, low, cutoff))
+        # The survivors are the thinned track itself: each one is a key point now
+        conn.execute('UPDATE gps_data SET redundant = 0 WHERE timestamp >= ? AND timestamp < ? AND redundant = 1',
+                     (low, cutoff))
+        conn.execute('INSERT OR REPLACE INTO retention_state (key, value) VALUES (?, ?)', (key, cutoff))
+        return removed
+
+    def _preview(self, now):
+        """
+        (downsampled, archived, partitions) of a run, without changing anything
+
+        Read-only: each tier is a stage of one query that keeps what
+        _downsample_tier() would keep of the rows the earlier tiers leave (same
+        bucket pick, survivors become key points), so the dry run counts what a
+        real run removes without taking the write lock.
+        """
+        with storage.connection(self.path) as conn:
+            _, archive_before, _ = month_bounds(now - self.archive_after)
+            ranges = []
+            for age, resolution in self.tiers:
+                _, low, cutoff = self._tier_range(conn, now, age, resolution)
+                if cutoff > low:
+                    ranges.append((low, cutoff, resolution))
+            horizon = max([archive_before] + [cutoff for _, cutoff, _ in ranges])
+
+            stages = ['stage0 AS (SELECT id, device_id, timestamp, activity, is_anomaly, redundant '
+                      'FROM gps_data WHERE timestamp < ?)']
+            params = [horizon]
+            for i, (low, cutoff, resolution) in enumerate(ranges, 1):
+                stages.append(f'''stage{i} AS (
+                    SELECT id, device_id, timestamp, activity, is_anomaly,
+                           CASE WHEN in_tier THEN 0 ELSE redundant END AS redundant
+                    FROM (
+                        SELECT *, ROW_NUMBER() OVER (
+                            PARTITION BY in_tier, device_id, timestamp / ?, COALESCE(activity, '')
+                            ORDER BY redundant, id
+                        ) AS pick
+                        FROM (SELECT *, timestamp >= ? AND timestamp < ? AS in_tier FROM stage{i - 1})
+                    )
+                    WHERE NOT in_tier OR pick = 1 OR COALESCE(is_anomaly, 0) IN (1, X'01')
+                )''')
+                params += [resolution, low, cutoff]
+            kept = f'stage{len(ranges)}'
+            downsampled, archived = conn.execute(f'''
+                WITH {', '.join(stages)}
+                SELECT (SELECT COUNT(*) FROM stage0) - (SELECT COUNT(*) FROM {kept}),
+                       (SELECT COUNT(*) FROM {kept} WHERE timestamp < ?)
+            ''', params + [archive_before]).fetchone()
+            partitions = [name for name, _, _ in self._archive_months(conn, now)]
+        return downsampled, archived, partitions
+
+    def _archive_counts(self, conn, now):
+        """(rows, month names) archive() would move"""
+        archived = 0
+        partitions = []
+        for name, month_start, month_end in self._archive_months(conn, now):
+            archived += conn.execute('SELECT COUNT(*) FROM gps_data WHERE timestamp >= ? AND timestamp < ?',
+                                     (month_start, month_end)).fetchone()[0]
+            partitions.append(name)
+        return archived, partitions
+
+    def _archive_months(self, conn, now):
+        """Months to archive, oldest first: only months that ended before the cutoff month began"""
+        _, archive_before, _ = month_bounds(now - self.archive_after)
+        low = 0
+        while True:
+            first = conn.execute('SELECT MIN(timestamp) FROM gps_data WHERE timestamp >= ? AND timestamp < ?',
+                                 (low, archive_before)).fetchone()[0]
+            if first is None:
+                return
+            month = month_bounds(first)
+            low = month[2]
+            yield month
+
+    def archive(self, now, dry_run=False):
+        with storage.connection(self.path) as conn:
+            if dry_run:
+                return self._archive_counts(conn, now)
+            months = list(self._archive_months(conn, now))
+        archived = 0
+        partitions = []
+        for name, month_start, month_end in months:
+            archived += self._archive_month(name, month_start, month_end)
+            partitions.append(name)
+        return archived, partitions
+
+    def _archive_month(self, name, month_start, month_end):
+        with storage.connection(self.path) as conn:
+            rows = conn.execute(f'''
+                SELECT {', '.join(GPS_COLUMNS)} FROM gps_data
+                WHERE timestamp >= ? AND timestamp < ?
+                ORDER BY id
+            ''', (month_start, month_end)).fetchall()
+            key_before = downsampled_before(conn)
+        if not rows:
+            return 0
+        max_id = rows[-1][0]
+        partition = self._write_partition(name, rows, key_before)
+
+        with storage.connection(self.path) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Rows stored after the read have higher ids; they go with the next run
+            deleted = _delete(conn, 'timestamp >= ? AND timestamp < ? AND id <= ?', (month_start, month_end, max_id))
+            _catalog(conn, partition)
+        print(f"📦 Partisi {name}: {deleted} titik dipindah ke {partition['path']} "
+              f"({partition['rows']} titik, {partition['bytes'] / 1024:.0f} KB)")
+        return deleted
+
+    def _rekey_partitions(self):
+        """
+        Once after migration 8: rewrite partitions archived while downsampling
+        still kept redundant rows, so their thinned rows are key points
+        """
+        with storage.connection(self.path) as conn:
+            if not conn.execute("SELECT 1 FROM retention_state WHERE key = 'rekey_partitions'").fetchone():
+                return
+            key_before = downsampled_before(conn)
+            partitions = [p for p in overlapping_partitions(conn) if p['min_ts'] < key_before]
+        for partition in partitions:
+            entry = self._write_partition(partition['name'], [], key_before)
+            with storage.connection(self.path) as conn:
+                _catalog(conn, entry)
+                _bump_generation(conn)
+            print(f"🗝️ Partisi {partition['name']}: titik hasil downsampling ditandai sebagai key point")
+        with storage.connection(self.path) as conn:
+            conn.execute("DELETE FROM retention_state WHERE key = 'rekey_partitions'")
+
+    def _write_partition(self, name, rows, key_before=0):
+        """
+        Merge rows into the month's archive file (by id) and return its catalog entry
+
+        Rows older than key_before (the downsampled range) are stored as key points.
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        final = os.path.join(self.archive_dir, f'gps_data-{name}.sqlite.gz')
+        work = os.path.join(self.archive_dir, f'gps_data-{name}.sqlite.tmp{os.getpid()}')
+        if os.path.exists(work):
+            os.remove(work)
+        if os.path.exists(final):
+            with gzip.open(final, 'rb') as src, open(work, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+
+        db = sqlite3.connect(work)
+        try:
+            for statement in PARTITION_SCHEMA:
+                db.execute(statement)
+            if 'redundant' not in [column[1] for column in db.execute('PRAGMA table_info(gps_data)')]:
+                # Partition archived before trajectory compression
+                db.execute('ALTER TABLE gps_data ADD COLUMN redundant INTEGER NOT NULL DEFAULT 0')
+            db.executemany(
+                f"INSERT OR REPLACE INTO gps_data ({', '.join(GPS_COLUMNS)}) VALUES ({', '.join('?' * len(GPS_COLUMNS))})",
+                rows
+            )
+            db.execute('UPDATE gps_data SET redundant = 0 WHERE timestamp < ? AND redundant = 1', (key_before,))
+            db.commit()
+            min_ts, max_ts, min_id, max_id, count = db.execute(
+                'SELECT MIN(timestamp), MAX(timestamp), MIN(id), MAX(id), COUNT(*) FROM gps_data'
+            ).fetchone()
+            db.execute('VACUUM')
+        finally:
+            db.close()
+
+        with open(work, 'rb') as src, gzip.open(f'{final}.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(f'{final}.tmp', final)
+        os.remove(work)
+        return {
+            'name': name, 'path': final, 'min_ts': min_ts, 'max_ts': max_ts, 'min_id': min_id, 'max_id': max_id,
+            'rows': count, 'bytes': os.path.getsize(final), 'archived_at': int(time.time())
+        }
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+_background = None
+
+
+def get_manager(path=None):
+    """Process-wide RetentionManager for a database file"""
+    with _managers_lock:
+        manager = _managers.get(path)
+        if manager is None:
+            manager = _managers[path] = RetentionManager(path)
+        return manager
+
+
+def start_background(path=None, interval=RETENTION_INTERVAL):
+    """Run retention every interval seconds in a daemon thread (once per process)"""
+    global _background
+    with _managers_lock:
+        if _background is not None:
+            return _background
+
+        def loop():
+            while True:
+                try:
+                    get_manager(path).run()
+                except Exception as e:
+                    print(f"⚠️ Retention failed: {e}")
+                time.sleep(interval)
+
+        _background = threading.Thread(target=loop, name='retention', daemon=True)
+        _background.start()
+        return _background
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Downsample and archive old gps_data')
+    parser.add_argument('--db', default=None, help='SQLite database (default: GPS_DB_PATH)')
+    parser.add_argument('--now', type=int, default=None, help='Reference time (epoch seconds)')
+    parser.add_argument('--dry-run', action='store_true', help='Only count what would be removed')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM afterwards to return freed pages to the OS')
+    args = parser.parse_args()
+
+    get_manager(args.db).run(args.now, args.dry_run)
+    if args.vacuum and not args.dry_run:
+        with storage.connection(args.db) as conn:
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        print(f"🗜️ Database di-vacuum: {os.path.getsize(args.db or storage.DATABASE_PATH) / 1024:.0f} KB")
+
+
+if __name__ == '__main__':
+    main()
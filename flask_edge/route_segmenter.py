@@ -0,0 +1,410 @@
+# File: flask_edge/route_segmenter.py
+# Incremental route segmentation for Smart GPS Tracker
+# Splits gps_data into trips at ingest time and materializes them in the routes table
+
+import argparse
+import threading
+from datetime import datetime, timezone
+
+import storage
+from models.geo import haversine_m, step_distances_m
+
+# Default split rules (the history screen asks for time_gap=180)
+ROUTE_TIME_GAP = 180            # Seconds without a point that end a route
+STATIONARY_SPLIT_RECENT = 10    # Max points of a stationary route within the last 24h
+STATIONARY_SPLIT_OLD = 50       # Max points of an older stationary route
+RECENT_WINDOW = 86400
+
+SYNC_BATCH = 2000               # Max new points one sync() folds in (one write transaction)
+
+POINT_COLUMNS = 'id, latitude, longitude, speed, timestamp, activity, is_anomaly, device_id'
+
+ROUTE_COLUMNS = ('id', 'route_name', 'start_time', 'end_time', 'total_distance', 'avg_speed',
+                 'main_activity', 'anomaly_count', 'start_point_id', 'end_point_id', 'max_point_id',
+                 'point_count', 'duration_seconds', 'start_lat', 'start_lon', 'end_lat', 'end_lon',
+                 'speed_sum', 'status', 'device_id')
+
+
+class RouteSegmenter:
+    """
+    Folds chronologically ordered points into routes
+
+    A new route starts on a time gap longer than time_gap, on any activity
+    change, and every STATIONARY_SPLIT_* points of a stationary stretch. Only
+    the open route is kept while feeding; add() hands back the route it closed.
+    """
+
+    def __init__(self, time_gap=ROUTE_TIME_GAP, now=None, split_recent=True):
+        """
+        Args:
+            time_gap: Seconds without a point that end a route
+            now: Reference time of the recent stationary split (default: current time)
+            split_recent: False splits every stationary stretch every STATIONARY_SPLIT_OLD
+                          points, so the routes do not depend on when they were segmented
+        """
+        self.time_gap = time_gap
+        self.now = now if now is not None else datetime.now(timezone.utc).timestamp()
+        self.split_recent = split_recent
+        self.current = None
+
+    def _starts_new_route(self, point):
+        route = self.current
+        if route is None:
+            return True
+        if point['timestamp'] - route['end_time'] > self.time_gap:
+            return True
+        if route['main_activity'] != point['activity']:
+            return True
+        if route['main_activity'] == 'stationary' and point['activity'] == 'stationary':
+            is_recent = self.split_recent and point['timestamp'] > self.now - RECENT_WINDOW
+            return route['point_count'] > (STATIONARY_SPLIT_RECENT if is_recent else STATIONARY_SPLIT_OLD)
+        return False
+
+    def add(self, point, step=None):
+        """
+        Add one point (dict with id, lat, lon, speed, timestamp, activity, is_anomaly)
+
+        Args:
+            point: The next point
+            step: Meters from the previous point, if already known (see feed)
+
+        Returns:
+            dict: The route closed by this point, or None
+        """
+        if not self._starts_new_route(point):
+            route = self.current
+            if step is None:
+                step = haversine_m(route['end_lat'], route['end_lon'], point['lat'], point['lon'])
+            route['total_distance'] += float(step)
+            route['end_time'] = point['timestamp']
+            route['end_point_id'] = point['id']
+            route['max_point_id'] = max(route['max_point_id'], point['id'])
+            route['end_lat'], route['end_lon'] = point['lat'], point['lon']
+            route['point_count'] += 1
+            route['speed_sum'] += point['speed'] or 0
+            route['anomaly_count'] += 1 if point['is_anomaly'] else 0
+            route['dirty'] = True
+            return None
+
+        closed = self.current
+        self.current = {
+            'id': None,
+            'start_time': point['timestamp'],
+            'end_time': point['timestamp'],
+            'start_point_id': point['id'],
+            'end_point_id': point['id'],
+            'max_point_id': point['id'],
+            'start_lat': point['lat'],
+            'start_lon': point['lon'],
+            'end_lat': point['lat'],
+            'end_lon': point['lon'],
+            'total_distance': 0.0,
+            'point_count': 1,
+            'speed_sum': point['speed'] or 0,
+            'anomaly_count': 1 if point['is_anomaly'] else 0,
+            'main_activity': point['activity'],
+            'device_id': point['device_id'],
+            'dirty': True
+        }
+        return closed
+
+    def feed(self, points):
+        """
+        Add a chronologically ordered list of points (one device)
+
+        Step distances for the whole batch are one vectorized haversine call.
+
+        Returns:
+            list: Routes closed along the way
+        """
+        if not points:
+            return []
+        lats = [point['lat'] for point in points]
+        lons = [point['lon'] for point in points]
+        if self.current is not None:
+            steps = step_distances_m([self.current['end_lat']] + lats, [self.current['end_lon']] + lons)
+        else:
+            steps = [None] + list(step_distances_m(lats, lons))
+        closed = [self.add(point, step) for point, step in zip(points, steps)]
+        return [route for route in closed if route is not None]
+
+
+def segment_points(points, time_gap=ROUTE_TIME_GAP):
+    """
+    Segment an in-memory, chronologically ordered list of points (any devices)
+
+    Returns:
+        list: Route summaries ordered by start time (each device's last one still open)
+    """
+    by_device = {}
+    for point in points:
+        by_device.setdefault(point['device_id'], []).append(point)
+    routes = []
+    for device_points in by_device.values():
+        segmenter = RouteSegmenter(time_gap)
+        routes += segmenter.feed(device_points)
+        routes.append(segmenter.current)
+    routes.sort(key=lambda route: route['start_time'])
+    return [finalize(route) for route in routes]
+
+
+def finalize(route):
+    """Fill the derived columns (duration, average speed, name) of a route summary"""
+    duration = route['end_time'] - route['start_time']
+    route['duration_seconds'] = duration
+    route['avg_speed'] = route['speed_sum'] / route['point_count'] if duration > 0 else 0
+    route['route_name'] = f"{route['main_activity']} {datetime.fromtimestamp(route['start_time'], tz=timezone.utc):%Y-%m-%d %H:%M}Z"
+    return route
+
+
+def _point(row):
+    return {
+        'id': row[0], 'lat': row[1], 'lon': row[2], 'speed': row[3],
+        'timestamp': row[4], 'activity': row[5], 'is_anomaly': bool(row[6]), 'device_id': row[7]
+    }
+
+
+def _load_open_route(cursor, device_id):
+    cursor.execute(f'''
+        SELECT {', '.join(ROUTE_COLUMNS)} FROM routes
+        WHERE status = 'open' AND device_id = ?
+        ORDER BY start_time DESC
+        LIMIT 1
+    ''', (device_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    route = dict(zip(ROUTE_COLUMNS, row))
+    route['dirty'] = False
+    return route
+
+
+def _save(cursor, route, status):
+    finalize(route)
+    values = {column: route[column] for column in ROUTE_COLUMNS if column not in ('id', 'status')}
+    values['status'] = status
+    if route['id'] is None:
+        cursor.execute(
+            f"INSERT INTO routes ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+            list(values.values())
+        )
+        route['id'] = cursor.lastrowid
+    else:
+        cursor.execute(
+            f"UPDATE routes SET {', '.join(f'{column} = ?' for column in values)} WHERE id = ?",
+            list(values.values()) + [route['id']]
+        )
+    route['dirty'] = False
+
+
+class RouteStore:
+    """
+    Keeps the routes table in step with gps_data
+
+    sync() reads points with a rowid above the highest one already segmented,
+    at most SYNC_BATCH of them per call; backfill() catches up a long backlog.
+    Stored routes split stationary stretches every STATIONARY_SPLIT_OLD points
+    whatever their age; recent_routes() applies the recent split when read.
+    Each device is segmented on its own: in-order points extend the device's
+    open route; a back-filled point older than the device's newest route
+    re-segments only the affected tail (routes ending within time_gap of it).
+    All state lives in the database, so the Flask process and a standalone MQTT
+    subscriber can both call sync() on the same file.
+    """
+
+    def __init__(self, path=None, time_gap=ROUTE_TIME_GAP):
+        self.path = path
+        self.time_gap = time_gap
+        self._lock = threading.Lock()
+
+    def _last_point_id(self, cursor):
+        cursor.execute('SELECT COALESCE(MAX(max_point_id), 0) FROM routes')
+        return cursor.fetchone()[0]
+
+    def has_pending(self):
+        """True when gps_data has points that are not segmented yet"""
+        with storage.connection(self.path) as conn:
+            cursor = conn.cursor()
+            last_id = self._last_point_id(cursor)
+            cursor.execute('SELECT 1 FROM gps_data WHERE id > ? LIMIT 1', (last_id,))
+            return cursor.fetchone() is not None
+
+    def sync(self, limit=SYNC_BATCH):
+        """
+        Segment the next points stored since the last sync
+
+        Ingest and /routes call this on every write and read, so one call folds
+        in at most `limit` points; the rest is left for the next call.
+
+        Returns:
+            int: Number of points folded in
+        """
+        if not self.has_pending():
+            return 0
+
+        with self._lock, storage.connection(self.path) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.cursor()
+
+            last_id = self._last_point_id(cursor)
+            cursor.execute(f'SELECT {POINT_COLUMNS} FROM gps_data WHERE id > ? ORDER BY id LIMIT ?', (last_id, limit))
+            new_points = sorted((_point(row) for row in cursor.fetchall()),
+                                key=lambda point: (point['timestamp'], point['id']))
+            if not new_points:
+                return 0
+
+            by_device = {}
+            for point in new_points:
+                by_device.setdefault(point['device_id'], []).append(point)
+            for device_id, points in by_device.items():
+                self._sync_device(cursor, device_id, points)
+
+        return len(new_points)
+
+    def _sync_device(self, cursor, device_id, new_points):
+        cursor.execute('SELECT COALESCE(MAX(end_time), 0) FROM routes WHERE device_id = ?', (device_id,))
+        newest_end = cursor.fetchone()[0]
+
+        segmenter = RouteSegmenter(self.time_gap, split_recent=False)
+        if new_points[0]['timestamp'] >= newest_end:
+            segmenter.current = _load_open_route(cursor, device_id)
+            points = new_points
+        else:
+            points = self._reopen_tail(cursor, device_id, new_points[0]['timestamp'])
+
+        for closed in segmenter.feed(points):
+            _save(cursor, closed, 'closed')
+        if segmenter.current is not None and segmenter.current['dirty']:
+            _save(cursor, segmenter.current, 'open')
+
+    def _reopen_tail(self, cursor, device_id, timestamp):
+        """Drop a device's routes a back-filled point can change and return the points to re-segment"""
+        cutoff = timestamp - self.time_gap
+        cursor.execute('SELECT MIN(start_time) FROM routes WHERE device_id = ? AND end_time >= ?', (device_id, cutoff))
+        start = cursor.fetchone()[0]
+        start = timestamp if start is None else min(start, timestamp)
+
+        cursor.execute('DELETE FROM routes WHERE device_id = ? AND end_time >= ?', (device_id, cutoff))
+        # Whatever remains ends before the gap, so a new route starts after it
+        cursor.execute("UPDATE routes SET status = 'closed' WHERE device_id = ? AND status = 'open'", (device_id,))
+
+        cursor.execute(f'''
+            SELECT {POINT_COLUMNS} FROM gps_data
+            WHERE device_id = ? AND timestamp >= ?
+            ORDER BY timestamp, id
+        ''', (device_id, start))
+        points = [_point(row) for row in cursor.fetchall()]
+        print(f"🧭 Routes {device_id} re-segmented from {start} ({len(points)} points)")
+        return points
+
+    def recent_routes(self, limit=10, min_points=2, device_id=None, now=None):
+        """
+        Most recent routes first (of one device, or of all), as stored summaries
+
+        Stationary routes reaching into the last RECENT_WINDOW are split every
+        STATIONARY_SPLIT_RECENT points here, against the current time, so they
+        read as one longer route again once they age out of the window.
+        """
+        self.sync()
+        now = now if now is not None else datetime.now(timezone.utc).timestamp()
+        device_filter = '' if device_id is None else 'AND device_id = ?'
+        params = (min_points,) + (() if device_id is None else (device_id,)) + (limit,)
+        routes = []
+        offset = 0
+        with storage.connection(self.path) as conn:
+            cursor = conn.cursor()
+            # Pages of stored routes until enough splits have min_points
+            while len(routes) < limit:
+                rows = cursor.execute(f'''
+                    SELECT {', '.join(ROUTE_COLUMNS)} FROM routes
+                    WHERE point_count >= ? {device_filter}
+                    ORDER BY start_time DESC
+                    LIMIT ? OFFSET ?
+                ''', params + (offset,)).fetchall()
+                for row in rows:
+                    routes += [route for route in self._split_recent(cursor, dict(zip(ROUTE_COLUMNS, row)), now)
+                               if route['point_count'] >= min_points]
+                if len(rows) < limit:
+                    break
+                offset += limit
+        routes.sort(key=lambda route: route['start_time'], reverse=True)
+        return routes[:limit]
+
+    def _split_recent(self, cursor, route, now):
+        """A stored route as the routes the recent stationary split makes of it"""
+        if (route['main_activity'] != 'stationary' or route['end_time'] <= now - RECENT_WINDOW
+                or route['point_count'] <= STATIONARY_SPLIT_RECENT + 1):
+            return [route]
+        cursor.execute(f'''
+            SELECT {POINT_COLUMNS} FROM gps_data
+            WHERE device_id = ? AND timestamp BETWEEN ? AND ?
+              AND (timestamp, id) >= (?, ?) AND (timestamp, id) <= (?, ?)
+            ORDER BY timestamp, id
+        ''', (route['device_id'], route['start_time'], route['end_time'],
+              route['start_time'], route['start_point_id'], route['end_time'], route['end_point_id']))
+        points = [_point(row) for row in cursor.fetchall()]
+        if not points:
+            return [route]
+
+        segmenter = RouteSegmenter(self.time_gap, now)
+        routes = segmenter.feed(points) + [segmenter.current]
+        for split in routes:
+            split['id'] = route['id']
+            split['status'] = 'closed'
+        routes[-1]['status'] = route['status']
+        return [finalize(split) for split in routes]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path=None):
+    """Process-wide RouteStore for a database file"""
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = RouteStore(path)
+        return store
+
+
+def sync(path=None):
+    """Segment pending points; never raises (called right after ingest commits)"""
+    try:
+        return get_store(path).sync()
+    except Exception as e:
+        print(f"⚠️ Route segmentation failed: {e}")
+        return 0
+
+
+def backfill(path=None, batch=SYNC_BATCH):
+    """
+    Segment every pending point, one committed transaction per `batch` points
+
+    For databases with points stored before routes were materialized; run it
+    once offline so the request path only ever folds in the newest points.
+
+    Returns:
+        int: Number of points folded in
+    """
+    store = get_store(path)
+    total = 0
+    while True:
+        count = store.sync(batch)
+        if not count:
+            break
+        total += count
+        print(f"🧭 Routes: {total} titik tersegmentasi")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Segment gps_data points not yet in the routes table')
+    parser.add_argument('--db', default=None, help='SQLite database (default: GPS_DB_PATH)')
+    parser.add_argument('--batch', type=int, default=SYNC_BATCH, help='Points per transaction')
+    args = parser.parse_args()
+    backfill(args.db, args.batch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# File: flask_edge/stats.py
+# Rolling statistics for Smart GPS Tracker
+# Answers /stats from the stats_buckets summary table kept up to date by gps_data triggers
+
+import threading
+import time
+from datetime import datetime, timezone
+
+import storage
+
+# How long fine-grained buckets are kept (day and total buckets are kept forever)
+RETENTION_SECONDS = {
+    'minute': 2 * 86400,
+    'hour': 35 * 86400,
+}
+PRUNE_INTERVAL = 3600
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+def prune(conn, now=None):
+    """
+    Drop expired minute/hour buckets and buckets emptied by deletes
+
+    Returns:
+        int: Number of bucket rows removed
+    """
+    now = now if now is not None else time.time()
+    removed = 0
+    for granularity, seconds in RETENTION_SECONDS.items():
+        removed += conn.execute(
+            'DELETE FROM stats_buckets WHERE granularity = ? AND bucket_start < ?',
+            (granularity, int(now - seconds))
+        ).rowcount
+    removed += conn.execute('DELETE FROM stats_buckets WHERE points <= 0').rowcount
+    return removed
+
+
+def _maybe_prune(conn):
+    global _last_prune
+    with _prune_lock:
+        if time.time() - _last_prune < PRUNE_INTERVAL:
+            return
+        _last_prune = time.time()
+    removed = prune(conn)
+    if removed:
+        print(f"🧹 Stats buckets pruned: {removed}")
+
+
+def _recent_activity(cursor, since):
+    """
+    Points per activity inserted since `since` (epoch seconds, UTC)
+
+    Whole hours come from hour buckets and the partial first hour from minute
+    buckets, so the window is exact to the minute.
+    """
+    first_minute = int(since) // 60 * 60
+    first_hour = -(-first_minute // 3600) * 3600
+    cursor.execute('''
+        SELECT activity, SUM(points) AS count
+        FROM stats_buckets
+        WHERE activity != ''
+        AND ((granularity = 'hour' AND bucket_start >= ?)
+             OR (granularity = 'minute' AND bucket_start >= ? AND bucket_start < ?))
+        GROUP BY activity
+        HAVING count > 0
+        ORDER BY count DESC
+    ''', (first_hour, first_minute, first_hour))
+    return [{'activity': row[0], 'count': row[1]} for row in cursor.fetchall()]
+
+
+def get_statistics(path=None, now=None):
+    """
+    Activity, anomaly and speed statistics in O(buckets)
+
+    Returns:
+        dict: Same fields as the /stats response, without generated_at
+    """
+    now = now if now is not None else datetime.now(timezone.utc).timestamp()
+    with storage.connection(path) as conn:
+        _maybe_prune(conn)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT activity, is_anomaly, points, speed_sum
+            FROM stats_buckets
+            WHERE granularity = 'total' AND bucket_start = 0 AND points > 0
+        ''')
+        totals = cursor.fetchall()
+        recent_activity = _recent_activity(cursor, now - 86400)
+
+    by_activity = {}
+    by_anomaly = {}
+    for activity, is_anomaly, points, speed_sum in totals:
+        by_anomaly[bool(is_anomaly)] = by_anomaly.get(bool(is_anomaly), 0) + points
+        if activity:
+            count, speed = by_activity.get(activity, (0, 0.0))
+            by_activity[activity] = (count + points, speed + speed_sum)
+
+    ranked = sorted(by_activity.items(), key=lambda item: item[1][0], reverse=True)
+    return {
+        'activity_distribution': [{'activity': activity, 'count': count} for activity, (count, _) in ranked],
+        'anomaly_statistics': [{'is_anomaly': flag, 'count': count} for flag, count in sorted(by_anomaly.items())],
+        'recent_activity': recent_activity,
+        'total_data_points': sum(by_anomaly.values()),
+        'speed_by_activity': [
+            {
+                'activity': activity,
+                'avg_speed': round(speed / count, 2),
+                'count': count
+            } for activity, (count, speed) in sorted(by_activity.items())
+        ]
+    }
+
+
+def timeline(granularity='hour', since=0, path=None):
+    """
+    Points, anomalies and average speed per time bucket
+
+    Args:
+        granularity: 'minute', 'hour' or 'day'
+        since: Oldest bucket start (epoch seconds, UTC)
+
+    Returns:
+        list: Buckets oldest first
+    """
+    with storage.connection(path) as conn:
+        rows = conn.execute('''
+            SELECT bucket_start, SUM(points), SUM(CASE WHEN is_anomaly THEN points ELSE 0 END), SUM(speed_sum)
+            FROM stats_buckets
+            WHERE granularity = ? AND bucket_start >= ?
+            GROUP BY bucket_start
+            HAVING SUM(points) > 0
+            ORDER BY bucket_start
+        ''', (granularity, int(since))).fetchall()
+    return [
+        {
+            'bucket_start': bucket_start,
+            'count': points,
+            'anomalies': anomalies,
+            'avg_speed': round(speed_sum / points, 2)
+        } for bucket_start, points, anomalies, speed_sum in rows
+    ]
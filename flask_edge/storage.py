@@ -0,0 +1,387 @@
+# File: flask_edge/storage.py
+# Shared SQLite storage for Smart GPS Tracker
+# Thread-safe connection pool used by the Flask handlers, the MQTT subscriber and the models
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Database path (relative to flask_edge/, override with GPS_DB_PATH)
+DATABASE_PATH = os.environ.get('GPS_DB_PATH', 'gps_data.db')
+
+# Device id of points stored before multi-device support (and of payloads without one)
+DEFAULT_DEVICE_ID = 'default'
+
+# Connection tuning
+POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024  # 256 MB
+
+# Rolling /stats aggregates: bucket widths in seconds ('total' is one bucket)
+STATS_GRANULARITIES = (('minute', 60), ('hour', 3600), ('day', 86400), ('total', 0))
+
+
+def _stats_bucket_upserts(row, sign):
+    """Trigger statements adding (sign=1) or removing (sign=-1) one gps_data row from every bucket"""
+    created = f"CAST(strftime('%s', COALESCE({row}.created_at, CURRENT_TIMESTAMP)) AS INTEGER)"
+    statements = []
+    for granularity, width in STATS_GRANULARITIES:
+        bucket = f'({created} / {width}) * {width}' if width else '0'
+        statements.append(f'''
+            INSERT INTO stats_buckets (granularity, bucket_start, activity, is_anomaly, points, speed_sum)
+            VALUES ('{granularity}', {bucket}, COALESCE({row}.activity, ''),
+                    CASE WHEN {row}.is_anomaly IN (1, X'01') THEN 1 ELSE 0 END, {sign}, {sign} * {row}.speed)
+            ON CONFLICT (granularity, bucket_start, activity, is_anomaly) DO UPDATE SET
+                points = points + excluded.points,
+                speed_sum = speed_sum + excluded.speed_sum;''')
+    return ''.join(statements)
+
+
+def _stats_backfill(granularity, width, where='1'):
+    bucket = f"(CAST(strftime('%s', created_at) AS INTEGER) / {width}) * {width}" if width else '0'
+    return f'''
+        INSERT INTO stats_buckets (granularity, bucket_start, activity, is_anomaly, points, speed_sum)
+        SELECT '{granularity}', {bucket}, COALESCE(activity, ''),
+               CASE WHEN is_anomaly IN (1, X'01') THEN 1 ELSE 0 END, COUNT(*), SUM(speed)
+        FROM gps_data
+        WHERE {where}
+        GROUP BY 2, 3, 4
+    '''
+
+
+# Versioned schema migrations, tracked with PRAGMA user_version.
+# Append new entries; never edit one that has shipped.
+MIGRATIONS = [
+    (1, 'gps_data and routes tables', [
+        '''
+        CREATE TABLE IF NOT EXISTS gps_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            speed REAL NOT NULL,
+            timestamp INTEGER NOT NULL,
+            activity TEXT,
+            is_anomaly BOOLEAN DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            route_name TEXT,
+            start_time DATETIME,
+            end_time DATETIME,
+            total_distance REAL,
+            avg_speed REAL,
+            main_activity TEXT,
+            anomaly_count INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, 'indexes for timestamp, created_at and activity access paths', [
+        # ORDER BY timestamp DESC LIMIT ? and the duplicate timestamp check,
+        # covering the columns get_recent_gps_data reads
+        '''
+        CREATE INDEX IF NOT EXISTS idx_gps_data_timestamp
+        ON gps_data (timestamp, latitude, longitude, speed, activity, is_anomaly)
+        ''',
+        # Time-window filters on insert time (duplicate check, last 24h stats)
+        'CREATE INDEX IF NOT EXISTS idx_gps_data_created_at ON gps_data (created_at)',
+        # /history?activity= ordered by timestamp and per-activity GROUP BY with AVG(speed)
+        'CREATE INDEX IF NOT EXISTS idx_gps_data_activity ON gps_data (activity, timestamp, speed)',
+    ]),
+    (3, 'materialized routes: point ranges, running totals and status', [
+        # start_time / end_time hold device epoch seconds, like gps_data.timestamp
+        'ALTER TABLE routes ADD COLUMN start_point_id INTEGER',
+        'ALTER TABLE routes ADD COLUMN end_point_id INTEGER',
+        'ALTER TABLE routes ADD COLUMN max_point_id INTEGER',
+        'ALTER TABLE routes ADD COLUMN point_count INTEGER DEFAULT 0',
+        'ALTER TABLE routes ADD COLUMN duration_seconds INTEGER DEFAULT 0',
+        'ALTER TABLE routes ADD COLUMN start_lat REAL',
+        'ALTER TABLE routes ADD COLUMN start_lon REAL',
+        'ALTER TABLE routes ADD COLUMN end_lat REAL',
+        'ALTER TABLE routes ADD COLUMN end_lon REAL',
+        'ALTER TABLE routes ADD COLUMN speed_sum REAL DEFAULT 0',
+        "ALTER TABLE routes ADD COLUMN status TEXT DEFAULT 'closed'",
+        # /routes newest first, sync() high-water mark and tail re-segmentation
+        'CREATE INDEX IF NOT EXISTS idx_routes_start_time ON routes (start_time)',
+        'CREATE INDEX IF NOT EXISTS idx_routes_max_point_id ON routes (max_point_id)',
+        'CREATE INDEX IF NOT EXISTS idx_routes_end_time ON routes (end_time)',
+        'CREATE INDEX IF NOT EXISTS idx_routes_status ON routes (status, start_time)',
+    ]),
+    (4, 'rolling stats buckets per activity, anomaly flag and insert-time bucket', [
+        # activity '' stands for NULL so the primary key can match it on upsert;
+        # early rows hold is_anomaly as a numpy.bool_ blob (X'00' / X'01')
+        '''
+        CREATE TABLE IF NOT EXISTS stats_buckets (
+            granularity TEXT NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            activity TEXT NOT NULL,
+            is_anomaly INTEGER NOT NULL,
+            points INTEGER NOT NULL DEFAULT 0,
+            speed_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket_start, activity, is_anomaly)
+        ) WITHOUT ROWID
+        ''',
+        # Triggers keep the buckets exact for every writer (Flask, MQTT, scripts)
+        f'''
+        CREATE TRIGGER IF NOT EXISTS gps_data_stats_insert AFTER INSERT ON gps_data
+        BEGIN{_stats_bucket_upserts('NEW', 1)}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS gps_data_stats_delete AFTER DELETE ON gps_data
+        BEGIN{_stats_bucket_upserts('OLD', -1)}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS gps_data_stats_update
+        AFTER UPDATE OF activity, is_anomaly, speed, created_at ON gps_data
+        BEGIN{_stats_bucket_upserts('OLD', -1)}{_stats_bucket_upserts('NEW', 1)}
+        END
+        ''',
+        # One-time back-fill; minute buckets only for the window stats.py keeps
+        _stats_backfill('minute', 60, "created_at >= datetime('now', '-2 days')"),
+        _stats_backfill('hour', 3600, "created_at >= datetime('now', '-35 days')"),
+        _stats_backfill('day', 86400),
+        _stats_backfill('total', 0),
+    ]),
+    (5, 'device_id on gps_data and routes', [
+        f"ALTER TABLE gps_data ADD COLUMN device_id TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE_ID}'",
+        f"ALTER TABLE routes ADD COLUMN device_id TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE_ID}'",
+        # Per-device recent points, staleness/duplicate checks and history filters
+        'CREATE INDEX IF NOT EXISTS idx_gps_data_device_timestamp ON gps_data (device_id, timestamp)',
+        # Per-device open route and /routes?device_id=
+        'CREATE INDEX IF NOT EXISTS idx_routes_device_start_time ON routes (device_id, start_time)',
+    ]),
+    (6, 'retention state, archived partition catalog and retention-aware stats delete trigger', [
+        # 'generation' counts retention runs that removed rows (part of the /history ETag);
+        # 'deleting' exists only inside a retention transaction, never committed
+        '''
+        CREATE TABLE IF NOT EXISTS retention_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        # One row per month of gps_data moved to a compressed archive file
+        '''
+        CREATE TABLE IF NOT EXISTS archived_partitions (
+            name TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            min_ts INTEGER NOT NULL,
+            max_ts INTEGER NOT NULL,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            rows INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            archived_at INTEGER NOT NULL
+        )
+        ''',
+        # Stats count every ingested point: downsampling and archival do not subtract
+        'DROP TRIGGER IF EXISTS gps_data_stats_delete',
+        f'''
+        CREATE TRIGGER gps_data_stats_delete AFTER DELETE ON gps_data
+        WHEN NOT EXISTS (SELECT 1 FROM retention_state WHERE key = 'deleting')
+        BEGIN{_stats_bucket_upserts('OLD', -1)}
+        END
+        ''',
+    ]),
+    (7, 'redundant flag from ingest-time trajectory compression', [
+        # 1: within tolerance of the dead-reckoned track (trajectory.py); rows before this migration stay 0
+        'ALTER TABLE gps_data ADD COLUMN redundant INTEGER NOT NULL DEFAULT 0',
+        # Key points of a device in time order (/history and /routes with ?tolerance=)
+        'CREATE INDEX IF NOT EXISTS idx_gps_data_device_key ON gps_data (device_id, redundant, timestamp)',
+    ]),
+    (8, 'key points for rows thinned by downsampling', [
+        # Downsampling used to keep redundant rows; what survived it is the track, so every row is a key point
+        '''
+        UPDATE gps_data SET redundant = 0
+        WHERE redundant = 1
+          AND timestamp < (SELECT COALESCE(MAX(value), 0) FROM retention_state WHERE key LIKE 'downsampled_before_%')
+        ''',
+        # Archive partitions are files: RetentionManager rewrites them on its next run
+        "INSERT OR REPLACE INTO retention_state (key, value) VALUES ('rekey_partitions', 1)",
+    ]),
+    (9, 'routes re-segmented with the age-independent stationary split', [
+        # Stationary routes were stored with the 24h split of their ingest time; sync() and
+        # route_segmenter.backfill() rebuild them, recent_routes() splits recent ones when read
+        'DELETE FROM routes',
+    ]),
+]
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of SQLite connections shared across threads
+
+    Every connection runs in WAL mode with synchronous=NORMAL and a memory-mapped
+    read path, so the Flask threads and the MQTT thread can read while one writes.
+    The schema is prepared once, when the first connection is opened.
+    """
+
+    def __init__(self, path=DATABASE_PATH, size=POOL_SIZE, timeout=30.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+
+        if not self._schema_ready:
+            self._prepare_schema(conn)
+        return conn
+
+    def _prepare_schema(self, conn):
+        migrate(conn)
+        self._schema_ready = True
+
+    def acquire(self):
+        """Take an idle connection, opening a new one while below pool size"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                conn = self._open()
+                self._created += 1
+                return conn
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No SQLite connection available after {self.timeout}s")
+
+    def release(self, conn):
+        """Return a connection to the pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with-block
+
+        Commits on success and rolls back on error before returning it to the pool.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle connection (used on shutdown and in scripts)"""
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                    self._created -= 1
+                except queue.Empty:
+                    break
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """
+    Apply pending migrations up to target (default: latest)
+
+    Each migration runs in its own IMMEDIATE transaction and re-checks the version
+    inside it, so two processes starting together apply it only once.
+    """
+    for version, description, statements in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        if version <= schema_version(conn):
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+            print(f"🗄️ Database migrated to v{version}: {description}")
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def device_id_or_default(value):
+    """Device id as stored: str(value), DEFAULT_DEVICE_ID when missing or empty"""
+    if value is None or value == '':
+        return DEFAULT_DEVICE_ID
+    return str(value)
+
+
+def recent_duplicate_count(cursor, timestamp, window='-10 minutes', device_id=DEFAULT_DEVICE_ID):
+    """
+    Count rows of a device with the same timestamp inserted within the window
+
+    created_at holds CURRENT_TIMESTAMP text ('YYYY-MM-DD HH:MM:SS'), which sorts
+    the same as datetime(), so the column is compared bare. The (device_id,
+    timestamp) index narrows the scan to the matching rows.
+    """
+    cursor.execute('''
+        SELECT COUNT(*) FROM gps_data
+        WHERE device_id = ? AND timestamp = ? AND created_at >= datetime('now', ?)
+    ''', (device_id, timestamp, window))
+    return cursor.fetchone()[0]
+
+
+def last_stored_timestamp(cursor, device_id=DEFAULT_DEVICE_ID):
+    """Newest timestamp stored for a device (index lookup, O(log n))"""
+    cursor.execute('SELECT MAX(timestamp) FROM gps_data WHERE device_id = ?', (device_id,))
+    row = cursor.fetchone()
+    return row[0] if row and row[0] is not None else 0
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=None):
+    """Process-wide pool for a database file"""
+    path = path or DATABASE_PATH
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
+
+def connection(path=None):
+    """Shortcut for get_pool(path).connection()"""
+    return get_pool(path).connection()
+
+
+def init_db(path=None):
+    """Open the pool once so the schema is prepared before the first request"""
+    with connection(path):
+        pass
@@ -1,120 +1,207 @@
 # File: train_random_forest.py
 # Versi "Ultra": Advanced Feature Engineering dengan Rolling Windows + Tuning
+# Pipeline: fitur vektor (cache di disk per hash dataset) -> search paralel dengan CV per route_id -> laporan waktu
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
 
-import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, GridSearchCV
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (enables HalvingRandomSearchCV)
+from sklearn.model_selection import (GridSearchCV, HalvingRandomSearchCV, RandomizedSearchCV,
+                                     StratifiedGroupKFold)
 from sklearn.metrics import accuracy_score, classification_report
-import joblib
-import time
+from models.artifact_cache import save_artifact
+from models.activity_features import FEATURES, WINDOW_SIZE, build_features
+from training_data import fingerprint, read_dataset
 
-def calculate_bearing(lat1, lon1, lat2, lon2):
-    """Menghitung arah pergerakan (bearing) dari dua titik koordinat."""
-    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
-    dLon = lon2 - lon1
-    y = np.sin(dLon) * np.cos(lat2)
-    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dLon)
-    bearing = np.arctan2(y, x)
-    bearing = np.degrees(bearing)
-    bearing = (bearing + 360) % 360
-    return bearing
+FEATURE_CACHE_DIR = 'feature_cache'
+FEATURE_VERSION = 1   # Naikkan jika build_features berubah (cache lama otomatis tidak terpakai)
+TARGET = 'activity_label'
+GROUP = 'route_id'
 
-def main():
-    start_time = time.time()
-    
-    # --- 1. MEMBACA & MEMPERSIAPKAN DATA ---
-    # Gunakan dataset terbesar yang Anda miliki (200+ atau 500+ baris)
-    file_path = 'activity_dataset.csv' 
-    df = pd.read_csv(file_path)
-    print(f"📊 Dataset loaded: {len(df)} data points")
+# Ruang pencarian (random / halving); grid memakai versi kecil yang sama seperti sebelumnya
+PARAM_DISTRIBUTIONS = {
+    'n_estimators': [100, 200, 300],
+    'max_depth': [None, 10, 20, 30],
+    'min_samples_split': [2, 5, 10],
+    'min_samples_leaf': [1, 2, 4],
+    'max_features': ['sqrt', 'log2', None],
+    'class_weight': ['balanced', 'balanced_subsample'],
+}
+PARAM_GRID = {
+    'n_estimators': [100, 200],
+    'max_depth': [None, 20, 30],
+    'min_samples_split': [2, 5],
+    'min_samples_leaf': [1, 2]
+}
 
-    df.sort_values(by=['route_id', 'timestamp'], inplace=True)
-    
-    # --- 2. BASIC FEATURE ENGINEERING ---
-    df['time_diff'] = df.groupby('route_id')['timestamp'].diff().fillna(0)
-    df['speed_diff'] = df.groupby('route_id')['speed_mps'].diff().fillna(0)
-    df['acceleration_mps2'] = np.where(df['time_diff'] > 0, df['speed_diff'] / df['time_diff'], 0)
-
-    df['prev_lat'] = df.groupby('route_id')['latitude'].shift(1)
-    df['prev_lon'] = df.groupby('route_id')['longitude'].shift(1)
-    df['bearing'] = df.apply(
-        lambda row: calculate_bearing(row['prev_lat'], row['prev_lon'], row['latitude'], row['longitude']) 
-        if pd.notnull(row['prev_lat']) else 0,
-        axis=1
-    )
-    df.drop(columns=['time_diff', 'speed_diff', 'prev_lat', 'prev_lon'], inplace=True)
-    
-    # --- 3. ADVANCED FEATURE ENGINEERING: ROLLING WINDOWS ---
+
+class StageTimer:
+    """Durasi per tahap pipeline untuk laporan waktu"""
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        print("\n⏱️ Laporan waktu")
+        for name, seconds in self.stages.items():
+            print(f"  {name:22s} {seconds:8.2f} s  ({seconds / total:5.1%})")
+        print(f"  {'total':22s} {total:8.2f} s")
+        return {'stages': self.stages, 'total_seconds': total}
+
+
+def dataset_key(path):
+    """Hash isi dataset (CSV, atau daftar part untuk direktori export) + definisi fitur: kunci cache fitur"""
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        digest.update(fingerprint(path).encode())
+    else:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    digest.update(json.dumps([FEATURE_VERSION, WINDOW_SIZE, FEATURES]).encode())
+    return digest.hexdigest()[:16]
+
+
+def load_features(path, cache_dir=FEATURE_CACHE_DIR):
+    """
+    Matriks fitur, label dan grup route untuk dataset di path
+
+    Hasil build_features disimpan sebagai .npz di cache_dir dengan kunci hash
+    dataset, jadi run berikutnya pada data yang sama melewati tahap fitur.
+
+    Returns:
+        tuple: (X, y, groups, cache_hit)
+    """
+    cache_path = os.path.join(cache_dir, f'features-{dataset_key(path)}.npz') if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        cached = np.load(cache_path, allow_pickle=False)
+        return cached['X'], cached['y'], cached['groups'], True
+
+    df = read_dataset(path)
+    print(f"📊 Dataset loaded: {len(df)} data points")
     print("🔧 Performing Advanced Feature Engineering with Rolling Windows...")
-    WINDOW_SIZE = 5 # Menggunakan 5 data point terakhir (25 detik) sebagai konteks
-    
-    # Fitur-fitur yang akan kita buat versi rolling-nya
-    cols_for_rolling = ['speed_mps', 'acceleration_mps2', 'bearing']
-    
-    for col in cols_for_rolling:
-        # Menghitung rata-rata dan standar deviasi dalam window, dikelompokkan per rute
-        rolling_mean = df.groupby('route_id')[col].rolling(window=WINDOW_SIZE, min_periods=1).mean().reset_index(level=0, drop=True)
-        rolling_std = df.groupby('route_id')[col].rolling(window=WINDOW_SIZE, min_periods=1).std().reset_index(level=0, drop=True)
-        
-        # Menambahkan fitur baru ke dataframe
-        df[f'{col}_rol_mean_{WINDOW_SIZE}'] = rolling_mean
-        df[f'{col}_rol_std_{WINDOW_SIZE}'] = rolling_std
-        
-    # Membersihkan nilai NaN yang mungkin muncul dari perhitungan std dev
-    df.fillna(0, inplace=True)
+    df = build_features(df, group=GROUP)
+    X = df[FEATURES].to_numpy(dtype=np.float64)
+    y = df[TARGET].to_numpy(dtype=str)
+    groups = df[GROUP].to_numpy(dtype=str)
 
-    # --- 4. PERSIAPAN DATA UNTUK MODEL ---
-    # Sekarang kita gunakan SEMUA fitur yang telah kita buat
-    features = [
-        'speed_mps', 'acceleration_mps2', 'bearing',
-        'speed_mps_rol_mean_5', 'speed_mps_rol_std_5',
-        'acceleration_mps2_rol_mean_5', 'acceleration_mps2_rol_std_5',
-        'bearing_rol_mean_5', 'bearing_rol_std_5'
-    ]
-    target = 'activity_label'
-    
-    X = df[features]
-    y = df[target]
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.25, random_state=42, stratify=y
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{cache_path}.tmp{os.getpid()}.npz'
+        np.savez(tmp_path, X=X, y=y, groups=groups)
+        os.replace(tmp_path, cache_path)
+        print(f"💾 Fitur disimpan ke cache: {cache_path}")
+    return X, y, groups, False
+
+
+def make_search(kind, jobs, cv, n_iter, seed=42):
+    """
+    Hyperparameter search dengan CV per route (titik satu route tidak pernah
+    terbagi antara train dan validasi)
+    """
+    rf = RandomForestClassifier(random_state=seed, class_weight='balanced', n_jobs=1)
+    folds = StratifiedGroupKFold(n_splits=cv, shuffle=True, random_state=seed)
+    common = dict(cv=folds, n_jobs=jobs, scoring='accuracy', verbose=1)
+    if kind == 'grid':
+        return GridSearchCV(rf, PARAM_GRID, **common)
+    if kind == 'random':
+        return RandomizedSearchCV(rf, PARAM_DISTRIBUTIONS, n_iter=n_iter, random_state=seed, **common)
+    # Successive halving: banyak kandidat dengan sedikit pohon, yang terbaik dapat lebih banyak pohon
+    distributions = {k: v for k, v in PARAM_DISTRIBUTIONS.items() if k != 'n_estimators'}
+    return HalvingRandomSearchCV(
+        rf, distributions, resource='n_estimators', min_resources=25,
+        max_resources=max(PARAM_DISTRIBUTIONS['n_estimators']), factor=3,
+        n_candidates=n_iter, random_state=seed, **common
     )
-    
-    # --- 5. HYPERPARAMETER TUNING (Tetap dilakukan) ---
-    print("\n⚡ Memulai Hyperparameter Tuning dengan fitur baru...")
 
-    param_grid = {
-        'n_estimators': [100, 200],
-        'max_depth': [None, 20, 30],
-        'min_samples_split': [2, 5],
-        'min_samples_leaf': [1, 2]
-    }
 
-    rf = RandomForestClassifier(random_state=42, class_weight='balanced')
-    grid_search = GridSearchCV(estimator=rf, param_grid=param_grid, cv=5, n_jobs=-1, verbose=1, scoring='accuracy')
+def main():
+    parser = argparse.ArgumentParser(description='Train the rolling-window activity Random Forest')
+    parser.add_argument('--data', default='activity_dataset.csv',
+                        help='CSV atau direktori hasil training_data.py export (gunakan dataset terbesar)')
+    parser.add_argument('--output', default='activity_model.pkl')
+    parser.add_argument('--search', choices=('halving', 'random', 'grid'), default='halving')
+    parser.add_argument('--n-iter', type=int, default=60, help='Kandidat untuk random/halving search')
+    parser.add_argument('--cv', type=int, default=3, help='Fold CV per route_id')
+    parser.add_argument('--jobs', type=int, default=int(os.environ.get('TRAIN_JOBS', os.cpu_count() or 1)),
+                        help='Batas proses paralel search (default: semua CPU, atau TRAIN_JOBS)')
+    parser.add_argument('--no-cache', action='store_true', help='Hitung ulang fitur tanpa cache')
+    parser.add_argument('--report', help='Tulis laporan waktu + hasil ke file JSON ini')
+    args = parser.parse_args()
+
+    timer = StageTimer()
+
+    # --- 1-3. DATA + FEATURE ENGINEERING (dengan cache) ---
+    # Implementasi bersama dengan serving (models/activity_features.py), dicek oleh check_feature_parity.py
+    with timer.stage('features'):
+        X, y, groups, cache_hit = load_features(args.data, None if args.no_cache else FEATURE_CACHE_DIR)
+    print(f"🧮 {len(X)} titik, {len(np.unique(groups))} route, fitur dari {'cache' if cache_hit else 'dataset'}")
+
+    # --- 4. PERSIAPAN DATA UNTUK MODEL ---
+    # Holdout per route: sekitar 25% route untuk test
+    with timer.stage('split'):
+        holdout = StratifiedGroupKFold(n_splits=4, shuffle=True, random_state=42)
+        train_idx, test_idx = next(holdout.split(X, y, groups))
+        X_train, X_test = X[train_idx], X[test_idx]
+        y_train, y_test = y[train_idx], y[test_idx]
 
-    grid_search.fit(X_train, y_train)
+    # --- 5. HYPERPARAMETER TUNING ---
+    print(f"\n⚡ Memulai Hyperparameter Tuning ({args.search}, {args.jobs} proses, CV {args.cv} fold per route)...")
+    search = make_search(args.search, args.jobs, args.cv, args.n_iter)
+    with timer.stage('search'):
+        search.fit(X_train, y_train, groups=groups[train_idx])
+    fits = len(search.cv_results_['params']) * args.cv
 
     print("\n🏆 Proses Tuning Selesai!")
-    print(f"Kombinasi Hyperparameter Terbaik: {grid_search.best_params_}")
+    print(f"Kombinasi Hyperparameter Terbaik: {search.best_params_} (CV {search.best_score_:.2%}, {fits} fit)")
+
+    with timer.stage('evaluate'):
+        best_model = search.best_estimator_
+        y_pred = best_model.predict(X_test)
+        accuracy = accuracy_score(y_test, y_pred)
 
-    best_model = grid_search.best_estimator_
-    y_pred = best_model.predict(X_test)
-    accuracy = accuracy_score(y_test, y_pred)
-    
     print("\n" + "="*50)
     print("🎊 HASIL EVALUASI MODEL DENGAN ROLLING WINDOWS 🎊")
     print("="*50)
-    print(f"✅ Akurasi Model Final: {accuracy:.2%}")
+    print(f"✅ Akurasi Model Final (route holdout): {accuracy:.2%}")
     print("\nLaporan Klasifikasi Rinci:")
-    print(classification_report(y_test, y_pred))
-    
-    joblib.dump(best_model, 'activity_model.pkl')
-    print("\n💾 Model terbaik telah disimpan ke activity_model.pkl")
-    
-    end_time = time.time()
-    print(f"\n⏱️ Total waktu eksekusi: {end_time - start_time:.2f} detik")
+    print(classification_report(y_test, y_pred, zero_division=0))
+
+    # Atomic replace: the running server memory-maps the file and hot-reloads it
+    with timer.stage('save'):
+        save_artifact(best_model, args.output)
+    print(f"\n💾 Model terbaik telah disimpan ke {args.output}")
+
+    report = timer.report()
+    if args.report:
+        report.update({
+            'search': args.search,
+            'jobs': args.jobs,
+            'feature_cache_hit': cache_hit,
+            'candidates': len(search.cv_results_['params']),
+            'fits': fits,
+            'best_params': search.best_params_,
+            'cv_accuracy': float(search.best_score_),
+            'test_accuracy': float(accuracy)
+        })
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
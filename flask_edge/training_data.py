@@ -0,0 +1,235 @@
+# File: flask_edge/training_data.py
+# Training-data export for Smart GPS Tracker
+# Streams new gps_data rows into day/device-partitioned .npy column files and loads them back memory-mapped
+
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+import storage
+from route_segmenter import ROUTE_TIME_GAP
+
+# Export root (relative to flask_edge/, override with TRAINING_DATA_DIR)
+TRAINING_DATA_DIR = os.environ.get('TRAINING_DATA_DIR', 'training_data')
+CHECKPOINT_FILE = '_checkpoint.json'
+CHUNK_ROWS = 50_000
+ROUTE_GAP_SECONDS = ROUTE_TIME_GAP   # route_id matches the materialized routes (not the /routes default of 300)
+
+# Column -> dtype of the exported files (device_id and day live in the partition path)
+COLUMNS = {
+    'id': np.int64,
+    'timestamp': np.int64,
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'speed_mps': np.float64,
+    'activity_label': '<U16',
+    'is_anomaly': np.int8,
+}
+
+EXPORT_QUERY = '''
+    SELECT id, timestamp, latitude, longitude, speed, activity,
+           is_anomaly IN (1, X'01'), device_id
+    FROM gps_data
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+'''
+
+
+def _day(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+class TrainingDataExporter:
+    """
+    Incremental gps_data -> columnar export
+
+    Rows are read in id order, CHUNK_ROWS at a time (a rowid range scan), and
+    written as one part per (UTC day, device) of the chunk:
+
+        <root>/day=2025-06-08/device=esp32-1/part-000000012345/<column>.npy
+
+    After each chunk the high-water mark (last exported id) is saved in
+    <root>/_checkpoint.json, so the next run only reads newer rows. Part names
+    come from the first id they hold, so re-running an interrupted chunk
+    overwrites its parts instead of duplicating them.
+    """
+
+    def __init__(self, root=TRAINING_DATA_DIR, db_path=None, chunk_rows=CHUNK_ROWS):
+        self.root = root
+        self.db_path = db_path
+        self.chunk_rows = chunk_rows
+
+    def checkpoint(self):
+        path = os.path.join(self.root, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return {'last_id': 0, 'rows': 0, 'parts': 0}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_checkpoint(self, state):
+        path = os.path.join(self.root, CHECKPOINT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def _write_part(self, day, device_id, columns):
+        part_dir = os.path.join(self.root, f'day={day}', f"device={quote(device_id, safe='')}",
+                                f"part-{int(columns['id'][0]):012d}")
+        tmp_dir = part_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, values in columns.items():
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), values)
+        shutil.rmtree(part_dir, ignore_errors=True)
+        os.replace(tmp_dir, part_dir)
+
+    def _export_chunk(self, rows):
+        """Split one chunk by (day, device) and write its parts; returns the number of parts"""
+        partitions = {}
+        for row in rows:
+            partitions.setdefault((_day(row[1]), row[7]), []).append(row)
+        for (day, device_id), part_rows in partitions.items():
+            ids, timestamps, lats, lons, speeds, activities, anomalies, _ = zip(*part_rows)
+            self._write_part(day, device_id, {
+                'id': np.array(ids, dtype=COLUMNS['id']),
+                'timestamp': np.array(timestamps, dtype=COLUMNS['timestamp']),
+                'latitude': np.array(lats, dtype=COLUMNS['latitude']),
+                'longitude': np.array(lons, dtype=COLUMNS['longitude']),
+                # gps_data stores km/h (as sent by the ESP32); training features use m/s
+                'speed_mps': np.array([(s or 0) / 3.6 for s in speeds], dtype=COLUMNS['speed_mps']),
+                'activity_label': np.array([a or '' for a in activities], dtype=COLUMNS['activity_label']),
+                'is_anomaly': np.array(anomalies, dtype=COLUMNS['is_anomaly']),
+            })
+        return len(partitions)
+
+    def export(self, max_rows=None):
+        """
+        Export rows stored since the checkpoint
+
+        Args:
+            max_rows: Stop after about this many rows (None: until caught up)
+
+        Returns:
+            dict: Updated checkpoint plus rows/parts written by this run
+        """
+        os.makedirs(self.root, exist_ok=True)
+        state = self.checkpoint()
+        exported = parts = 0
+        start = time.perf_counter()
+        while max_rows is None or exported < max_rows:
+            with storage.connection(self.db_path) as conn:
+                rows = conn.execute(EXPORT_QUERY, (state['last_id'], self.chunk_rows)).fetchall()
+            if not rows:
+                break
+            chunk_parts = self._export_chunk(rows)
+            exported += len(rows)
+            parts += chunk_parts
+            state = {
+                'last_id': rows[-1][0],
+                'rows': state['rows'] + len(rows),
+                'parts': state['parts'] + chunk_parts,
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }
+            self._save_checkpoint(state)
+            print(f"📤 Export sampai id {state['last_id']}: +{len(rows)} baris, {chunk_parts} part")
+
+        elapsed = time.perf_counter() - start
+        print(f"✅ Export selesai: {exported} baris baru, {parts} part, {elapsed:.2f} s "
+              f"(total {state['rows']} baris, high-water mark id {state['last_id']})")
+        return {**state, 'exported_rows': exported, 'exported_parts': parts}
+
+
+def iter_parts(root=TRAINING_DATA_DIR, days=None, devices=None, columns=None):
+    """
+    Yield (day, device_id, {column: memmap}) for every exported part
+
+    Column files are opened with np.load(mmap_mode='r'): nothing is parsed and
+    pages are read only when touched.
+    """
+    columns = list(columns or COLUMNS)
+    if not os.path.isdir(root):
+        return
+    for day_dir in sorted(os.listdir(root)):
+        if not day_dir.startswith('day='):
+            continue
+        day = day_dir[4:]
+        if days is not None and day not in days:
+            continue
+        for device_dir in sorted(os.listdir(os.path.join(root, day_dir))):
+            device_id = unquote(device_dir[len('device='):])
+            if devices is not None and device_id not in devices:
+                continue
+            device_path = os.path.join(root, day_dir, device_dir)
+            for part in sorted(os.listdir(device_path)):
+                if not part.startswith('part-') or part.endswith('.tmp'):
+                    continue
+                part_path = os.path.join(device_path, part)
+                yield day, device_id, {
+                    name: np.load(os.path.join(part_path, f'{name}.npy'), mmap_mode='r') for name in columns
+                }
+
+
+def load_frame(root=TRAINING_DATA_DIR, days=None, devices=None, labeled_only=True, route_gap=ROUTE_GAP_SECONDS):
+    """
+    Exported points as a DataFrame shaped like activity_dataset.csv
+
+    Columns: the exported ones plus device_id and route_id. route_id splits
+    each device's points on gaps over route_gap seconds, so group-aware CV by
+    route works on production data too.
+    """
+    frames = []
+    for _, device_id, columns in iter_parts(root, days, devices):
+        frame = pd.DataFrame({name: np.asarray(values) for name, values in columns.items()})
+        frame['device_id'] = device_id
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=list(COLUMNS) + ['device_id', 'route_id'])
+
+    df = pd.concat(frames, ignore_index=True)
+    if labeled_only:
+        df = df[~df['activity_label'].isin(['', 'unknown'])]
+    df = df.sort_values(['device_id', 'timestamp', 'id'], ignore_index=True)
+
+    new_route = (df['device_id'] != df['device_id'].shift()) | (df['timestamp'].diff() > route_gap)
+    df['route_id'] = df['device_id'] + '#' + new_route.cumsum().astype(str)
+    return df
+
+
+def read_dataset(path):
+    """A training dataset: an exported directory (memory-mapped) or a CSV file"""
+    if os.path.isdir(path):
+        return load_frame(path)
+    return pd.read_csv(path)
+
+
+def fingerprint(path):
+    """Cheap identity of an exported directory: its checkpoint and part listing"""
+    entries = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            st = os.stat(os.path.join(root, name))
+            entries.append((os.path.relpath(os.path.join(root, name), path), st.st_size, st.st_mtime_ns))
+    return json.dumps(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export gps_data to partitioned .npy training data')
+    parser.add_argument('--db', default=None, help='SQLite database (default: GPS_DB_PATH)')
+    parser.add_argument('--out', default=TRAINING_DATA_DIR)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--max-rows', type=int, default=None)
+    args = parser.parse_args()
+    TrainingDataExporter(args.out, args.db, args.chunk_rows).export(args.max_rows)
+
+
+if __name__ == '__main__':
+    main()
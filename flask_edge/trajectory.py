@@ -0,0 +1,282 @@
+# File: flask_edge/trajectory.py
+# Trajectory compression for Smart GPS Tracker
+# Online dead-reckoning marks redundant points at ingest; Douglas-Peucker simplifies tracks for map responses
+
+import argparse
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import retention
+import storage
+from models.geo import douglas_peucker, haversine_m
+
+# A point within this distance of the dead-reckoned position is marked redundant
+INGEST_TOLERANCE_M = float(os.environ.get('GPS_INGEST_TOLERANCE_M', 10.0))
+# A key point at least this often, so a parked or straight-line device still leaves a trace
+MAX_KEY_GAP = 60
+MAX_DEVICES = 1024
+
+
+class DeadReckoner:
+    """
+    Online dead-reckoning compressor for one device
+
+    The last key point and the velocity measured when it was taken predict
+    where the device should be. A new point within `tolerance` meters of the
+    prediction is redundant. A point that breaks the prediction becomes a key
+    point, and so does the point before it (the corner), if that one was
+    marked redundant: classify() returns its stored id so the caller can
+    un-mark it. The caller reports each new point's id with stored().
+
+    Anomalies, activity changes, out-of-order points and MAX_KEY_GAP seconds
+    without a key point always give a key point.
+    """
+
+    def __init__(self, tolerance=INGEST_TOLERANCE_M, max_gap=MAX_KEY_GAP):
+        self.tolerance = tolerance
+        self.max_gap = max_gap
+        self.anchor = None         # (timestamp, lat, lon) of the last key point
+        self.velocity = (0.0, 0.0)  # Degrees per second (lat, lon)
+        self.activity = None
+        self.last = None           # (timestamp, lat, lon, redundant, stored id) of the last point seen
+        self.unstored = False      # last is a classified point whose id stored() has not reported yet
+        self.lock = threading.Lock()
+
+    def seed(self, points):
+        """Resume from stored points (id, timestamp, lat, lon, activity, redundant), oldest first"""
+        for point_id, timestamp, lat, lon, activity, redundant in points:
+            if redundant:
+                self.last = (timestamp, lat, lon, True, point_id)
+            else:
+                self._key(timestamp, lat, lon, activity)
+                self.stored(point_id)
+
+    def _key(self, timestamp, lat, lon, activity):
+        previous = self.last
+        if previous is not None and timestamp > previous[0] and activity == self.activity:
+            dt = timestamp - previous[0]
+            self.velocity = ((lat - previous[1]) / dt, (lon - previous[2]) / dt)
+        else:
+            self.velocity = (0.0, 0.0)
+        self.anchor = (timestamp, lat, lon)
+        self.activity = activity
+        self.last = (timestamp, lat, lon, False, None)
+        self.unstored = True
+
+    def classify(self, timestamp, lat, lon, activity=None, is_anomaly=False):
+        """
+        Decide whether the next point is redundant
+
+        Returns:
+            tuple: (redundant, promoted) where promoted is the stored id of the
+            previous point that must be stored as a key point again, or None
+        """
+        if self.last is not None and timestamp <= self.last[0]:
+            return False, None   # Back-filled point: keep, leave the state alone
+
+        if self.anchor is not None and not is_anomaly and activity == self.activity:
+            dt = timestamp - self.anchor[0]
+            if dt <= self.max_gap:
+                predicted_lat = self.anchor[1] + self.velocity[0] * dt
+                predicted_lon = self.anchor[2] + self.velocity[1] * dt
+                if float(haversine_m(predicted_lat, predicted_lon, lat, lon)) <= self.tolerance:
+                    self.last = (timestamp, lat, lon, True, None)
+                    self.unstored = True
+                    return True, None
+
+        previous = self.last
+        promoted = None
+        if previous is not None and previous[3]:
+            promoted = previous[4]
+            self.last = previous[:3] + (False, previous[4])
+        self._key(timestamp, lat, lon, activity)
+        return False, promoted
+
+    def stored(self, point_id):
+        """Record the id the point classify() just took in was stored under"""
+        if self.unstored:
+            self.last = self.last[:4] + (point_id,)
+            self.unstored = False
+
+
+_reckoners = OrderedDict()
+_reckoners_lock = threading.Lock()
+
+
+def get_reckoner(device_id=storage.DEFAULT_DEVICE_ID, path=None):
+    """
+    Process-wide DeadReckoner of a device (least recently used ones are dropped)
+
+    A new reckoner resumes from the device's newest key point and the points
+    stored after it.
+    """
+    with _reckoners_lock:
+        reckoner = _reckoners.get(device_id)
+        if reckoner is not None:
+            _reckoners.move_to_end(device_id)
+            return reckoner
+
+    reckoner = DeadReckoner()
+    with storage.connection(path) as conn:
+        # The newest key point, the point before it (its velocity) and the redundant tail after it
+        key = conn.execute('''
+            SELECT timestamp, id FROM gps_data
+            WHERE device_id = ? AND redundant = 0
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        ''', (device_id,)).fetchone() or (0, 0)
+        rows = conn.execute('''
+            SELECT id, timestamp, latitude, longitude, activity, redundant FROM gps_data
+            WHERE device_id = ? AND (timestamp, id) < (?, ?)
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        ''', (device_id,) + tuple(key)).fetchall()
+        rows += conn.execute('''
+            SELECT id, timestamp, latitude, longitude, activity, redundant FROM gps_data
+            WHERE device_id = ? AND (timestamp, id) >= (?, ?)
+            ORDER BY timestamp, id
+        ''', (device_id,) + tuple(key)).fetchall()
+    reckoner.seed(rows)
+
+    with _reckoners_lock:
+        reckoner = _reckoners.setdefault(device_id, reckoner)
+        _reckoners.move_to_end(device_id)
+        while len(_reckoners) > MAX_DEVICES:
+            _reckoners.popitem(last=False)
+        return reckoner
+
+
+def mark(device_id, timestamp, lat, lon, activity=None, is_anomaly=False):
+    """
+    Redundant flag for a point about to be stored, and the key point to restore
+
+    Report the inserted row's id with stored(); if the write fails or is
+    rolled back, forget() the device so its reckoner resumes from storage.
+
+    Returns:
+        tuple: (redundant, promoted id or None), see DeadReckoner.classify
+    """
+    reckoner = get_reckoner(device_id)
+    with reckoner.lock:
+        return reckoner.classify(timestamp, lat, lon, activity, is_anomaly)
+
+
+def stored(device_id, point_id):
+    """Record the id of the device's point marked last (after its insert)"""
+    with _reckoners_lock:
+        reckoner = _reckoners.get(device_id)
+    if reckoner is not None:
+        with reckoner.lock:
+            reckoner.stored(point_id)
+
+
+def forget(device_ids):
+    """Drop the reckoners of devices whose write failed (re-seeded from storage on next use)"""
+    with _reckoners_lock:
+        for device_id in device_ids:
+            _reckoners.pop(device_id, None)
+
+
+def promote(cursor, point_ids):
+    """Store points as key points again (in the transaction of the point that promoted them)"""
+    cursor.executemany('UPDATE gps_data SET redundant = 0 WHERE id = ?', [(point_id,) for point_id in point_ids])
+
+
+def simplify(rows, lat_index, lon_index, tolerance, group_index=None):
+    """
+    Douglas-Peucker over rows in track order (independently per group, e.g. device)
+
+    Returns:
+        list: The kept rows, in their original order
+    """
+    if not tolerance or len(rows) < 3:
+        return list(rows)
+    groups = {}
+    for i, row in enumerate(rows):
+        groups.setdefault(row[group_index] if group_index is not None else None, []).append(i)
+    keep = np.zeros(len(rows), dtype=bool)
+    for indexes in groups.values():
+        lats = [rows[i][lat_index] for i in indexes]
+        lons = [rows[i][lon_index] for i in indexes]
+        keep[np.asarray(indexes)[douglas_peucker(lats, lons, tolerance)]] = True
+    return [row for row, kept in zip(rows, keep) if kept]
+
+
+def route_polyline(conn, route, tolerance):
+    """
+    Simplified [[lat, lon], ...] of a route's points
+
+    With tolerance >= INGEST_TOLERANCE_M only key points (and the route's
+    endpoints) are read; archived months overlapping the route are read too.
+    """
+    where = 'device_id = ? AND timestamp >= ? AND timestamp <= ?'
+    params = [route['device_id'], route['start_time'], route['end_time']]
+    if tolerance >= INGEST_TOLERANCE_M:
+        where += ' AND (redundant = 0 OR id IN (?, ?))'
+        params += [route['start_point_id'], route['end_point_id']]
+    query = f'SELECT timestamp, id, latitude, longitude FROM gps_data WHERE {where}'
+
+    rows = conn.execute(query, params).fetchall()
+    for partition in retention.overlapping_partitions(conn, route['start_time'], route['end_time']):
+        archive = retention.get_partition_cache().open(partition)
+        try:
+            rows += archive.execute(query, params).fetchall()
+        finally:
+            archive.close()
+    rows.sort()
+    return [[row[2], row[3]] for row in simplify(rows, 2, 3, tolerance)]
+
+
+def backfill(path=None, tolerance=INGEST_TOLERANCE_M):
+    """
+    Mark redundant points among rows stored before compression existed
+
+    Replays every device's points in time order through a fresh DeadReckoner.
+    Rows thinned by retention downsampling are the track already: they stay
+    key points and are not replayed.
+
+    Returns:
+        dict: device_id -> (points, redundant)
+    """
+    summary = {}
+    with storage.connection(path) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        key_before = retention.downsampled_before(conn)
+        conn.execute('UPDATE gps_data SET redundant = 0 WHERE timestamp < ? AND redundant = 1', (key_before,))
+        devices = [row[0] for row in conn.execute('SELECT DISTINCT device_id FROM gps_data')]
+        for device_id in devices:
+            rows = conn.execute('''
+                SELECT id, timestamp, latitude, longitude, activity, is_anomaly IN (1, X'01') FROM gps_data
+                WHERE device_id = ? AND timestamp >= ?
+                ORDER BY timestamp, id
+            ''', (device_id, key_before)).fetchall()
+            reckoner = DeadReckoner(tolerance)
+            flags = {}
+            for row_id, timestamp, lat, lon, activity, is_anomaly in rows:
+                redundant, promoted = reckoner.classify(timestamp, lat, lon, activity, bool(is_anomaly))
+                reckoner.stored(row_id)
+                if promoted is not None:
+                    flags[promoted] = 0
+                flags[row_id] = 1 if redundant else 0
+            conn.executemany('UPDATE gps_data SET redundant = ? WHERE id = ?',
+                             [(flag, row_id) for row_id, flag in flags.items()])
+            summary[device_id] = (len(rows), sum(flags.values()))
+            print(f"🗜️ {device_id}: {summary[device_id][1]}/{len(rows)} titik redundant")
+    with _reckoners_lock:
+        _reckoners.clear()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mark redundant gps_data points (dead-reckoning compression)')
+    parser.add_argument('--db', default=None, help='SQLite database (default: GPS_DB_PATH)')
+    parser.add_argument('--tolerance', type=float, default=INGEST_TOLERANCE_M, help='Meters')
+    args = parser.parse_args()
+    backfill(args.db, args.tolerance)
+
+
+if __name__ == '__main__':
+    main()